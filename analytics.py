@@ -0,0 +1,299 @@
+"""Referral funnel and cohort reports computed with NumPy.
+
+Rows are never turned into ORM objects: each query selects only the
+columns a report needs, with timestamps already converted to epoch
+seconds by the database, and the columns become NumPy arrays. Referral
+codes become small integers (``self.codes``), so every grouping is one
+``np.bincount`` or ``np.unique`` pass.
+
+State is cached per process and only ever extended:
+
+- a user map (id, own code, referrer code, signup bucket). Users are
+  append-only, but ids do not become visible in order (concurrent
+  signups, batch imports, a lagging replica), so each refresh re-reads
+  the newest ``overlap`` ids and skips the ones already mapped, and every
+  ``reload_every`` seconds the whole table is re-read for stragglers
+  older than that;
+- one aggregate per time bucket of freeplay claims and bonus credits.
+  A bucket is final once it ended ``settle`` seconds ago and is then
+  never recomputed. Newer buckets are recomputed at most every
+  ``live_ttl`` seconds. A claim that failed to write is retried as a job
+  with its original timestamp, possibly long after ``settle``: while
+  ``pending()`` reports such a claim, the buckets from its timestamp on
+  are live again.
+
+A report over N days therefore costs the users registered since the
+last report, the rows of the newest buckets, and a few vector passes.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import Integer, cast, func, select
+
+
+def epoch(column, dialect):
+    if dialect == 'sqlite':
+        return cast(func.strftime('%s', column), Integer)
+    return cast(func.extract('epoch', column), Integer)
+
+
+class _Bucket:
+    # Claims grouped by the code entered, distinct claimers, claimers per
+    # signup cohort, and bonus credits grouped by the credited user's code
+    __slots__ = ('claim_codes', 'claims', 'rewards', 'claimers', 'cohorts', 'active', 'bonus_codes', 'bonuses')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+
+class ReferralAnalytics:
+    def __init__(self, db, user_model, entry_model, txn_model, bucket_seconds=86400, settle=300, live_ttl=30,
+                 overlap=1000, reload_every=3600, pending=None):
+        self.db = db
+        self.user_model = user_model
+        self.entry_model = entry_model
+        self.txn_model = txn_model
+        self.bucket_seconds = bucket_seconds
+        self.settle = settle
+        self.live_ttl = live_ttl
+        self.overlap = overlap
+        self.reload_every = reload_every
+        self.pending = pending  # -> timestamp of the earliest claim not yet written, or None
+        self.codes = []  # index -> referral code
+        self._code_index = {}
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._user_ids = np.zeros(0, np.int64)
+        self._own_code = np.zeros(0, np.int64)
+        self._referrer = np.zeros(0, np.int64)
+        self._signup = np.zeros(0, np.int64)
+        self._loaded_at = 0.0  # last full read of the users table
+        self._final = {}  # bucket -> _Bucket
+        self._live = {}  # bucket -> (computed_at, _Bucket)
+
+    # helpers
+
+    def _intern(self, values):
+        """Maps codes to indexes (None -> -1), growing the vocabulary."""
+        index = self._code_index
+        for code in set(values):
+            if code is not None and code not in index:
+                index[code] = len(self.codes)
+                self.codes.append(code)
+        return np.fromiter((index.get(code, -1) for code in values), np.int64, len(values))
+
+    def _columns(self, stmt):
+        # Core execution: plain tuples, none of the ORM's per-row loading
+        rows = self.db.session.connection().execute(stmt).all()
+        return list(zip(*rows)) if rows else None
+
+    def _users_of(self, user_ids):
+        # Row of each user id in the user map (-1 if unknown)
+        if not len(self._user_ids):
+            return np.full(len(user_ids), -1, np.int64)
+        pos = np.minimum(np.searchsorted(self._user_ids, user_ids), len(self._user_ids) - 1)
+        return np.where(self._user_ids[pos] == user_ids, pos, -1)
+
+    def bucket_of(self, when):
+        if isinstance(when, datetime):
+            when = when.replace(tzinfo=when.tzinfo or timezone.utc).timestamp()
+        return int(when // self.bucket_seconds)
+
+    def bucket_start(self, bucket):
+        return datetime.fromtimestamp(bucket * self.bucket_seconds, timezone.utc)
+
+    # incremental loading
+
+    def _refresh_users(self, dialect):
+        u = self.user_model
+        now = time.time()
+        stmt = select(u.id, u.referral_code, u.referrer_code, epoch(u.date_created, dialect))
+        full = now - self._loaded_at >= self.reload_every
+        if full:
+            self._loaded_at = now
+        elif len(self._user_ids):
+            stmt = stmt.where(u.id > int(self._user_ids[-1]) - self.overlap)
+        cols = self._columns(stmt.order_by(u.id))
+        if cols is None:
+            return
+        ids = np.array(cols[0], np.int64)
+        new = self._users_of(ids) < 0
+        if not new.any():
+            return
+        keep = np.nonzero(new)[0]
+        late = len(self._user_ids) and ids[keep[0]] < self._user_ids[-1]
+        ids = ids[keep]
+        own, referrer, created = ([col[i] for i in keep] for col in cols[1:])
+        signup = np.array([c if c is not None else 0 for c in created], np.int64) // self.bucket_seconds
+        user_ids = np.concatenate([self._user_ids, ids])
+        order = np.argsort(user_ids, kind='stable')
+        self._user_ids = user_ids[order]
+        self._own_code = np.concatenate([self._own_code, self._intern(own)])[order]
+        self._referrer = np.concatenate([self._referrer, self._intern(referrer)])[order]
+        self._signup = np.concatenate([self._signup, signup])[order]
+        if full and late:
+            # Cached buckets may have dropped these users' claims and bonuses
+            self._final.clear()
+            self._live.clear()
+
+    def _compute(self, first, last, dialect):
+        """Aggregates for buckets first..last, one query per table."""
+        e, t = self.entry_model, self.txn_model
+        # Filter on the raw columns so their indexes apply; convert in the select
+        lo, hi = self.bucket_start(first).replace(tzinfo=None), self.bucket_start(last + 1).replace(tzinfo=None)
+        buckets = {}
+        cols = self._columns(select(e.user_id, e.referral_code, e.reward, epoch(e.timestamp, dialect))
+                             .where(e.timestamp >= lo, e.timestamp < hi))
+        if cols is not None:
+            users, codes, rewards, stamps = cols
+            users = np.array(users, np.int64)
+            codes = self._intern(codes)
+            rewards = np.array(rewards, np.float64)
+            which = np.array(stamps, np.int64) // self.bucket_seconds
+            order = np.argsort(which, kind='stable')
+            bounds = np.searchsorted(which[order], np.arange(first, last + 2))
+            for i, b in enumerate(range(first, last + 1)):
+                sel = order[bounds[i]:bounds[i + 1]]
+                if not len(sel):
+                    continue
+                agg = buckets[b] = _Bucket()
+                agg.claim_codes, inverse = np.unique(codes[sel], return_inverse=True)
+                agg.claims = np.bincount(inverse)
+                agg.rewards = np.bincount(inverse, weights=rewards[sel])
+                agg.claimers = np.unique(users[sel])
+                rows = self._users_of(agg.claimers)
+                agg.cohorts, agg.active = np.unique(self._signup[rows[rows >= 0]], return_counts=True)
+        cols = self._columns(select(t.user_id, t.amount, epoch(t.timestamp, dialect))
+                             .where(t.type == 'bonus', t.timestamp >= lo, t.timestamp < hi))
+        if cols is not None:
+            users, amounts, stamps = (np.array(c) for c in cols)
+            rows = self._users_of(users.astype(np.int64))
+            which = stamps.astype(np.int64) // self.bucket_seconds
+            for b in np.unique(which):
+                sel = (which == b) & (rows >= 0)
+                agg = buckets.setdefault(int(b), _Bucket())
+                agg.bonus_codes, inverse = np.unique(self._own_code[rows[sel]], return_inverse=True)
+                agg.bonuses = np.bincount(inverse, weights=amounts[sel].astype(np.float64))
+        return buckets
+
+    def _buckets(self, first, last):
+        dialect = self.db.session.get_bind().dialect.name
+        self._refresh_users(dialect)
+        now = time.time()
+        settled = self.bucket_of(now - self.settle) - 1  # last bucket that can no longer change
+        earliest = self.pending() if self.pending is not None else None
+        if earliest is not None:
+            settled = min(settled, self.bucket_of(earliest) - 1)
+            for b in [b for b in self._final if b > settled]:
+                del self._final[b]  # the late claim will land in it
+        missing = [b for b in range(first, min(last, settled) + 1) if b not in self._final]
+        if missing:
+            computed = self._compute(missing[0], missing[-1], dialect)
+            for b in missing:
+                self._final[b] = computed.get(b)
+        live_first = max(first, settled + 1)
+        if live_first <= last:
+            stale = [b for b in range(live_first, last + 1)
+                     if now - self._live.get(b, (0, None))[0] > self.live_ttl]
+            if stale:
+                computed = self._compute(stale[0], stale[-1], dialect)
+                for b in stale:
+                    self._live[b] = (now, computed.get(b))
+            for b in [b for b in self._live if b <= settled]:
+                del self._live[b]  # now final; recomputed once above
+        return {b: (self._final[b] if b <= settled else self._live[b][1]) for b in range(first, last + 1)}
+
+    # reports
+
+    def report(self, start, end, top=50, code=None):
+        """Funnel per referral code (the ``top`` by signups), daily totals
+        and signup cohorts for buckets ``start`` to ``end`` (datetimes,
+        inclusive). With ``code`` every figure is limited to that code
+        and cohorts are omitted."""
+        first, last = self.bucket_of(start), self.bucket_of(end)
+        with self._lock:
+            buckets = self._buckets(first, last)
+            return self._report(first, last, buckets, top, code)
+
+    def _report(self, first, last, buckets, top, code):
+        n_codes, n_days = len(self.codes), last - first + 1
+        only = self._code_index.get(code, -2) if code is not None else None
+        present = [(b - first, agg) for b, agg in buckets.items() if agg is not None]
+
+        def per_code(field, values):
+            # Sums a per-bucket (code indexes, values) pair into code totals and a day series
+            totals, daily = np.zeros(n_codes), np.zeros(n_days)
+            for offset, agg in present:
+                idx, vals = getattr(agg, field), getattr(agg, values)
+                if idx is None:
+                    continue
+                keep = idx >= 0 if only is None else idx == only
+                totals += np.bincount(idx[keep], weights=vals[keep], minlength=n_codes)
+                daily[offset] = vals[keep].sum()
+            return totals, daily
+
+        claims, claims_daily = per_code('claim_codes', 'claims')
+        rewards, rewards_daily = per_code('claim_codes', 'rewards')
+        bonuses, bonuses_daily = per_code('bonus_codes', 'bonuses')
+
+        # Funnel: users referred by a code who signed up in the range, how
+        # many of them claimed within it, and how many referred users
+        # (whenever they signed up) were active in it
+        claimed = np.zeros(len(self._user_ids), bool)
+        claimers = [agg.claimers for _, agg in present if agg.claimers is not None]
+        if claimers:
+            rows = self._users_of(np.unique(np.concatenate(claimers)))
+            claimed[rows[rows >= 0]] = True
+        referred = self._referrer >= 0 if only is None else self._referrer == only
+        signed = referred & (self._signup >= first) & (self._signup <= last)
+        signups = np.bincount(self._referrer[signed], minlength=n_codes)
+        converted = np.bincount(self._referrer[signed & claimed], minlength=n_codes)
+        active = np.bincount(self._referrer[referred & claimed], minlength=n_codes)
+        signups_daily = np.bincount(self._signup[signed] - first, minlength=n_days)
+
+        ranked = np.lexsort((-claims, -signups))
+        ranked = ranked[(signups[ranked] > 0) | (claims[ranked] > 0) | (bonuses[ranked] > 0)][:top]
+        funnel = [{
+            "code": self.codes[i], "signups": int(signups[i]), "converted": int(converted[i]),
+            "conversion": round(converted[i] / signups[i], 4) if signups[i] else None,
+            "active_referred": int(active[i]), "claims": int(claims[i]), "rewards": round(float(rewards[i]), 2),
+            "bonuses": round(float(bonuses[i]), 2), "payouts": round(float(rewards[i] + bonuses[i]), 2),
+        } for i in ranked]
+
+        # Cohorts (all users, not per code): signups per bucket, and how
+        # many of them claimed 0, 1, 2... buckets later
+        cohorts = []
+        if only is None:
+            in_range = (self._signup >= first) & (self._signup <= last)
+            sizes = np.bincount(self._signup[in_range] - first, minlength=n_days)
+            matrix = np.zeros((n_days, n_days), np.int64)
+            for offset, agg in present:
+                if agg.cohorts is None:
+                    continue
+                keep = (agg.cohorts >= first) & (agg.cohorts <= first + offset)
+                matrix[agg.cohorts[keep] - first, first + offset - agg.cohorts[keep]] = agg.active[keep]
+            cohorts = [{"cohort": self.bucket_start(first + d).date().isoformat(), "size": int(sizes[d]),
+                        "active": matrix[d, :n_days - d].tolist()} for d in np.nonzero(sizes)[0]]
+
+        return {
+            "bucket_seconds": self.bucket_seconds,
+            "from": self.bucket_start(first).isoformat(), "to": self.bucket_start(last + 1).isoformat(),
+            "totals": {"signups": int(signups.sum()), "claims": int(claims.sum()),
+                       "rewards": round(float(rewards.sum()), 2), "bonuses": round(float(bonuses.sum()), 2)},
+            "daily": {
+                "dates": [self.bucket_start(b).date().isoformat() for b in range(first, last + 1)],
+                "signups": signups_daily.tolist(), "claims": claims_daily.astype(np.int64).tolist(),
+                "rewards": np.round(rewards_daily, 2).tolist(), "bonuses": np.round(bonuses_daily, 2).tolist(),
+            },
+            "funnel": funnel,
+            "cohorts": cohorts,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._reset()
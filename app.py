@@ -1,55 +1,109 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, Response
+from flask import Flask, Blueprint, request, jsonify, render_template, redirect, url_for, Response, stream_with_context, session, send_file, current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user, UserMixin
 from flask_cors import CORS
 import os
-import csv
-import stripe
-import paypalrestsdk
-from io import StringIO
+import click
+import time
 from dotenv import load_dotenv
-from werkzeug.security import generate_password_hash, check_password_hash
-from waitress import serve
-from datetime import datetime
+from datetime import datetime, timedelta
+from leaderboard import Leaderboard
+import kyc_export
+from pagination import CountCache, date_bounds, keyset_page, page_size
+from passwords import HasherBusy, PasswordHasher
+from user_cache import IdentityCache
+import ledger
+from write_behind import WriteBehindQueue
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.orm.exc import StaleDataError
+import functools
+import json
+from broker import Broker, PostgresRelay, SocketRelay
+import tempfile
+from jinja2 import FileSystemBytecodeCache
+from render_cache import RenderCache
+from static_assets import StaticAssets
+from conditional import ConditionalJSON
+import hashlib
+import hmac
+from referral_codes import CodeAllocator
+from referral_graph import ReferralGraph
+import user_import
+from metrics import Metrics
+import uploads
+from search import SearchIndex
+from werkzeug.exceptions import RequestEntityTooLarge
+import jobs
+import mailer
+import secrets
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from db_routing import ReplicaRouter, RoutingSession, pool_options, replica_binds
+import schema
 
 # Load environment variables
 load_dotenv()
 
-# Flask App Config
-app = Flask(__name__)
-app.secret_key = os.getenv('SECRET_KEY', 'default_secret_key')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI', 'sqlite:///referrals.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-CORS(app)
-
-# Stripe & PayPal Config
-stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
-paypalrestsdk.configure({
-    "mode": "sandbox",
-    "client_id": os.getenv('PAYPAL_CLIENT_ID'),
-    "client_secret": os.getenv('PAYPAL_CLIENT_SECRET')
-})
+# Extensions are created unbound and attached to the app in configure_app()
+
+# Per-route timing and SQL accounting, scraped at /metrics. Workers share
+# totals through METRICS_DIR (under gunicorn a temporary directory if unset)
+# so any worker reports the whole server.
+metrics = Metrics(directory=os.getenv('METRICS_DIR'),
+                  n_plus_one=int(os.getenv('N_PLUS_ONE_THRESHOLD', '10')))
+
+# Templates: anonymous pages are cached rendered, static URLs are
+# content-hash fingerprinted. Cached pages embed those URLs, so a changed
+# static file drops them.
+render_cache = RenderCache(maxsize=int(os.getenv('RENDER_CACHE_SIZE', '256')))
+static_assets = StaticAssets()
+static_assets.on_change(render_cache.invalidate)
+api_cache = ConditionalJSON(min_size=int(os.getenv('API_GZIP_MIN_BYTES', '1024')))
+
+# Password hashing runs on a bounded pool; see passwords.py for tuning
+hasher = PasswordHasher.from_env()
 
 # Initialize DB & Auth
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+# Views marked @db_router.read_only read from SQLALCHEMY_REPLICA_URIS
+# when configured; see db_routing.py
+db_router = ReplicaRouter(db, pin_seconds=float(os.getenv('REPLICA_PIN_SECONDS', '5')),
+                          check_interval=float(os.getenv('REPLICA_CHECK_INTERVAL', '5')),
+                          retry_after=float(os.getenv('REPLICA_RETRY_AFTER', '30')),
+                          max_lag=float(os.getenv('REPLICA_MAX_LAG', '10')))
+login_manager = LoginManager()
+login_manager.login_view = 'pages.login'
 
 # Models
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(150), unique=True, nullable=False)
-    password = db.Column(db.String(150), nullable=False)
+    password = db.Column(db.String(255), nullable=False)
     referral_code = db.Column(db.String(50), unique=True)
-    referrer_code = db.Column(db.String(50))
-    balance = db.Column(db.Float, default=0.0)
-    date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
+    referrer_code = db.Column(db.String(50), index=True)
+    balance = db.Column(db.Float, default=0.0, index=True)
+    date_created = db.Column(db.DateTime, default=db.func.current_timestamp(), index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    version_id = db.Column(db.Integer, nullable=False)
+    email_confirmed_at = db.Column(db.DateTime)
+
+    # Every UPDATE bumps version_id and fails if the row moved underneath us
+    __mapper_args__ = {'version_id_col': version_id}
 
     def set_password(self, password):
-        self.password = generate_password_hash(password)
+        with metrics.section('hash'):
+            self.password = hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        # Re-hashes with the configured cost on success; caller commits.
+        with metrics.section('hash'):
+            ok = hasher.verify(self.password, password)
+        if not ok:
+            return False
+        if hasher.needs_rehash(self.password):
+            self.set_password(password)
+        return True
 
 class KYCSubmission(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -58,44 +112,360 @@ class KYCSubmission(db.Model):
     phone = db.Column(db.String(100))
     country = db.Column(db.String(100))
     wallet_or_ssn = db.Column(db.String(150))
-    id_file = db.Column(db.String(255))
-    date = db.Column(db.String(100))
+    id_file = db.Column(db.String(255))  # path inside the upload store
+    id_file_hash = db.Column(db.String(64), index=True)  # sha256 of the document
+    date = db.Column(db.String(100), index=True)
+
+    __table_args__ = (db.Index('ix_kyc_submission_country_id', 'country', 'id'),)
 
 class FreeplayEntry(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer)
     referral_code = db.Column(db.String(50))
-    reward = db.Column(db.Float)
+    reward = db.Column(db.Float, index=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class Transaction(db.Model):
+    # Append-only balance ledger; User.balance is a running total of it
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    amount = db.Column(db.Float, nullable=False)
+    type = db.Column(db.String(50))  # e.g., freeplay, bonus, adjustment
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (db.Index('ix_transaction_type_timestamp', 'type', 'timestamp'),)
+
+class LeaderboardEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    entry_id = db.Column(db.Integer, unique=True)
+    user_id = db.Column(db.Integer)
+    referral_code = db.Column(db.String(50))
+    reward = db.Column(db.Float, index=True)
+    timestamp = db.Column(db.DateTime)
+
+class ReferralClosure(db.Model):
+    # One row per (ancestor, descendant) pair in the referral tree, self included
+    ancestor_id = db.Column(db.Integer, primary_key=True)
+    descendant_id = db.Column(db.Integer, primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (db.Index('ix_referral_closure_descendant_depth', 'descendant_id', 'depth'),)
+
+class ReferralStats(db.Model):
+    # Downline rollup per ancestor and depth; see referral_graph.py
+    ancestor_id = db.Column(db.Integer, primary_key=True)
+    depth = db.Column(db.Integer, primary_key=True)
+    members = db.Column(db.Integer, nullable=False, default=0)
+    earnings = db.Column(db.Float, nullable=False, default=0.0)
+
+class Job(db.Model):
+    # Durable background work (emails, bonuses, exports); see jobs.py
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime, nullable=False)
+    locked_by = db.Column(db.String(100))
+    locked_until = db.Column(db.DateTime)
+    dedupe_key = db.Column(db.String(100), unique=True)
+    last_error = db.Column(db.Text)
+    result = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'),)
+
+class JobData(db.Model):
+    # Bulk input or output of a job (user imports, KYC exports), kept in
+    # the database: the web and jobs services share nothing else
+    token = db.Column(db.String(32), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+# Admin search; the indexes are kept in sync by the database (see search.py)
+kyc_search = SearchIndex(db, KYCSubmission, ('full_name', 'email', 'phone', 'country'), weights=(4, 4, 2, 1))
+user_search = SearchIndex(db, User, ('email', 'referral_code'))
+
+# KYC documents: content-addressed on disk, previews rendered off-request
+kyc_store = uploads.ContentStore(os.getenv('UPLOAD_DIR', 'uploads'),
+                                 max_bytes=int(os.getenv('KYC_MAX_UPLOAD_MB', '10')) * 1024 * 1024)
+previews = uploads.PreviewPool(kyc_store, workers=int(os.getenv('THUMBNAIL_WORKERS', '2')))
+
+admin_counts = CountCache(ttl=float(os.getenv('ADMIN_COUNT_TTL', '30')))
+
+code_allocator = CodeAllocator.for_db(db)
+
+referrals = ReferralGraph(db, User, ReferralClosure, ReferralStats)
+
+importer = user_import.UserImporter(db, User, hasher, code_allocator, referrals,
+                                    chunk_size=int(os.getenv('USER_IMPORT_CHUNK', '1000')))
+
+leaderboard = Leaderboard(db, FreeplayEntry, LeaderboardEntry,
+                          size=int(os.getenv('LEADERBOARD_SIZE', '10')))
+
+user_cache = IdentityCache(User, maxsize=int(os.getenv('USER_CACHE_SIZE', '1024')),
+                           ttl=float(os.getenv('USER_CACHE_TTL', '60')),
+                           sync_interval=float(os.getenv('USER_CACHE_SYNC_INTERVAL', '2')))
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Rows written by other processes (the job worker's bonus credits,
+    # a reset handled by another worker) drop out within sync_interval
+    with db_router.use_primary():
+        user_cache.sync(db.session)
+    user = user_cache.get(db.session, int(user_id), session.get('_user_version'))
+    if user is None:
+        user = db.session.get(User, int(user_id))
+        if user is not None and user.version_id < session.get('_user_version', 0):
+            # A replica that has not replayed this client's own write yet
+            with db_router.use_primary():
+                user = db.session.get(User, int(user_id), populate_existing=True)
+        if user is not None:
+            user_cache.put(user_cache.snapshot(user))
+    return user
+
+def commit_user(user, **fresh):
+    # Snapshot after flush (new version_id, before commit expires the row)
+    # so the cache and the client's session both carry the written version.
+    # ``fresh`` overrides columns that were changed by SQL-side updates.
+    db.session.flush()
+    values = user_cache.snapshot(user)
+    values.update(fresh)
+    db.session.commit()
+    remember_user(values)
+
+def remember_user(values):
+    user_cache.put(values)
+    session['_user_version'] = values['version_id']
+
+def record_freeplay(items):
+    # Writes the claims without committing; returns ({user_id: (balance,
+    # version)}, whether the leaderboard changed).
+    entries = db.session.scalars(
+        insert(FreeplayEntry).returning(FreeplayEntry, sort_by_parameter_order=True), items).all()
+    placed = leaderboard.record_many(entries)
+    credited = ledger.credit_many(db, User, Transaction, [
+        (e.user_id, e.reward, 'freeplay', e.timestamp) for e in entries])
+    earned = {}
+    for e in entries:
+        earned[e.user_id] = earned.get(e.user_id, 0.0) + e.reward
+    for user_id, amount in sorted(earned.items()):
+        referrals.add_earnings(user_id, amount)
+    return credited, placed
+
+def announce_freeplay(credited, placed):
+    # After the claims' commit: drop stale caches, push the new balances
+    leaderboard.invalidate()
+    for user_id, (balance, _) in credited.items():
+        user_cache.invalidate(user_id)
+        broker.publish(f'user:{user_id}', json.dumps({"balance": balance}))
+    if placed:
+        publish_leaderboard()
+
+def flush_freeplay(items):
+    # Group commit: every queued claim lands in one transaction.
+    credited, placed = record_freeplay(items)
+    db.session.commit()
+    announce_freeplay(credited, placed)
+    return [credited[item['user_id']] for item in items]
+
+def park_freeplay(items, error):
+    # Async claims were acknowledged before they were written: a claim that
+    # fails becomes a job, retried by the worker and left dead (see
+    # /api/admin/jobs) if it keeps failing, rather than only logged.
+    for item in items:
+        job_queue.enqueue('freeplay_claim', dict(item, timestamp=item['timestamp'].isoformat()))
+    db.session.commit()
+
+# Server-sent events fan-out; see /api/stream. Each process has its own
+# broker and the relay (see stream_relay) carries publishes to the others,
+# including the job workers' credits. Under gunicorn, configure_stream
+# fits both settings to the worker class.
+STREAM_ENABLED = os.getenv('STREAM_ENABLED', '1') == '1'
+broker = Broker(max_subscribers=int(os.getenv('STREAM_MAX_SUBSCRIBERS', '1000')))
+
+def configure_stream(worker_class, threads):
+    # Each open stream holds a worker thread: a sync worker would be held
+    # whole until its timeout, so no stream there; a threaded worker
+    # keeps half of its threads for other requests unless
+    # STREAM_MAX_SUBSCRIBERS says otherwise.
+    global STREAM_ENABLED
+    if worker_class == 'sync':
+        STREAM_ENABLED = False
+    elif 'STREAM_MAX_SUBSCRIBERS' not in os.environ:
+        broker.max_subscribers = max(1, threads // 2)
+
+def stream_relay(database_uri):
+    # STREAM_RELAY=postgres|socket|off; the default follows the database
+    kind = os.getenv('STREAM_RELAY') or ('postgres' if database_uri.startswith('postgres') else 'socket')
+    if kind == 'postgres':
+        return PostgresRelay(database_uri)
+    if kind == 'socket':
+        return SocketRelay(os.getenv('STREAM_RELAY_DIR', os.path.join(tempfile.gettempdir(), 'sportzino-stream')))
+    return None
+
+def publish_leaderboard():
+    # Payloads are published pre-serialized so fan-out never re-encodes.
+    broker.publish('leaderboard', leaderboard.snapshot()[0].decode())
+
+freeplay_writer = WriteBehindQueue(
+    flush_freeplay,
+    mode=os.getenv('FREEPLAY_WRITE_MODE', 'sync'),
+    max_batch=int(os.getenv('FREEPLAY_BATCH_SIZE', '200')),
+    max_delay=float(os.getenv('FREEPLAY_BATCH_DELAY_MS', '50')) / 1000,
+    on_failure=park_freeplay, transient=(OperationalError,))
+
+# Background jobs: `flask jobs-worker` runs them; SMTP_* configures mail
+# (python smtp_sink.py accepts it locally)
+job_queue = jobs.JobQueue(db, Job, max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', '5')),
+                          backoff=float(os.getenv('JOB_RETRY_BACKOFF', '30')))
+mail = mailer.Mailer.from_env()
+REFERRAL_BONUS = float(os.getenv('REFERRAL_BONUS', '0'))
+JOB_DATA_CHUNK_BYTES = int(os.getenv('JOB_DATA_CHUNK_BYTES', str(1024 * 1024)))
+
+def store_job_data(token, stream):
+    # Returns the number of chunks written
+    seq = 0
+    while data := stream.read(JOB_DATA_CHUNK_BYTES):
+        db.session.add(JobData(token=token, seq=seq, data=data))
+        seq += 1
+    return seq
+
+def iter_job_data(token, chunks):
+    # One chunk in memory at a time
+    for seq in range(chunks):
+        yield db.session.scalar(db.select(JobData.data).where(JobData.token == token, JobData.seq == seq))
+
+def email_token(purpose):
+    return URLSafeTimedSerializer(current_app.secret_key, salt=purpose)
+
+def external_url(endpoint, **values):
+    # Workers have no request to take the host from
+    with current_app.test_request_context(base_url=os.getenv('PUBLIC_URL', 'http://localhost:5000')):
+        return url_for(endpoint, _external=True, **values)
 
-# Routes
-@app.route('/')
+def activation_email(user):
+    url = external_url('pages.activate', token=email_token('activate').dumps(user.id))
+    return mail.message(user.email, "Confirm your email", render_template('email/activate.html', confirm_url=url))
+
+def password_fingerprint(user):
+    # Keyed digest of the stored hash: the token is signed, not encrypted,
+    # so it must not carry any part of the hash itself
+    key = current_app.secret_key
+    key = key.encode() if isinstance(key, str) else key
+    return hmac.new(key, user.password.encode(), hashlib.sha256).hexdigest()[:32]
+
+def reset_email(user):
+    # The token carries a fingerprint of the current hash, so it stops
+    # working once the password is changed
+    token = email_token('reset').dumps([user.id, password_fingerprint(user)])
+    url = external_url('pages.reset_password', token=token)
+    return mail.message(user.email, "Reset your password", render_template('email/reset_password.html', reset_url=url))
+
+def send_user_emails(payloads, build):
+    # One query for the recipients, one pooled SMTP connection for the batch
+    users = {u.id: u for u in db.session.scalars(db.select(User).where(User.id.in_([p['user_id'] for p in payloads])))}
+    outcomes, messages, slots = [None] * len(payloads), [], []
+    for i, payload in enumerate(payloads):
+        user = users.get(payload['user_id'])
+        if user is not None:  # deleted since: nothing to send
+            messages.append(build(user))
+            slots.append(i)
+    for i, error in zip(slots, mail.send_many(messages)):
+        outcomes[i] = jobs.PermanentFailure(str(error)) if mailer.is_permanent(error) else error
+    return outcomes
+
+job_queue.handler('activation_email', batch=True)(lambda payloads: send_user_emails(payloads, activation_email))
+job_queue.handler('reset_email', batch=True)(lambda payloads: send_user_emails(payloads, reset_email))
+
+@job_queue.handler('referral_bonus')
+def credit_referral_bonus(payload):
+    # Commits together with the job's DONE mark, so it is credited once
+    referrer_id, amount = payload['referrer_id'], payload['amount']
+    balance, _ = ledger.credit(db, User, Transaction, referrer_id, amount, 'bonus')
+    referrals.add_earnings(referrer_id, amount)
+    user_cache.invalidate(referrer_id)
+    job_queue.after_commit(lambda: broker.publish(f'user:{referrer_id}', json.dumps({"balance": balance})))
+    return {"credited": amount}
+
+@job_queue.handler('freeplay_claim')
+def retry_freeplay_claim(payload):
+    # Commits together with the job's DONE mark, so it is credited once
+    credited, placed = record_freeplay([dict(payload, timestamp=datetime.fromisoformat(payload['timestamp']))])
+    job_queue.after_commit(lambda: announce_freeplay(credited, placed))
+    return {"balance": credited[payload['user_id']][0]}
+
+@job_queue.handler('kyc_export')
+def export_kyc_csv(payload):
+    # The chunks commit together with the job's DONE mark: a failed
+    # attempt leaves nothing behind for the next one to trip over
+    name = f"kyc-{payload['token']}.csv" + ('.gz' if payload.get('gzip') else '')
+    chunks = kyc_export.iter_csv(db, KYCSubmission, chunk_size=int(os.getenv('KYC_EXPORT_CHUNK', '1000')),
+                                 **payload.get('filters', {}))
+    if payload.get('gzip'):
+        chunks = kyc_export.gzip_stream(chunks)
+    buf, seq, size = bytearray(), 0, 0
+    for chunk in chunks:
+        buf += chunk if isinstance(chunk, bytes) else chunk.encode()
+        while len(buf) >= JOB_DATA_CHUNK_BYTES:
+            db.session.add(JobData(token=payload['token'], seq=seq, data=bytes(buf[:JOB_DATA_CHUNK_BYTES])))
+            del buf[:JOB_DATA_CHUNK_BYTES]
+            seq, size = seq + 1, size + JOB_DATA_CHUNK_BYTES
+    if buf or not seq:
+        db.session.add(JobData(token=payload['token'], seq=seq, data=bytes(buf)))
+        seq, size = seq + 1, size + len(buf)
+    return {"file": name, "token": payload['token'], "chunks": seq, "bytes": size}
+
+@job_queue.handler('user_import')
+def run_user_import(payload):
+    # The stored upload holds plain-text passwords: it goes whether the
+    # import succeeds or not
+    upload = db.delete(JobData).where(JobData.token == payload['token'])
+    stream = user_import.chunk_stream(iter_job_data(payload['token'], payload['chunks']))
+    try:
+        report = importer.run(user_import.iter_records(stream, payload['format']))
+    except Exception:
+        db.session.rollback()
+        db.session.execute(upload)
+        db.session.commit()
+        raise
+    db.session.execute(upload)
+    return report
+
+# Pages
+pages = Blueprint('pages', __name__)
+
+@pages.route('/')
 def home():
-    return render_template('index.html')
+    # Only signed-in visitors have a balance to keep live
+    return render_cache.render('index.html', live_balance=STREAM_ENABLED and current_user.is_authenticated)
 
-@app.route('/login', methods=['GET', 'POST'])
+@pages.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form['email']
         password = request.form['password']
         user = User.query.filter_by(email=email).first()
-        if user and user.check_password(password):
+        try:
+            ok = user is not None and user.check_password(password)
+        except HasherBusy:
+            return render_template('login.html', error="Server busy, please retry."), 503, {'Retry-After': '1'}
+        if ok:
+            commit_user(user)
             login_user(user)
-            return redirect(url_for('freeplay'))
+            return redirect(url_for('pages.freeplay'))
         return render_template('login.html', error="Invalid credentials")
     return render_template('login.html')
 
-@app.route('/logout')
+@pages.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('pages.login'))
 
-@app.route('/register', methods=['GET', 'POST'])
+@pages.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         email = request.form['email']
@@ -103,42 +473,161 @@ def register():
         if User.query.filter_by(email=email).first():
             return render_template('register.html', error="Email already registered.")
         user = User(email=email)
-        user.set_password(password)
-        user.referral_code = email.split('@')[0] + str(int(datetime.utcnow().timestamp()))
+        try:
+            user.set_password(password)
+        except HasherBusy:
+            return render_template('register.html', error="Server busy, please retry."), 503, {'Retry-After': '1'}
+        user.referral_code = code_allocator.allocate()
+        referrer = None
+        referred_by = request.form.get('referral_code')
+        if referred_by:
+            referrer = db.session.scalar(db.select(User.id).filter_by(referral_code=referred_by))
+            if referrer is not None:
+                user.referrer_code = referred_by
         db.session.add(user)
-        db.session.commit()
+        db.session.flush()
+        referrals.add_user(user.id, referrer)
+        # Queued in the registration transaction; sent by the job workers
+        job_queue.enqueue('activation_email', {'user_id': user.id})
+        if referrer is not None and REFERRAL_BONUS > 0:
+            job_queue.enqueue('referral_bonus', {'referrer_id': referrer, 'user_id': user.id, 'amount': REFERRAL_BONUS},
+                              dedupe_key=f'referral_bonus:{user.id}')
+        commit_user(user)
         login_user(user)
-        return redirect(url_for('freeplay'))
+        return redirect(url_for('pages.freeplay'))
     return render_template('register.html')
 
-@app.route('/freeplay')
+@pages.route('/activate/<token>')
+def activate(token):
+    try:
+        user_id = email_token('activate').loads(token, max_age=int(os.getenv('ACTIVATION_TOKEN_TTL', '259200')))
+    except BadSignature:
+        return jsonify({"error": "Invalid or expired link"}), 400
+    user = db.session.get(User, user_id)
+    if user is None:
+        return jsonify({"error": "Invalid or expired link"}), 400
+    if user.email_confirmed_at is None:
+        user.email_confirmed_at = datetime.utcnow()
+        db.session.commit()
+        user_cache.invalidate(user.id)
+    return redirect(url_for('pages.freeplay'))
+
+def reset_user(token):
+    # The user a reset link is for; None if it is invalid, expired or used
+    try:
+        user_id, fingerprint = email_token('reset').loads(token, max_age=int(os.getenv('RESET_TOKEN_TTL', '3600')))
+    except (BadSignature, ValueError):
+        return None
+    user = db.session.get(User, user_id)
+    if user is None or not hmac.compare_digest(password_fingerprint(user), str(fingerprint)):
+        return None
+    return user
+
+@pages.route('/reset-password/<token>', methods=['GET', 'POST'])
+def reset_password(token):
+    # The emailed link (GET) shows the form; POST sets the password, from
+    # that form or as JSON
+    def reply(status, error=None, headers=None, **context):
+        if request.is_json:
+            return jsonify({"error": error} if error else {"status": "password updated"}), status, headers
+        return render_template('reset_password.html', token=token, error=error, **context), status, headers
+
+    user = reset_user(token)
+    if user is None:
+        return reply(400, "Invalid or expired link")
+    if request.method == 'GET':
+        return reply(200, form=True)
+    password = (request.get_json(silent=True) or request.form).get('password')
+    if not password:
+        return reply(400, "password is required", form=True)
+    try:
+        user.set_password(password)
+    except HasherBusy:
+        return reply(503, "Server busy, please retry.", headers={'Retry-After': '1'}, form=True)
+    db.session.commit()
+    user_cache.invalidate(user.id)
+    return reply(200, done=True)
+
+@pages.route('/freeplay')
 @login_required
 def freeplay():
-    return render_template('freeplay.html', background_music_url=url_for('static', filename='music/bg.mp3'))
+    return render_cache.render('freeplay.html', background_music_url=url_for('static', filename='music/bg.mp3'))
+
+# API
+api = Blueprint('api', __name__)
 
-# API Routes
-@app.route('/api/user-info')
+@api.route('/api/user-info')
+@db_router.read_only
 @login_required
+@api_cache.conditional(lambda: f"{current_user.id}-{current_user.version_id}")
 def user_info():
     return jsonify({
         "balance": current_user.balance,
         "referral_link": f"https://example.com/referral/{current_user.referral_code}"
     })
 
-@app.route('/api/leaderboard')
+@api.route('/api/password-reset', methods=['POST'])
+def request_password_reset():
+    # Same answer whether or not the address exists
+    email = (request.get_json(silent=True) or request.form).get('email')
+    user_id = db.session.scalar(db.select(User.id).filter_by(email=email)) if email else None
+    if user_id is not None:
+        # At most one reset email per user per five minutes
+        job_queue.enqueue('reset_email', {'user_id': user_id},
+                          dedupe_key=f'reset_email:{user_id}:{int(time.time() // 300)}')
+        db.session.commit()
+    return jsonify({"status": "queued"}), 202
+
+@api.route('/api/leaderboard')
+@db_router.read_only
+@api_cache.conditional(lambda: leaderboard.snapshot()[1])
 def get_leaderboard():
-    entries = FreeplayEntry.query.order_by(FreeplayEntry.reward.desc()).limit(10).all()
-    leaderboard = [
-        {
-            "user_id": e.user_id,
-            "referral_code": e.referral_code,
-            "amount": e.reward,
-            "timestamp": e.timestamp.strftime('%Y-%m-%d %H:%M')
-        } for e in entries
-    ]
-    return jsonify({"leaderboard": leaderboard})
-
-@app.route('/api/freeplay', methods=['POST'])
+    resp = Response(leaderboard.snapshot()[0], mimetype='application/json')
+    resp.cache_control.no_cache = True
+    return resp
+
+def sse_event(topic, data):
+    name = 'leaderboard' if topic == 'leaderboard' else 'balance'
+    return f"event: {name}\ndata: {data}\n\n"
+
+@api.route('/api/stream')
+def stream():
+    # Everything the generator needs is read here: the stream outlives the
+    # request's DB session and must not pin a pooled connection.
+    if not STREAM_ENABLED or not current_user.is_authenticated:
+        return '', 204  # EventSource does not reconnect after a 204
+    topics = ['leaderboard', f'user:{current_user.id}']
+    initial = [('leaderboard', leaderboard.snapshot()[0].decode()),
+               (f'user:{current_user.id}', json.dumps({"balance": current_user.balance}))]
+    db.session.remove()
+    sub = broker.subscribe(topics)
+    if sub is None:
+        # Full: send the current state and end the stream, telling the
+        # client to reconnect later. (EventSource gives up after a 503.)
+        retry = int(os.getenv('STREAM_BUSY_RETRY_MS', '15000'))
+        body = f'retry: {retry}\n\n' + ''.join(sse_event(topic, data) for topic, data in initial)
+        return Response(body, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    heartbeat = float(os.getenv('STREAM_HEARTBEAT', '15'))
+
+    def events():
+        yield 'retry: 5000\n\n'
+        pending = initial
+        while True:
+            for topic, data in pending:
+                yield sse_event(topic, data)
+            if sub.closed:
+                return
+            pending = sub.wait(heartbeat)
+            if not pending:
+                yield ': keepalive\n\n'
+
+    resp = Response(events(), mimetype='text/event-stream')
+    resp.call_on_close(lambda: broker.unsubscribe(sub))
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+@api.route('/api/freeplay', methods=['POST'])
 @login_required
 def freeplay_api():
     data = request.get_json() or {}
@@ -146,65 +635,389 @@ def freeplay_api():
     if not code:
         return jsonify({"error": "Please enter a referral code"}), 400
     reward = 10.0
+    if freeplay_writer.enabled:
+        return queue_freeplay(code, reward)
     entry = FreeplayEntry(user_id=current_user.id, referral_code=code, reward=reward)
     db.session.add(entry)
-    current_user.balance += reward
-    db.session.commit()
+    placed = leaderboard.record(entry)
+    balance, version = ledger.credit(db, User, Transaction, current_user.id, reward, 'freeplay')
+    referrals.add_earnings(current_user.id, reward)
+    commit_user(current_user, balance=balance, version_id=version)
+    leaderboard.invalidate()
+    broker.publish(f'user:{current_user.id}', json.dumps({"balance": balance}))
+    if placed:
+        publish_leaderboard()
+    return jsonify({"message": "Referral recorded. $10 reward added."}), 200
+
+def queue_freeplay(code, reward):
+    fut = freeplay_writer.submit({
+        "user_id": current_user.id, "referral_code": code,
+        "reward": reward, "timestamp": datetime.utcnow()})
+    if freeplay_writer.mode == 'group':
+        balance, version = fut.result()
+        values = user_cache.snapshot(current_user)
+        values.update(balance=balance, version_id=version)
+        remember_user(values)
+    else:
+        # Each queued credit advances version_id by one once flushed, so
+        # caches can't serve this user's pre-credit row after it lands.
+        session['_user_version'] = max(session.get('_user_version', 0), current_user.version_id) + 1
     return jsonify({"message": "Referral recorded. $10 reward added."}), 200
 
-@app.route('/api/submit', methods=['POST'])
+@api.route('/api/referrals')
+@db_router.read_only
+@login_required
+def referral_stats():
+    max_depth = request.args.get('max_depth', type=int)
+    return jsonify(referrals.subtree(current_user.id, max_depth))
+
+# Admin
+admin = Blueprint('admin', __name__)
+
+@admin.route('/api/referrals/<code>')
+@db_router.read_only
+@login_required
+def referral_stats_for(code):
+    if current_user.email != os.getenv('ADMIN_EMAIL'):
+        return jsonify({"error": "Unauthorized"}), 403
+    user_id = db.session.scalar(db.select(User.id).filter_by(referral_code=code))
+    if user_id is None:
+        return jsonify({"error": "Unknown referral code"}), 404
+    max_depth = request.args.get('max_depth', type=int)
+    return jsonify(dict(referrals.subtree(user_id, max_depth), user_id=user_id))
+
+@admin.route('/api/admin/import-users', methods=['POST'])
+@login_required
+def import_users():
+    # Accepts a multipart "file" upload or a raw CSV / JSON Lines body.
+    if current_user.email != os.getenv('ADMIN_EMAIL'):
+        return jsonify({"error": "Unauthorized"}), 403
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, fmt = upload.stream, user_import.detect_format(upload.filename, upload.mimetype)
+    else:
+        stream, fmt = request.stream, user_import.detect_format(mimetype=request.mimetype)
+    # Hashing thousands of passwords is the jobs worker's business, not a
+    # request thread's: the upload is stored and the import queued (once:
+    # a partial import is not retried). GET status_url for the report.
+    token = secrets.token_hex(8)
+    chunks = store_job_data(token, stream)
+    job = job_queue.enqueue('user_import', {'token': token, 'chunks': chunks,
+                                            'format': request.args.get('format', fmt)}, max_attempts=1)
+    db.session.commit()
+    return jsonify({"job_id": job.id, "status_url": url_for('admin.import_result', job_id=job.id)}), 202
+
+@admin.route('/api/admin/import-users/<int:job_id>')
+@login_required
+def import_result(job_id):
+    if current_user.email != os.getenv('ADMIN_EMAIL'):
+        return jsonify({"error": "Unauthorized"}), 403
+    job = db.session.get(Job, job_id)
+    if job is None or job.kind != 'user_import':
+        return jsonify({"error": "No such import"}), 404
+    if job.status != jobs.DONE:
+        return jsonify({"status": job.status, "attempts": job.attempts, "error": job.last_error}), 202
+    return jsonify(json.loads(job.result)), 200
+
+@api.route('/api/kyc', methods=['POST'])
+def submit_kyc():
+    # Size and type are checked from the headers before any of the body is
+    # read; the document then streams to disk (see uploads.py).
+    if request.content_length is None:
+        return jsonify({"error": "Content-Length required"}), 411
+    if request.content_length > kyc_store.max_bytes + 64 * 1024:
+        return jsonify({"error": "Upload too large"}), 413
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return jsonify({"error": "Expected multipart/form-data"}), 400
+    try:
+        fields, files = uploads.parse_multipart(request.stream, boundary, kyc_store)
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except RequestEntityTooLarge:
+        return jsonify({"error": "Form fields too large"}), 413
+    stored = files.get('id_file')
+    if stored is None:
+        return jsonify({"error": "id_file is required"}), 400
+    submission = KYCSubmission(
+        full_name=fields.get('full_name'), email=fields.get('email'), phone=fields.get('phone'),
+        country=fields.get('country'), wallet_or_ssn=fields.get('wallet_or_ssn'),
+        id_file=stored.path, id_file_hash=stored.digest, date=datetime.utcnow().isoformat())
+    db.session.add(submission)
+    db.session.commit()
+    previews.submit(stored)
+    # Dedupe stays internal: telling an anonymous caller whether these
+    # bytes were already on file would let anyone probe for a document
+    return jsonify({"id": submission.id}), 201
+
+@api.route('/api/submit', methods=['POST'])
 def submit():
     data = request.get_json() or {}
     return jsonify({"message": "Form submitted successfully"}), 200
 
-@app.route('/api/admin-dashboard')
+def admin_dashboard_etag():
+    # Index-only lookups: rows are only ever appended to KYCSubmission, and
+    # every User write bumps updated_at.
+    if current_user.email != os.getenv('ADMIN_EMAIL'):
+        return None
+    row = db.session.query(
+        db.session.query(db.func.max(KYCSubmission.id)).scalar_subquery(),
+        db.session.query(db.func.max(User.id)).scalar_subquery(),
+        db.session.query(db.func.max(User.updated_at)).scalar_subquery()).one()
+    key = f"{row[0]}|{row[1]}|{row[2]}|{request.query_string.decode()}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+@admin.route('/api/admin-dashboard')
+@db_router.read_only
 @login_required
+@api_cache.conditional(admin_dashboard_etag)
 def admin_dashboard():
     if current_user.email != os.getenv('ADMIN_EMAIL'):
         return jsonify({"error": "Unauthorized"}), 403
-    subs = KYCSubmission.query.all()
-    users = User.query.all()
+    args = request.args
+    limit = page_size(args.get('limit'), default=int(os.getenv('ADMIN_PAGE_SIZE', '50')))
+
+    subs = db.session.query(
+        KYCSubmission.id, KYCSubmission.full_name, KYCSubmission.email, KYCSubmission.phone,
+        KYCSubmission.country, KYCSubmission.wallet_or_ssn, KYCSubmission.id_file, KYCSubmission.id_file_hash,
+        KYCSubmission.date)
+    if args.get('country'):
+        subs = subs.filter(KYCSubmission.country == args['country'])
+
+    users = db.session.query(User.id, User.email, User.balance, User.referral_code)
+    try:
+        subs = subs.filter(*date_bounds(KYCSubmission.date, args.get('since'), args.get('until')))
+        if args.get('min_balance'):
+            users = users.filter(User.balance >= float(args['min_balance']))
+        if args.get('max_balance'):
+            users = users.filter(User.balance <= float(args['max_balance']))
+        users = users.filter(*date_bounds(User.date_created, args.get('joined_since'), args.get('joined_until')))
+        sub_rows, sub_cursor = keyset_page(subs, KYCSubmission.id, args.get('submissions_cursor'), limit)
+        user_rows, user_cursor = keyset_page(users, User.id, args.get('users_cursor'), limit)
+    except ValueError:
+        return jsonify({"error": "Invalid filter or cursor"}), 400
+
+    sub_key = ('kyc', args.get('country'), args.get('since'), args.get('until'))
+    user_key = ('user', args.get('min_balance'), args.get('max_balance'),
+                args.get('joined_since'), args.get('joined_until'))
     return jsonify({
-        "submissions": [{
-            "id": s.id,
-            "full_name": s.full_name,
-            "email": s.email,
-            "phone": s.phone,
-            "country": s.country,
-            "wallet_or_ssn": s.wallet_or_ssn,
-            "id_file": s.id_file,
-            "date": s.date
-        } for s in subs],
-        "users": [{
-            "id": u.id,
-            "email": u.email,
-            "balance": u.balance,
-            "referral_code": u.referral_code
-        } for u in users]
+        "submissions": [dict(s._mapping) for s in sub_rows],
+        "users": [dict(u._mapping) for u in user_rows],
+        "submissions_total": admin_counts.get(sub_key, lambda: subs.order_by(None).count()),
+        "users_total": admin_counts.get(user_key, lambda: users.order_by(None).count()),
+        "next_submissions_cursor": sub_cursor,
+        "next_users_cursor": user_cursor
     })
 
-@app.route('/api/download-kyc-csv')
+@admin.route('/api/cache-stats')
+@login_required
+def cache_stats():
+    if current_user.email != os.getenv('ADMIN_EMAIL'):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify({"user_cache": user_cache.stats(), "render_cache": render_cache.stats(),
+                    "api": api_cache.stats(), "db_replicas": db_router.stats()})
+
+@admin.route('/metrics')
+def prometheus_metrics():
+    # Admin session, or a bearer token for Prometheus scrapers
+    token = os.getenv('METRICS_TOKEN')
+    if not (token and request.headers.get('Authorization') == f'Bearer {token}'):
+        if not current_user.is_authenticated or current_user.email != os.getenv('ADMIN_EMAIL'):
+            return jsonify({"error": "Unauthorized"}), 403
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@admin.route('/api/kyc/<int:submission_id>/<any(file, thumb, preview):kind>')
+@login_required
+def kyc_document(submission_id, kind):
+    if current_user.email != os.getenv('ADMIN_EMAIL'):
+        return jsonify({"error": "Unauthorized"}), 403
+    submission = db.session.get(KYCSubmission, submission_id)
+    stored = submission and submission.id_file_hash and kyc_store.lookup(submission.id_file)
+    if not stored:
+        return jsonify({"error": "No document"}), 404
+    path = kyc_store.abspath(stored.path)
+    if kind != 'file':
+        path = kyc_store.preview_path(stored.digest, kind)
+        if not os.path.exists(path):
+            if previews.submit(stored) is None:
+                return jsonify({"error": "No preview for this document type"}), 404
+            return jsonify({"status": "pending"}), 202, {'Retry-After': '1'}
+    # Content-addressed, so a URL's bytes never change
+    resp = send_file(path, conditional=True, max_age=365 * 24 * 3600)
+    resp.cache_control.private = True
+    resp.cache_control.immutable = True
+    return resp
+
+@admin.route('/api/admin/search')
+@db_router.read_only
+@login_required
+def admin_search():
+    if current_user.email != os.getenv('ADMIN_EMAIL'):
+        return jsonify({"error": "Unauthorized"}), 403
+    kind = request.args.get('type', 'kyc')
+    if kind not in ('kyc', 'users'):
+        return jsonify({"error": "type must be kyc or users"}), 400
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    index, model = (kyc_search, KYCSubmission) if kind == 'kyc' else (user_search, User)
+    if kind == 'kyc':
+        columns = (KYCSubmission.id, KYCSubmission.full_name, KYCSubmission.email, KYCSubmission.phone,
+                   KYCSubmission.country, KYCSubmission.date)
+    else:
+        columns = (User.id, User.email, User.referral_code, User.balance, User.date_created)
+    hits = index.search(request.args.get('q', ''), limit)
+    rows = {row.id: row._asdict() for row in db.session.execute(
+        db.select(*columns).where(model.id.in_([hit_id for hit_id, _ in hits])))}
+    return jsonify({"results": [dict(rows[hit_id], score=round(score, 4))
+                                for hit_id, score in hits if hit_id in rows]})
+
+@admin.route('/api/admin/jobs')
+@db_router.read_only
+@login_required
+def job_stats():
+    if current_user.email != os.getenv('ADMIN_EMAIL'):
+        return jsonify({"error": "Unauthorized"}), 403
+    dead = db.session.execute(
+        db.select(Job.id, Job.kind, Job.attempts, Job.last_error, Job.finished_at)
+        .where(Job.status == jobs.DEAD).order_by(Job.id.desc()).limit(50))
+    return jsonify({"counts": job_queue.stats(), "dead": [row._asdict() for row in dead]})
+
+@admin.route('/api/admin/jobs/<int:job_id>/retry', methods=['POST'])
+@login_required
+def retry_job(job_id):
+    if current_user.email != os.getenv('ADMIN_EMAIL'):
+        return jsonify({"error": "Unauthorized"}), 403
+    if not job_queue.requeue([job_id]):
+        return jsonify({"error": "No dead job with that id"}), 404
+    return jsonify({"status": "queued"}), 200
+
+@admin.route('/api/admin/exports', methods=['POST'])
+@login_required
+def start_kyc_export():
+    if current_user.email != os.getenv('ADMIN_EMAIL'):
+        return jsonify({"error": "Unauthorized"}), 403
+    try:
+        filters = kyc_export.parse_filters(request.args)
+    except ValueError:
+        return jsonify({"error": "Invalid id range or date"}), 400
+    job = job_queue.enqueue('kyc_export', {'filters': filters, 'gzip': request.args.get('gzip') == '1',
+                                           'token': secrets.token_hex(8)})
+    db.session.commit()
+    return jsonify({"job_id": job.id, "status_url": url_for('admin.kyc_export_result', job_id=job.id)}), 202
+
+@admin.route('/api/admin/exports/<int:job_id>')
+@login_required
+def kyc_export_result(job_id):
+    if current_user.email != os.getenv('ADMIN_EMAIL'):
+        return jsonify({"error": "Unauthorized"}), 403
+    job = db.session.get(Job, job_id)
+    if job is None or job.kind != 'kyc_export':
+        return jsonify({"error": "No such export"}), 404
+    if job.status != jobs.DONE:
+        return jsonify({"status": job.status, "attempts": job.attempts, "error": job.last_error}), 202
+    result = json.loads(job.result)
+    mimetype = 'application/gzip' if result['file'].endswith('.gz') else 'text/csv'
+    return Response(stream_with_context(iter_job_data(result['token'], result['chunks'])), mimetype=mimetype,
+                    headers={'Content-Disposition': f"attachment; filename={result['file']}",
+                             'Content-Length': str(result['bytes'])})
+
+@functools.lru_cache(maxsize=None)
+def referral_analytics():
+    # NumPy loads with the first report rather than at startup; the
+    # per-bucket cache lives as long as the process
+    import analytics
+    return analytics.ReferralAnalytics(db, User, FreeplayEntry, Transaction,
+                                       settle=float(os.getenv('ANALYTICS_SETTLE', '300')),
+                                       live_ttl=float(os.getenv('ANALYTICS_LIVE_TTL', '30')),
+                                       reload_every=float(os.getenv('ANALYTICS_RELOAD_EVERY', '3600')),
+                                       pending=pending_freeplay_since)
+
+def pending_freeplay_since():
+    # Earliest claim still waiting in a freeplay_claim job (see park_freeplay)
+    payloads = db.session.scalars(db.select(Job.payload).where(
+        Job.kind == 'freeplay_claim', Job.status.in_((jobs.QUEUED, jobs.RUNNING))))
+    stamps = [json.loads(payload)['timestamp'] for payload in payloads]
+    return datetime.fromisoformat(min(stamps)) if stamps else None
+
+@admin.route('/api/admin/analytics/referrals')
+@db_router.read_only
+@login_required
+def referral_report():
+    # ?from=YYYY-MM-DD&to=YYYY-MM-DD (UTC days, inclusive; default the last 30) &top=50 &code=
+    if current_user.email != os.getenv('ADMIN_EMAIL'):
+        return jsonify({"error": "Unauthorized"}), 403
+    try:
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d') if request.args.get('to') else datetime.utcnow()
+        start = (datetime.strptime(request.args['from'], '%Y-%m-%d') if request.args.get('from')
+                 else end - timedelta(days=29))
+    except ValueError:
+        return jsonify({"error": "Dates must be YYYY-MM-DD"}), 400
+    if not timedelta(0) <= end - start <= timedelta(days=366):
+        return jsonify({"error": "Range must be 1 to 367 days"}), 400
+    top = min(request.args.get('top', 50, type=int), 500)
+    return jsonify(referral_analytics().report(start, end, top=top, code=request.args.get('code')))
+
+@admin.route('/api/freeplay-queue')
+@login_required
+def freeplay_queue_stats():
+    if current_user.email != os.getenv('ADMIN_EMAIL'):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(freeplay_writer.stats())
+
+# Not @db_router.read_only: the CSV streams after the view returns, out of
+# reach of the replica fallback
+@admin.route('/api/download-kyc-csv')
 @login_required
 def download_kyc_csv():
     if current_user.email != os.getenv('ADMIN_EMAIL'):
         return jsonify({"error": "Unauthorized"}), 403
-    subs = KYCSubmission.query.all()
-    si = StringIO()
-    w = csv.writer(si)
-    w.writerow(['ID', 'Full Name', 'Email', 'Phone', 'Country', 'Wallet/SSN', 'ID File', 'Date'])
-    for s in subs:
-        w.writerow([s.id, s.full_name, s.email, s.phone, s.country, s.wallet_or_ssn, s.id_file, s.date])
-    resp = Response(si.getvalue(), mimetype='text/csv')
-    resp.headers['Content-Disposition'] = 'attachment; filename=submissions.csv'
+    try:
+        filters = kyc_export.parse_filters(request.args)
+    except ValueError:
+        return jsonify({"error": "Invalid id range or date"}), 400
+    chunks = kyc_export.iter_csv(db, KYCSubmission, chunk_size=int(os.getenv('KYC_EXPORT_CHUNK', '1000')), **filters)
+    filename = 'submissions.csv'
+    if request.args.get('gzip') == '1':
+        chunks = kyc_export.gzip_stream(chunks)
+        filename += '.gz'
+        resp = Response(stream_with_context(chunks), mimetype='application/gzip')
+    else:
+        resp = Response(stream_with_context(chunks), mimetype='text/csv')
+    resp.headers['Content-Disposition'] = f'attachment; filename={filename}'
     return resp
 
-# Stripe & PayPal
-@app.route('/api/create-checkout-session', methods=['POST'])
+# Stripe & PayPal: payments.py (and requests) load on the first payment
+# call instead of at startup, keeping them out of cold-start time
+billing = Blueprint('billing', __name__)
+
+@functools.lru_cache(maxsize=None)
+def payment_gateways():
+    import payments
+    return payments.from_env()
+
+def payment_idempotency_key(scope):
+    # Explicit Idempotency-Key header wins; otherwise identical submissions
+    # from the same client within a minute collapse into one remote call.
+    # Either way the key is scoped to the buyer, so two accounts sending the
+    # same header value never share a provider object. Anonymous buyers are
+    # told apart by a random per-session nonce: many share one address
+    # behind a proxy or NAT.
+    import payments
+    if current_user.is_authenticated:
+        who = f'user:{current_user.get_id()}'
+    else:
+        who = session.setdefault('_payment_nonce', secrets.token_urlsafe(16))
+    if request.headers.get('Idempotency-Key'):
+        return payments.idempotency_key(scope, who, request.headers['Idempotency-Key'])
+    return payments.idempotency_key(scope, who, request.get_data(), int(time.time() // 60))
+
+@billing.route('/api/create-checkout-session', methods=['POST'])
 def create_checkout_session():
+    import payments
+    stripe_gateway, _ = payment_gateways()
     try:
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{
+        checkout_session = stripe_gateway.create_checkout_session({
+            'payment_method_types': ['card'],
+            'line_items': [{
                 'price_data': {
                     'currency': 'usd',
                     'product_data': {'name': 'Sportzino Membership'},
@@ -212,41 +1025,231 @@ def create_checkout_session():
                 },
                 'quantity': 1,
             }],
-            mode='payment',
-            success_url='https://sportzino.com/success',
-            cancel_url='https://sportzino.com/cancel',
-        )
-        return jsonify({"url": checkout_session.url}), 200
-    except Exception as e:
+            'mode': 'payment',
+            'success_url': 'https://sportzino.com/success',
+            'cancel_url': 'https://sportzino.com/cancel',
+        }, payment_idempotency_key('stripe-checkout'))
+        return jsonify({"url": checkout_session['url']}), 200
+    except payments.GatewayUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    except payments.PaymentError as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/paypal-pay', methods=['POST'])
+@billing.route('/api/paypal-pay', methods=['POST'])
 def paypal_pay():
+    import payments
+    _, paypal_gateway = payment_gateways()
     data = request.get_json() or {}
-    payment = paypalrestsdk.Payment(data)
-    if payment.create():
-        link = next((l.href for l in payment.links if l.method == 'REDIRECT'), None)
-        return jsonify({"url": link}), 200
-    return jsonify({"error": "PayPal error"}), 500
+    try:
+        payment = paypal_gateway.create_payment(data, payment_idempotency_key('paypal-payment'))
+    except payments.GatewayUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    except payments.PaymentError:
+        return jsonify({"error": "PayPal error"}), 500
+    link = next((l['href'] for l in payment.get('links', []) if l.get('method') == 'REDIRECT'), None)
+    return jsonify({"url": link}), 200
 
-@app.route('/api/chime-pay', methods=['POST'])
+@billing.route('/api/chime-pay', methods=['POST'])
 def chime_pay():
     return jsonify({"message": "Transfer manually to Chime Bank."}), 200
 
+# CLI (registered at the top level: `flask rebuild-leaderboard`)
+commands = Blueprint('commands', __name__, cli_group=None)
+
+# Values for rows that predate a column (see schema.upgrade)
+SCHEMA_BACKFILL = {
+    ('user', 'version_id'): '1',
+    ('user', 'updated_at'): 'date_created',
+}
+
+@commands.cli.command('upgrade-db')
+def upgrade_db():
+    # Adds the columns and indexes a database created by an older release
+    # lacks; safe to run on every deploy
+    statements = schema.upgrade(db, SCHEMA_BACKFILL)
+    for statement in statements:
+        print(statement)
+    # Summary tables start out empty: derive them from their sources (the
+    # search indexes do this themselves when ensure() creates them)
+    created = {statement.split()[-1] for statement in statements if statement.startswith('CREATE TABLE ')}
+    if LeaderboardEntry.__tablename__ in created:
+        print(f"Leaderboard rebuilt with {leaderboard.rebuild()} entries.")
+    if created & {ReferralClosure.__tablename__, ReferralStats.__tablename__}:
+        print(f"Referral graph rebuilt with {referrals.rebuild(Transaction)} paths.")
+    for index in (kyc_search, user_search):
+        index.ensure()
+    print("Schema up to date.")
+
+@commands.cli.command('rebuild-leaderboard')
+def rebuild_leaderboard():
+    db.create_all()
+    print(f"Leaderboard rebuilt with {leaderboard.rebuild()} entries.")
+
+@commands.cli.command('rebuild-referrals')
+def rebuild_referrals():
+    db.create_all()
+    print(f"Referral graph rebuilt with {referrals.rebuild(Transaction)} paths.")
+
+@commands.cli.command('jobs-worker')
+@click.option('--processes', default=int(os.getenv('JOB_WORKERS', '1')), help='Worker processes to run.')
+@click.option('--kind', 'kinds', multiple=True, help='Only run these job kinds (repeatable).')
+@click.option('--batch-size', default=50, help='Jobs claimed per poll.')
+@click.option('--once', is_flag=True, help='Run everything that is due, then exit.')
+def jobs_worker(processes, kinds, batch_size, once):
+    db.create_all()
+    flask_app = current_app._get_current_object()
+    make_worker = lambda: jobs.Worker(job_queue, flask_app, kinds=kinds or None, batch_size=batch_size)
+    if once:
+        print(f"Ran {make_worker().drain()} jobs.")
+        return
+    jobs.run_workers(make_worker, processes, after_fork=lambda: after_fork(flask_app))
+
+@commands.cli.command('rebuild-search')
+def rebuild_search():
+    db.create_all()
+    for index in (kyc_search, user_search):
+        index.rebuild()
+    print("Search indexes rebuilt.")
+
+@commands.cli.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+def import_users_command(path, fmt):
+    db.create_all()
+    with open(path, 'rb') as f:
+        report = importer.run(user_import.iter_records(f, fmt or user_import.detect_format(path)))
+    for error in report['errors']:
+        print(f"line {error['line']} ({error['email']}): {error['error']}")
+    print(f"{report['created']} users created, {report['failed']} rows failed of {report['rows']}.")
+
+@commands.cli.command('build-assets')
+def build_assets():
+    print(f"Wrote {static_assets.precompress()} precompressed static variants.")
+
+@commands.cli.command('startup-profile')
+@click.option('--runs', default=3, help='Cold starts to time; the median is reported.')
+@click.option('--top', default=15, help='Slowest top-level imports to list.')
+@click.option('--path', default='/', help='Route requested as the first response.')
+@click.option('--eager', multiple=True, help='Also time a start that imports this module up front (repeatable).')
+def startup_profile(runs, top, path, eager):
+    import startup_profile as sp
+    rows = sp.children(sp.import_times())
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for self_us, cumulative, _, name in sorted(rows, key=lambda r: -r[1])[:top + 1]:
+        print(f"{cumulative / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+    starts = [('cold start', ())]
+    if eager:
+        starts.append((f"with {', '.join(eager)} eager", eager))
+    for label, modules in starts:
+        samples = sorted((sp.cold_start(path=path, eager=modules) for _ in range(runs)), key=lambda r: r['total'])
+        mid = samples[len(samples) // 2]
+        print(f"{label} (median of {runs}): import {mid['import'] * 1000:.0f}ms, first response "
+              f"{mid['first_response'] * 1000:.0f}ms, spawn to response {mid['total'] * 1000:.0f}ms")
+
+@commands.cli.command('check-ledger')
+@click.option('--adopt', is_flag=True, help='Append adjustment entries so the ledger matches balances.')
+@click.option('--reset', is_flag=True, help='Overwrite balances with the ledger-derived totals.')
+def check_ledger(adopt, reset):
+    rows = ledger.mismatches(db, User, Transaction).all()
+    for user_id, balance, derived in rows:
+        print(f"user {user_id}: balance {balance} != ledger {derived}")
+    print(f"{len(rows)} mismatched balances.")
+    if adopt:
+        print(f"Adopted {ledger.adopt(db, Transaction, rows)} balances into the ledger.")
+    elif reset:
+        print(f"Reset {ledger.reset(db, User, rows)} balances from the ledger.")
+
 # Error Handlers
-@app.errorhandler(404)
+@pages.app_errorhandler(404)
 def page_not_found(error):
     return render_template('404.html'), 404
 
-@app.errorhandler(500)
+@pages.app_errorhandler(500)
 def internal_server_error(error):
     return render_template('500.html'), 500
 
+@pages.app_errorhandler(StaleDataError)
+def stale_user(error):
+    # A User UPDATE matched no row at the version it was loaded with: some
+    # other request or process wrote it first. Our write is lost; drop the
+    # rows we held from the cache so the client's retry starts fresh.
+    for model, ident, _ in list(db.session.identity_map.keys()):
+        if model is User:
+            user_cache.invalidate(ident[0])
+    db.session.rollback()
+    return jsonify({"error": "Your account changed while this request ran; please retry"}), 409
+
+def configure_app():
+    """Builds the module's ``app`` and binds the module-level extensions to
+    it. Called once, below: the extensions keep a single app."""
+    app = Flask(__name__)
+    # Signs sessions and email links; a default would let anyone forge them
+    app.secret_key = os.getenv('SECRET_KEY')
+    if not app.secret_key:
+        raise RuntimeError("SECRET_KEY must be set")
+    # The web and jobs services (render.yaml) are separate machines: both
+    # need the same database, and mail links need the public address
+    if os.getenv('FLASK_ENV') == 'production':
+        for key in ('SQLALCHEMY_DATABASE_URI', 'PUBLIC_URL'):
+            if not os.getenv(key):
+                raise RuntimeError(f"{key} must be set in production")
+        if os.environ['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+            raise RuntimeError("SQLALCHEMY_DATABASE_URI must name a shared database in production, not SQLite")
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI', 'sqlite:///referrals.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Pool sizes per engine: DB_POOL_SIZE etc. for the primary, REPLICA_*
+    # for the replicas (which otherwise inherit the primary's)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = pool_options(os.environ, 'DB')
+    app.config['SQLALCHEMY_BINDS'] = replica_binds(os.getenv('SQLALCHEMY_REPLICA_URIS', ''),
+                                                   **pool_options(os.environ, 'REPLICA'))
+    CORS(app)
+    metrics.init_app(app)
+    broker.relay = stream_relay(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    # Compiled template bytecode persists across restarts
+    jinja_cache_dir = os.getenv('JINJA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'sportzino-jinja'))
+    os.makedirs(jinja_cache_dir, exist_ok=True)
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(jinja_cache_dir)}
+    static_assets.init_app(app)
+    api_cache.init_app(app)
+
+    db.init_app(app)
+    db_router.init_app(app)
+    login_manager.init_app(app)
+    freeplay_writer.init_app(app)
+    for blueprint in (pages, api, admin, billing, commands):
+        app.register_blueprint(blueprint)
+    return app
+
+def warm_up(app):
+    """Loads read-only state once, before gunicorn forks (preload_app), so
+    workers share it copy-on-write instead of each building their own."""
+    configure_mappers()
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+    static_assets.warm()
+    # The payment and NumPy analytics modules add 140-210 ms to every cold
+    # start and are only needed once someone pays or opens the report, so
+    # they stay lazy unless WARM_UP_IMPORTS=1 trades that for sharing them.
+    if os.getenv('WARM_UP_IMPORTS') == '1':
+        import payments  # noqa: F401  (module only; gateways stay per-process)
+        import analytics  # noqa: F401  (the report cache stays per-process)
+
+def after_fork(app):
+    # Pooled connections must never be shared between processes; drop any
+    # the parent opened without closing them from the child's side.
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+app = configure_app()
+
 # Run App
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()
     if os.getenv('FLASK_ENV') == 'production':
+        from waitress import serve
         serve(app, host='0.0.0.0', port=5000)
     else:
         app.run(debug=True)
@@ -0,0 +1,124 @@
+"""Referral report timings: cold, cached, and after new activity.
+
+Seeds --users users over --days days (a third referred by an earlier
+user), --claims freeplay entries and some bonus credits, then times
+ReferralAnalytics.report for the last 30 days: cold (every bucket
+computed), warm (only the live bucket recomputed) and after another
+batch of today's claims. Totals are checked against SQL GROUP BY
+queries. With --compare it also times the ORM approach the module
+replaces: load every User and FreeplayEntry and group in Python.
+
+Usage: python benchmarks/bench_analytics.py [--users 200000] [--claims 1000000] [--compare]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f"{label:28} {(time.perf_counter() - start) * 1000:9.1f}ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--claims', type=int, default=1000000)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    os.environ.setdefault('SECRET_KEY', 'bench-secret-key')
+    import app as A
+    from sqlalchemy import func, insert
+
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    origin = now - timedelta(days=args.days)
+    with A.app.app_context():
+        A.db.create_all()
+        session = A.db.session
+        start = time.perf_counter()
+        users, codes = [], []
+        for i in range(args.users):
+            code = f'C{i:07d}'
+            referrer = codes[rng.randrange(i)] if i and rng.random() < 0.33 else None
+            users.append({'email': f'a{i}@example.com', 'password': '-', 'referral_code': code,
+                          'referrer_code': referrer, 'balance': 0.0, 'version_id': 1,
+                          'date_created': origin + timedelta(seconds=args.days * 86400 * i / args.users)})
+            codes.append(code)
+        for offset in range(0, len(users), 20000):
+            session.execute(insert(A.User.__table__), users[offset:offset + 20000])
+        user_dates = [u['date_created'] for u in users]
+        del users
+
+        def claims(n, since):
+            rows = []
+            for _ in range(n):
+                uid = rng.randrange(args.users) + 1
+                when = max(user_dates[uid - 1], since) + timedelta(seconds=rng.random() * 86400 * 3)
+                rows.append({'user_id': uid, 'referral_code': codes[int(rng.paretovariate(1.2)) % args.users],
+                             'reward': 10.0, 'timestamp': min(when, datetime.utcnow())})
+            return rows
+
+        for offset in range(0, args.claims, 50000):
+            session.execute(insert(A.FreeplayEntry.__table__), claims(min(50000, args.claims - offset), origin))
+        session.execute(insert(A.Transaction.__table__), [
+            {'user_id': rng.randrange(args.users) + 1, 'amount': 5.0, 'type': 'bonus',
+             'timestamp': origin + timedelta(seconds=rng.random() * args.days * 86400)}
+            for _ in range(args.claims // 20)])
+        session.commit()
+        print(f"seeded in {time.perf_counter() - start:.1f}s")
+
+        analytics = A.referral_analytics()
+        end, begin = now, now - timedelta(days=29)
+        cold = timed("report, cold", lambda: analytics.report(begin, end))
+        timed("report, cached", lambda: analytics.report(begin, end))
+        analytics.live_ttl = 0
+        timed("report, live bucket redone", lambda: analytics.report(begin, end))
+        session.execute(insert(A.FreeplayEntry.__table__), claims(5000, now - timedelta(hours=1)))
+        session.commit()
+        fresh = timed("report, 5k new claims", lambda: analytics.report(begin, end))
+        timed("report, 7 days", lambda: analytics.report(now - timedelta(days=6), end))
+
+        # Cross-check totals against the database
+        lo = datetime.strptime(cold['from'][:10], '%Y-%m-%d')
+        e = A.FreeplayEntry
+        claimed = session.scalar(A.db.select(func.count()).where(e.timestamp >= lo))
+        signups = session.scalar(A.db.select(func.count()).where(
+            A.User.date_created >= lo, A.User.referrer_code.isnot(None)))
+        assert fresh['totals']['claims'] == claimed, (fresh['totals'], claimed)
+        assert fresh['totals']['signups'] == signups, (fresh['totals'], signups)
+        top = fresh['funnel'][0]
+        by_code = session.scalar(A.db.select(func.count()).where(e.timestamp >= lo, e.referral_code == top['code']))
+        assert top['claims'] == by_code, (top, by_code)
+        print(f"totals match SQL: {claimed} claims, {signups} referred signups, top code {top['code']}")
+
+        if args.compare:
+            def orm():
+                per_code_day = Counter()
+                for entry in e.query.filter(e.timestamp >= lo).all():
+                    per_code_day[entry.referral_code, entry.timestamp.date()] += 1
+                signed = Counter()
+                for user in A.User.query.filter(A.User.date_created >= lo).all():
+                    if user.referrer_code:
+                        signed[user.referrer_code, user.date_created.date()] += 1
+                return per_code_day, signed
+            session.expunge_all()
+            timed("ORM loop (claims + signups)", orm)
+
+
+if __name__ == '__main__':
+    main()
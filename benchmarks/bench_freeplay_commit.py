@@ -0,0 +1,79 @@
+"""Compare per-request commits with group commit for /api/freeplay.
+
+Each FREEPLAY_WRITE_MODE runs in a fresh subprocess against its own SQLite
+file so the modes don't share warm caches.
+
+Usage: python benchmarks/bench_freeplay_commit.py [--users 8] [--requests 200]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+os.environ.setdefault('SECRET_KEY', 'bench-secret-key')  # app.py won't start without one
+
+
+def worker(args):
+    sys.path.insert(0, ROOT)
+    import app as A
+
+    with A.app.app_context():
+        A.db.create_all()
+    clients = []
+    for i in range(args.users):
+        c = A.app.test_client()
+        c.post('/register', data={'email': f'bench{i}@example.com', 'password': 'bench'})
+        clients.append(c)
+
+    def drive(c):
+        for _ in range(args.requests):
+            c.post('/api/freeplay', json={'referral_code': 'BENCH'})
+
+    threads = [threading.Thread(target=drive, args=(c,)) for c in clients]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    A.freeplay_writer.flush()
+    elapsed = time.perf_counter() - start
+    stats = A.freeplay_writer.stats()
+    print(json.dumps({"rps": args.users * args.requests / elapsed, "batches": stats['batches']}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--delay-ms', type=float, default=20)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        return worker(args)
+
+    print(f"{'mode':<8} {'req/s':>10} {'commits':>10}")
+    for mode in ('sync', 'group', 'async'):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ,
+                       SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                       PASSWORD_HASH_METHOD='pbkdf2:sha256:1000',
+                       FREEPLAY_WRITE_MODE=mode,
+                       FREEPLAY_BATCH_SIZE=str(args.batch_size),
+                       FREEPLAY_BATCH_DELAY_MS=str(args.delay_ms))
+            out = subprocess.run(
+                [sys.executable, __file__, '--worker', '--users', str(args.users),
+                 '--requests', str(args.requests)],
+                env=env, check=True, capture_output=True, text=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            commits = args.users * args.requests if mode == 'sync' else result['batches']
+            print(f"{mode:<8} {result['rps']:>10.1f} {commits:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Logins/sec per core for each password hashing setting.
+
+Usage: python benchmarks/bench_password_hashing.py [--seconds 3] [method ...]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from passwords import PasswordHasher  # noqa: E402
+
+DEFAULT_METHODS = [
+    'scrypt:32768:8:1',
+    'scrypt:16384:8:1',
+    'pbkdf2:sha256:600000',
+    'pbkdf2:sha256:260000',
+]
+
+
+def run(method, seconds, cores):
+    hasher = PasswordHasher(method=method, workers=cores, queue_size=cores * 4, timeout=60)
+    pwhash = hasher.hash('correct horse battery staple')
+    done = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        nonlocal done
+        n = 0
+        while time.perf_counter() < deadline:
+            hasher.verify(pwhash, 'correct horse battery staple')
+            n += 1
+        with lock:
+            done += n
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(cores * 2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    hasher.shutdown()
+    return done / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--cores', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('methods', nargs='*', default=DEFAULT_METHODS)
+    args = parser.parse_args()
+
+    print(f"{'method':<24} {'logins/s':>10} {'per core':>10}")
+    for method in args.methods:
+        rate = run(method, args.seconds, args.cores)
+        print(f"{method:<24} {rate:>10.1f} {rate / args.cores:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
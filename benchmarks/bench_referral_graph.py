@@ -0,0 +1,112 @@
+"""Referral-graph maintenance and subtree queries on a synthetic tree.
+
+Builds a random recursive tree of --nodes users (each new user is referred
+by a uniformly chosen earlier one, so depth grows like ln(n)), fills the
+closure table with the recursive-CTE rebuild, then times incremental
+registers, credits and subtree-stats lookups against it. For comparison
+it also times the on-the-fly recursive-CTE count the rollups replace.
+
+Usage: python benchmarks/bench_referral_graph.py [--nodes 1000000] [--ops 2000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return f"p50 {pick(0.50):.3f}ms  p99 {pick(0.99):.3f}ms  mean {statistics.mean(samples) * 1000:.3f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=1000000)
+    parser.add_argument('--ops', type=int, default=2000)
+    parser.add_argument('--chunk', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    os.environ.setdefault('SECRET_KEY', 'bench-secret-key')
+    import app as A
+    from sqlalchemy import insert, text
+
+    rng = random.Random(args.seed)
+    with A.app.app_context():
+        A.db.create_all()
+        session = A.db.session
+        start = time.perf_counter()
+        codes = []
+        for offset in range(0, args.nodes, args.chunk):
+            n = min(args.chunk, args.nodes - offset)
+            batch = A.code_allocator.allocate_many(n)
+            rows = []
+            for i, code in enumerate(batch, offset):
+                rows.append({'email': f'tree{i}@example.com', 'password': '-', 'referral_code': code,
+                             'referrer_code': codes[rng.randrange(i)] if i else None,
+                             'balance': 0.0, 'version_id': 1})
+                codes.append(code)
+            session.execute(insert(A.User.__table__), rows)
+            session.commit()
+        print(f"users inserted:       {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        paths = A.referrals.rebuild()
+        print(f"closure rebuild:      {time.perf_counter() - start:.1f}s ({paths} paths, "
+              f"{paths / args.nodes:.1f} per user)")
+
+        ids = [i + 1 for i in range(args.nodes)]
+        samples = []
+        for k in range(args.ops):
+            referrer = rng.choice(ids)
+            t = time.perf_counter()
+            user = A.User(email=f'new{k}@example.com', password='-', referral_code=A.code_allocator.allocate(),
+                          referrer_code=codes[referrer - 1])
+            session.add(user)
+            session.flush()
+            A.referrals.add_user(user.id, referrer)
+            session.commit()
+            samples.append(time.perf_counter() - t)
+        print(f"register + closure:   {percentiles(samples)}")
+
+        samples = []
+        for _ in range(args.ops):
+            user_id = rng.choice(ids)
+            t = time.perf_counter()
+            A.referrals.add_earnings(user_id, 10.0)
+            session.commit()
+            samples.append(time.perf_counter() - t)
+        print(f"credit rollup:        {percentiles(samples)}")
+
+        samples = []
+        for _ in range(args.ops):
+            user_id = rng.choice(ids[:max(1, len(ids) // 100)])  # early users have big downlines
+            t = time.perf_counter()
+            A.referrals.subtree(user_id)
+            samples.append(time.perf_counter() - t)
+        print(f"subtree stats:        {percentiles(samples)}")
+        root = A.referrals.subtree(1)
+        print(f"root downline:        {root['members']} members over {len(root['levels'])} levels")
+
+        t = time.perf_counter()
+        count = session.execute(text("""
+            WITH RECURSIVE down(id, code, depth) AS (
+                SELECT id, referral_code, 0 FROM user WHERE id = 1
+                UNION ALL
+                SELECT u.id, u.referral_code, d.depth + 1 FROM down d JOIN user u ON u.referrer_code = d.code
+            )
+            SELECT count(*) - 1 FROM down
+        """)).scalar()
+        print(f"root via recursive CTE: {(time.perf_counter() - t) * 1000:.1f}ms ({count} members)")
+
+
+if __name__ == '__main__':
+    main()
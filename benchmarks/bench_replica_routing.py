@@ -0,0 +1,155 @@
+"""Read-replica routing with SQLite file copies standing in for replicas.
+
+Seeds a primary database, copies it to --replicas read-only files
+(SQLALCHEMY_REPLICA_URIS, ``mode=ro``) and checks the routing rules:
+
+- marked reads go to the replicas, in turn;
+- a client that just wrote reads its own write from the primary, even
+  though the copies never change;
+- a replica whose file disappears fails over to the primary within the
+  same request and stays out of rotation.
+
+Then times the dashboard, user-info and referral reads from --threads
+clients while a writer commits to the primary in a loop, once routed to
+the replicas and once with every replica taken out (all on the primary).
+
+Usage: python benchmarks/bench_replica_routing.py [--users 20000] [--replicas 2] [--requests 400]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def login(client, user_id):
+    with client.session_transaction() as s:
+        s['_user_id'] = str(user_id)
+        s['_fresh'] = True
+
+
+def timed_reads(A, paths, user_id, threads, requests):
+    latencies = []
+
+    def run():
+        client = A.app.test_client()
+        login(client, user_id)
+        for i in range(requests // threads):
+            start = time.perf_counter()
+            assert client.get(paths[i % len(paths)]).status_code == 200
+            latencies.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    latencies.sort()
+    return statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--replicas', type=int, default=2)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    primary = os.path.join(tmp, 'primary.db')
+    copies = [os.path.join(tmp, f'replica{i}.db') for i in range(args.replicas)]
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{primary}"
+    os.environ.setdefault('SECRET_KEY', 'bench-secret-key')
+    os.environ['SQLALCHEMY_REPLICA_URIS'] = ','.join(f"sqlite:///file:{p}?mode=ro&uri=true" for p in copies)
+    os.environ['ADMIN_EMAIL'] = 'u0@example.com'
+    os.environ['REPLICA_PIN_SECONDS'] = '2'
+    import app as A
+    from sqlalchemy import insert, update
+
+    with A.app.app_context():
+        A.db.create_all()
+        A.db.session.execute(insert(A.User.__table__), [
+            {'email': f'u{i}@example.com', 'password': '-', 'referral_code': f'C{i:06d}', 'balance': 0.0,
+             'version_id': 1} for i in range(args.users)])
+        A.db.session.execute(insert(A.KYCSubmission.__table__), [
+            {'full_name': f'Name {i}', 'email': f'k{i}@example.com', 'country': 'US', 'date': '2026-01-01'}
+            for i in range(args.users)])
+        A.db.session.commit()
+    for path in copies:
+        shutil.copyfile(primary, path)
+
+    admin_id, user_id = 1, 2
+    client = A.app.test_client()
+    login(client, user_id)
+    router = A.db_router
+
+    # Reads rotate over the replicas
+    for _ in range(2 * args.replicas):
+        assert client.get('/api/user-info').json['balance'] == 0.0
+    served = {key: s['served'] for key, s in router.stats()['replicas'].items()}
+    assert len(served) == args.replicas and all(n >= 1 for n in served.values()), served
+    print(f"reads served by replicas: {served}")
+
+    # Read-your-writes: the copies still say 0.0
+    assert client.post('/api/freeplay', json={'referral_code': 'C000000'}).status_code == 200
+    assert client.get('/api/user-info').json['balance'] == 10.0
+    other = A.app.test_client()
+    login(other, user_id)  # same user, fresh cookie: not pinned, but the user row is cached
+    with A.app.app_context():
+        A.user_cache.invalidate(user_id)
+    assert other.get('/api/user-info').json['balance'] == 0.0
+    print("writer reads its own write from the primary; other clients see the replica")
+    time.sleep(float(os.environ['REPLICA_PIN_SECONDS']) + 0.1)
+    with A.app.app_context():
+        A.user_cache.invalidate(user_id)
+    # Pin expired, but the session still remembers the version it wrote
+    assert client.get('/api/user-info').json['balance'] == 10.0
+    print("after the pin expires the user row still comes from the primary while replicas lag it")
+
+    # Failover: one replica's file disappears
+    os.remove(copies[0])
+    with A.app.app_context():
+        for engine in A.db.engines.values():
+            engine.dispose()
+    for _ in range(2 * args.replicas):
+        assert client.get('/api/referrals').status_code == 200
+    state = router.stats()
+    assert not state['replicas']['replica0']['healthy'], state
+    print(f"replica0 out of rotation ({state['replicas']['replica0']['error']}), fallbacks {router.fallbacks}")
+    shutil.copyfile(primary, copies[0])
+    for replica in router._replicas.values():
+        replica.down_until = 0.0
+
+    # Reads under a concurrent writer
+    stop = threading.Event()
+
+    def writer():
+        with A.app.app_context():
+            n = 0
+            while not stop.is_set():
+                A.db.session.execute(update(A.User).where(A.User.id == 3 + n % 100)
+                                     .values(balance=A.User.balance + 1, version_id=A.User.version_id + 1))
+                A.db.session.commit()
+                n += 1
+
+    paths = ['/api/admin-dashboard?limit=50', '/api/user-info', '/api/referrals']
+    for label, down in (("replicas", 0.0), ("primary only", float('inf'))):
+        for replica in router._replicas.values():
+            replica.down_until = down
+        stop.clear()
+        thread = threading.Thread(target=writer)
+        thread.start()
+        p50, p99 = timed_reads(A, paths, admin_id, args.threads, args.requests)
+        stop.set()
+        thread.join()
+        print(f"{label:13} p50 {p50:7.2f}ms  p99 {p99:7.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Admin search latency over a large synthetic KYC table.
+
+Inserts --rows submissions with generated names, emails, phones and
+countries through the ORM table (so the FTS5 triggers do their normal
+work and insert throughput is reported too), then times kyc_search.search
+for several query shapes: full name, name prefix, email prefix, phone
+fragment, name + country, and a deliberately broad two-letter prefix.
+With --compare it also times the LIKE '%...%' scan the index replaces.
+
+Usage: python benchmarks/bench_search.py [--rows 1000000] [--queries 200] [--compare]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+FIRST = ['james', 'mary', 'robert', 'patricia', 'john', 'jennifer', 'michael', 'linda', 'david', 'elizabeth',
+         'william', 'barbara', 'richard', 'susan', 'joseph', 'jessica', 'thomas', 'sarah', 'carlos', 'maria',
+         'wei', 'yuki', 'amara', 'olu', 'priya', 'arjun', 'fatima', 'omar', 'sofia', 'lucas']
+COUNTRIES = ['United States', 'Canada', 'Mexico', 'Brazil', 'Nigeria', 'India', 'Japan', 'Germany',
+             'France', 'Philippines', 'Kenya', 'United Kingdom']
+DOMAINS = ['gmail.com', 'yahoo.com', 'outlook.com', 'proton.me', 'example.org']
+
+
+def syllable_name(rng):
+    parts = ['ka', 'ro', 'mi', 'sen', 'dor', 'lin', 'vas', 'ter', 'bel', 'an', 'ez', 'ko', 'sh', 'ul', 'wen']
+    return ''.join(rng.choice(parts) for _ in range(rng.randint(2, 4)))
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return f"p50 {pick(0.50):7.3f}ms  p99 {pick(0.99):7.3f}ms  mean {statistics.mean(samples) * 1000:7.3f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--chunk', type=int, default=20000)
+    parser.add_argument('--compare', action='store_true', help="Also time an unindexed LIKE scan.")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    os.environ.setdefault('SECRET_KEY', 'bench-secret-key')
+    import app as A
+    from sqlalchemy import insert, or_
+
+    rng = random.Random(args.seed)
+    people = []
+    with A.app.app_context():
+        A.db.create_all()
+        session = A.db.session
+        start = time.perf_counter()
+        for offset in range(0, args.rows, args.chunk):
+            rows = []
+            for i in range(offset, min(args.rows, offset + args.chunk)):
+                first, last = rng.choice(FIRST), syllable_name(rng)
+                phone = f"+1 {rng.randint(200, 999)}-{rng.randint(200, 999)}-{rng.randint(1000, 9999)}"
+                rows.append({'full_name': f'{first.title()} {last.title()}',
+                             'email': f'{first}.{last}{i}@{rng.choice(DOMAINS)}', 'phone': phone,
+                             'country': rng.choice(COUNTRIES), 'date': '2024-01-01T00:00:00'})
+                if rng.random() < 0.001:
+                    people.append(rows[-1])
+            session.execute(insert(A.KYCSubmission.__table__), rows)
+            session.commit()
+        elapsed = time.perf_counter() - start
+        print(f"inserted {args.rows} rows: {elapsed:.1f}s ({args.rows / elapsed:,.0f} rows/s incl. FTS triggers)")
+
+        shapes = {
+            'full name': lambda p: p['full_name'],
+            'name prefix': lambda p: p['full_name'].split()[0] + ' ' + p['full_name'].split()[1][:3],
+            'email prefix': lambda p: p['email'][:p['email'].index('@') - 2],
+            'phone fragment': lambda p: p['phone'][-8:],
+            'name + country': lambda p: p['full_name'].split()[1] + ' ' + p['country'],
+            'broad prefix': lambda p: p['full_name'][:2],
+        }
+        for label, make in shapes.items():
+            samples, hits = [], 0
+            for _ in range(args.queries):
+                person = rng.choice(people)
+                q = make(person)
+                t0 = time.perf_counter()
+                found = A.kyc_search.search(q, 20)
+                samples.append(time.perf_counter() - t0)
+                hits += bool(found)
+            print(f"{label:15} {percentiles(samples)}  ({hits}/{args.queries} with results)")
+
+        if args.compare:
+            K = A.KYCSubmission
+            samples = []
+            for _ in range(min(args.queries, 20)):
+                q = f"%{rng.choice(people)['email'][:8]}%"
+                t0 = time.perf_counter()
+                session.execute(A.db.select(K.id).where(or_(K.full_name.ilike(q), K.email.ilike(q),
+                                                            K.phone.ilike(q))).limit(20)).all()
+                samples.append(time.perf_counter() - t0)
+            print(f"{'LIKE scan':15} {percentiles(samples)}")
+
+
+if __name__ == '__main__':
+    main()
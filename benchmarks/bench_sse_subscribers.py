@@ -0,0 +1,138 @@
+"""How many /api/stream subscribers the deployed server holds, and how
+fast a publish reaches all of them.
+
+Starts gunicorn with gunicorn.conf.py (gthread, --workers processes, so
+subscribers land on different workers and every publish but the local one
+goes through the stream relay), ramps up SSE subscribers in steps, then
+makes a freeplay claim and measures how long the leaderboard push takes to
+reach every subscriber, plus the workers' total RSS. Linux only.
+
+Usage: python benchmarks/bench_sse_subscribers.py [--steps 100,500,1000] [--workers 2]
+"""
+import argparse
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from http.cookiejar import CookieJar
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+os.environ.setdefault('SECRET_KEY', 'bench-secret-key')  # app.py won't start without one
+
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(p) for p in f.read().split()]
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not come up")
+
+
+def rss_kb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def subscribe(port, cookie):
+    # The stream is for signed-in users only
+    s = socket.create_connection(('127.0.0.1', port))
+    s.sendall(b'GET /api/stream HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n'
+              b'Cookie: ' + cookie.encode() + b'\r\n\r\n')
+    s.setblocking(False)
+    return s
+
+
+def drain(sel, socks, marker, timeout):
+    # Waits until every socket in ``socks`` has received ``marker``; data
+    # arriving on other registered sockets is read and discarded.
+    pending = set(socks)
+    deadline = time.perf_counter() + timeout
+    while pending and time.perf_counter() < deadline:
+        for key, _ in sel.select(timeout=0.5):
+            try:
+                data = key.fileobj.recv(65536)
+            except BlockingIOError:
+                continue
+            if marker in data:
+                pending.discard(key.fileobj)
+    return len(socks) - len(pending)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', default='50,200,500')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=5077)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    args = parser.parse_args()
+
+    # Every stream holds a gthread thread: give each worker room for all of them
+    capacity = max(int(x) for x in args.steps.split(',')) + 16
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                   STREAM_RELAY_DIR=os.path.join(tmp, 'stream'),
+                   PASSWORD_HASH_METHOD='pbkdf2:sha256:1000',
+                   LEADERBOARD_SIZE='1000000',
+                   PORT=str(args.port), WEB_CONCURRENCY=str(args.workers),
+                   GUNICORN_WORKER_MODE='threaded', GUNICORN_THREADS=str(capacity),
+                   GUNICORN_CMD_ARGS=f'--worker-connections {capacity} --backlog 4096',
+                   STREAM_MAX_SUBSCRIBERS=str(capacity))
+        subprocess.run([sys.executable, '-c', 'import app; app.app.app_context().push(); app.db.create_all()'],
+                       cwd=ROOT, env=env, check=True)
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                                  cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(args.port)
+            base = f'http://127.0.0.1:{args.port}'
+            jar = CookieJar()
+            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+            opener.open(base + '/register', data=b'email=bench%40example.com&password=bench')
+            cookie = '; '.join(f'{c.name}={c.value}' for c in jar)
+            workers = children(server.pid)
+            baseline = sum(rss_kb(pid) for pid in workers)
+
+            sel = selectors.DefaultSelector()
+            socks = []
+            print(f"{'subscribers':>12} {'connected':>10} {'fanout ms':>10} {'rss MB':>8} {'KB/sub':>8}")
+            for target in (int(x) for x in args.steps.split(',')):
+                fresh = []
+                while len(socks) + len(fresh) < target:
+                    s = subscribe(args.port, cookie)
+                    sel.register(s, selectors.EVENT_READ)
+                    fresh.append(s)
+                connected = len(socks) + drain(sel, fresh, b'event: leaderboard', args.timeout)
+                socks.extend(fresh)
+                req = urllib.request.Request(base + '/api/freeplay', data=b'{"referral_code": "BENCH"}',
+                                             headers={'Content-Type': 'application/json'})
+                start = time.perf_counter()
+                opener.open(req)
+                reached = drain(sel, socks, b'event: leaderboard', args.timeout)
+                fanout = (time.perf_counter() - start) * 1000
+                rss = sum(rss_kb(pid) for pid in workers)
+                per_sub = (rss - baseline) / max(len(socks), 1)
+                print(f"{len(socks):>12} {min(connected, reached):>10} {fanout:>10.1f} {rss / 1024:>8.1f} {per_sub:>8.1f}")
+            for s in socks:
+                s.close()
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
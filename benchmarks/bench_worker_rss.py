@@ -0,0 +1,94 @@
+"""Memory per gunicorn worker with and without preload_app.
+
+Starts gunicorn with gunicorn.conf.py for each configuration, sends
+--requests requests spread over the workers so each one has served real
+traffic, then reads every worker's RSS, PSS and private (unshared) memory
+from /proc/<pid>/smaps_rollup. RSS counts pages shared with the master in
+full; PSS splits them between sharers, and private memory is what each
+extra worker really costs. Linux only.
+
+Usage: python benchmarks/bench_worker_rss.py [--workers 4] [--modes sync,threaded]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+os.environ.setdefault('SECRET_KEY', 'bench-secret-key')  # app.py won't start without one
+
+
+def memory_kb(pid):
+    out = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:'):
+                out[parts[0][:-1]] = int(parts[1])
+    return out['Rss'], out['Pss'], out['Private_Clean'] + out['Private_Dirty']
+
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(p) for p in f.read().split()]
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not come up")
+
+
+def measure(preload, mode, args, db_path):
+    env = dict(os.environ, PORT=str(args.port), WEB_CONCURRENCY=str(args.workers),
+               GUNICORN_PRELOAD='1' if preload else '0', GUNICORN_WORKER_MODE=mode,
+               SQLALCHEMY_DATABASE_URI=f'sqlite:///{db_path}')
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(args.port)
+        for i in range(args.requests):
+            path = ('/', '/api/leaderboard')[i % 2]
+            urllib.request.urlopen(f'http://127.0.0.1:{args.port}{path}').read()
+        time.sleep(0.5)
+        workers = children(proc.pid)
+        samples = [memory_kb(pid) for pid in workers]
+        master = memory_kb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+    n = len(samples)
+    rss, pss, private = (sum(s[i] for s in samples) / n / 1024 for i in range(3))
+    print(f"preload={'on ' if preload else 'off'} {mode:8} workers={n}  per worker: RSS {rss:6.1f}MB  "
+          f"PSS {pss:6.1f}MB  private {private:6.1f}MB  | master RSS {master[0] / 1024:.1f}MB  "
+          f"total PSS {(sum(s[1] for s in samples) + master[1]) / 1024:.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--modes', default='sync,threaded')
+    parser.add_argument('--port', type=int, default=5079)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        env = dict(os.environ, SQLALCHEMY_DATABASE_URI=f'sqlite:///{db_path}')
+        subprocess.run([sys.executable, '-c', 'import app; app.app.app_context().push(); app.db.create_all()'],
+                       cwd=ROOT, env=env, check=True)
+        for mode in args.modes.split(','):
+            for preload in (False, True):
+                measure(preload, mode, args, db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""Reproducible load test for the main routes.
+
+Seeds a fresh SQLite database with --users users, --entries FreeplayEntry
+rows and --kyc KYC submissions, starts the app in a threaded worker
+subprocess, then drives each route with --concurrency client threads for
+--requests requests. For every route it reports p50/p95/p99 latency,
+requests/sec, error count and DB queries per request (counted by the
+worker once the response body has been sent, so streamed routes count the
+queries their body makes, and collected from a /_bench/queries endpoint).
+
+Results are written as JSON (--out). Given --baseline, each route is
+compared against the stored run and the script exits 1 when p95 latency
+or throughput regresses by more than --threshold (a fraction), or when a
+route issues on average more than half a query per request more than
+before. --save-baseline copies this run to the baseline path.
+
+Usage: python benchmarks/load_test.py [--users 2000] [--requests 500]
+           [--concurrency 8] [--out results.json] [--baseline baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+os.environ.setdefault('SECRET_KEY', 'bench-secret-key')  # app.py won't start without one
+sys.path.insert(0, ROOT)
+
+ADMIN = 'admin@bench.local'
+PASSWORD = 'bench-password'
+ROUTES = ['login', 'freeplay', 'leaderboard', 'user_info', 'admin_dashboard', 'download_kyc_csv']
+
+SERVER = """
+import sys, threading, logging
+sys.path.insert(0, {root!r})
+import app as A
+from flask import jsonify, request
+from sqlalchemy import event
+from werkzeug.serving import make_server
+logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+local = threading.local()
+counts, counts_lock = [], threading.Lock()
+with A.app.app_context():
+    engine = A.db.engine
+
+@event.listens_for(engine, 'before_cursor_execute')
+def count_query(*args):
+    local.queries = getattr(local, 'queries', 0) + 1
+
+@A.app.before_request
+def reset_queries():
+    local.queries = 0
+
+def record_queries():
+    with counts_lock:
+        counts.append(getattr(local, 'queries', 0))
+
+@A.app.after_request
+def report_queries(resp):
+    # the body of a streamed response runs after this hook, so count on close
+    if request.path != '/_bench/queries':
+        resp.call_on_close(record_queries)
+    return resp
+
+def collect_queries():
+    with counts_lock:
+        taken = counts[:]
+        del counts[:]
+    return jsonify(taken)
+
+A.app.add_url_rule('/_bench/queries', 'bench_queries', collect_queries)
+
+srv = make_server('127.0.0.1', {port}, A.app, threaded=True)
+srv.request_queue_size = 1024
+print('ready', flush=True)
+srv.serve_forever()
+"""
+
+
+def seed(args):
+    import app as A
+    import user_import
+    from sqlalchemy import insert
+
+    rng = random.Random(args.seed)
+    with A.app.app_context():
+        A.db.create_all()
+        records = [(1, {'email': ADMIN, 'password': PASSWORD})]
+        records += [(i + 2, {'email': f'user{i}@bench.local', 'password': PASSWORD}) for i in range(args.users)]
+        A.importer.run(iter(records))
+        start = datetime(2024, 1, 1)
+        A.db.session.execute(insert(A.FreeplayEntry.__table__), [
+            {'user_id': rng.randint(2, args.users + 1), 'referral_code': f'CODE{i}',
+             'reward': round(rng.uniform(1, 100), 2), 'timestamp': start + timedelta(seconds=i)}
+            for i in range(args.entries)])
+        A.db.session.execute(insert(A.KYCSubmission.__table__), [
+            {'full_name': f'Bench User {i}', 'email': f'user{i}@bench.local', 'phone': '555-0100',
+             'country': rng.choice(['US', 'CA', 'GB', 'DE']), 'wallet_or_ssn': 'n/a',
+             'id_file': f'id_{i}.png', 'date': (start + timedelta(minutes=i)).isoformat()}
+            for i in range(args.kyc)])
+        A.db.session.commit()
+        A.leaderboard.rebuild()
+
+
+def login(base, email):
+    s = requests.Session()
+    r = s.post(f'{base}/login', data={'email': email, 'password': PASSWORD}, allow_redirects=False)
+    r.raise_for_status()
+    return s
+
+
+def make_request(route, base, session, user, rng):
+    if route == 'login':
+        return requests.post(f'{base}/login', data={'email': user, 'password': PASSWORD}, allow_redirects=False)
+    if route == 'freeplay':
+        return session.post(f'{base}/api/freeplay', json={'referral_code': f'BENCH{rng.randrange(1000)}'})
+    if route == 'leaderboard':
+        return session.get(f'{base}/api/leaderboard')
+    if route == 'user_info':
+        return session.get(f'{base}/api/user-info')
+    if route == 'admin_dashboard':
+        return session.get(f'{base}/api/admin-dashboard', params={'limit': 50})
+    if route == 'download_kyc_csv':
+        return session.get(f'{base}/api/download-kyc-csv')
+    raise ValueError(route)
+
+
+def collect_queries(base):
+    return requests.get(f'{base}/_bench/queries').json()
+
+
+def drive(route, base, sessions, users, args):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    counter = iter(range(args.requests))
+
+    def worker(n):
+        nonlocal errors
+        rng = random.Random(args.seed * 1000 + n)
+        session = sessions[n]
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            t = time.perf_counter()
+            try:
+                r = make_request(route, base, session, users[n], rng)
+                r.content  # read the whole body (CSV export streams)
+                ok = r.status_code < 400
+            except requests.RequestException:
+                r, ok = None, False
+            elapsed = time.perf_counter() - t
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors += 1
+
+    collect_queries(base)  # drop counts from logins and earlier routes
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    queries = collect_queries(base)
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / wall, 1),
+        'p50_ms': round(pick(0.50), 2),
+        'p95_ms': round(pick(0.95), 2),
+        'p99_ms': round(pick(0.99), 2),
+        'queries_per_request': round(statistics.mean(queries), 2) if queries else None,
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for route, cur in results['routes'].items():
+        old = baseline.get('routes', {}).get(route)
+        if not old:
+            continue
+        if cur['p95_ms'] > old['p95_ms'] * (1 + threshold):
+            regressions.append(f"{route}: p95 {old['p95_ms']}ms -> {cur['p95_ms']}ms")
+        if cur['rps'] < old['rps'] * (1 - threshold):
+            regressions.append(f"{route}: {old['rps']} -> {cur['rps']} req/s")
+        if None not in (cur['queries_per_request'], old['queries_per_request']) \
+                and cur['queries_per_request'] > old['queries_per_request'] + 0.5:
+            regressions.append(f"{route}: {old['queries_per_request']} -> "
+                               f"{cur['queries_per_request']} queries/request")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--entries', type=int, default=20000)
+    parser.add_argument('--kyc', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--routes', default=','.join(ROUTES))
+    parser.add_argument('--port', type=int, default=5078)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default='load_test_results.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                          PASSWORD_HASH_METHOD=os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000'),
+                          ADMIN_EMAIL=ADMIN)
+        t = time.perf_counter()
+        seed(args)
+        print(f"seeded in {time.perf_counter() - t:.1f}s")
+
+        proc = subprocess.Popen([sys.executable, '-c', SERVER.format(root=ROOT, port=args.port)],
+                                stdout=subprocess.PIPE, text=True)
+        try:
+            if proc.stdout.readline().strip() != 'ready':
+                sys.exit("server failed to start")
+            base = f'http://127.0.0.1:{args.port}'
+            users = [f'user{n % args.users}@bench.local' for n in range(args.concurrency)]
+            user_sessions = [login(base, u) for u in users]
+            admin_sessions = [login(base, ADMIN) for _ in range(args.concurrency)]
+            results = {
+                'meta': {'revision': git_revision(), 'python': platform.python_version(),
+                         'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+                         'users': args.users, 'entries': args.entries, 'kyc': args.kyc,
+                         'requests': args.requests, 'concurrency': args.concurrency},
+                'routes': {},
+            }
+            for route in args.routes.split(','):
+                sessions = admin_sessions if route.startswith(('admin', 'download')) else user_sessions
+                stats = drive(route, base, sessions, users, args)
+                results['routes'][route] = stats
+                print(f"{route:18} {stats['rps']:8.1f} req/s  p50 {stats['p50_ms']:7.2f}ms  "
+                      f"p95 {stats['p95_ms']:7.2f}ms  p99 {stats['p99_ms']:7.2f}ms  "
+                      f"queries {stats['queries_per_request']}  errors {stats['errors']}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"wrote {args.out}")
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"saved baseline {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("no regressions against baseline")
+
+
+if __name__ == '__main__':
+    main()
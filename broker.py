@@ -0,0 +1,264 @@
+"""Topic fan-out for server-sent events, across worker processes.
+
+Each process keeps its own ``Broker`` of local subscribers. A publish is
+delivered locally and handed to the ``relay``, which forwards it to every
+other process's broker:
+
+- ``PostgresRelay``: NOTIFY/LISTEN on the primary database, so the job
+  workers (another service, possibly another host) reach web workers;
+- ``SocketRelay``: one Unix datagram socket per process in a shared
+  directory, for deployments on a single host (the SQLite default).
+
+Delivery is best effort, like the streams themselves: a message to a
+process that is backed up or gone is dropped, and a subscriber that
+misses an update gets the next one (events are coalesced per topic).
+"""
+import atexit
+import json
+import logging
+import os
+import select
+import socket
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Pending events for one subscriber, coalesced per topic: if several
+    updates for a topic arrive before the subscriber wakes up, only the
+    latest one is delivered."""
+
+    def __init__(self, topics):
+        self.topics = set(topics)
+        self._pending = {}
+        self._cond = threading.Condition()
+        self.closed = False
+
+    def push(self, topic, data):
+        with self._cond:
+            self._pending[topic] = data
+            self._cond.notify()
+
+    def wait(self, timeout=None):
+        with self._cond:
+            if not self._pending and not self.closed:
+                self._cond.wait(timeout)
+            events, self._pending = list(self._pending.items()), {}
+            return events
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+class Broker:
+    """Publishing is O(subscribers of the topic) and never blocks on slow
+    clients; each subscriber drains its own coalesced mailbox. Other
+    processes are reached through ``relay`` when one is set."""
+
+    def __init__(self, max_subscribers=1000, relay=None):
+        self.max_subscribers = max_subscribers
+        self.relay = relay
+        self.published = 0
+        self._lock = threading.Lock()
+        self._topics = {}
+        self._count = 0
+
+    def subscribe(self, topics):
+        if self.relay is not None:
+            self.relay.listen(self.deliver)
+        sub = Subscription(topics)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            self._count += 1
+            for topic in sub.topics:
+                self._topics.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            if sub.closed:
+                return
+            sub.close()
+            self._count -= 1
+            for topic in sub.topics:
+                subs = self._topics.get(topic)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._topics[topic]
+
+    def publish(self, topic, data):
+        """Delivers to this process's subscribers and relays to the others;
+        returns the number of local subscribers reached."""
+        reached = self.deliver(topic, data)
+        if self.relay is not None:
+            self.relay.send(topic, data)
+        return reached
+
+    def deliver(self, topic, data):
+        with self._lock:
+            subs = list(self._topics.get(topic, ()))
+            self.published += 1
+        for sub in subs:
+            sub.push(topic, data)
+        return len(subs)
+
+    def stats(self):
+        with self._lock:
+            return {"subscribers": self._count, "topics": len(self._topics), "published": self.published}
+
+
+class SocketRelay:
+    """Relays publishes between the processes of one host through Unix
+    datagram sockets named ``<pid>.sock`` in ``directory``. A process binds
+    its socket when it first has a subscriber; sends go to every socket
+    but its own, and sockets of dead processes are removed by the first
+    sender to find them."""
+
+    max_message = 64 * 1024
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._sender = None
+        self._listening = None
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'{pid}.sock')
+
+    def listen(self, deliver):
+        with self._lock:
+            if self._listening == os.getpid():
+                return
+            self._listening = os.getpid()
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(os.getpid())
+            if os.path.exists(path):
+                os.unlink(path)  # left by an earlier process with this pid
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(path)
+            atexit.register(_unlink, path)
+        threading.Thread(target=self._receive, args=(sock, deliver), name='stream-relay', daemon=True).start()
+
+    @staticmethod
+    def _receive(sock, deliver):
+        while True:
+            try:
+                topic, data = json.loads(sock.recv(SocketRelay.max_message))
+                deliver(topic, data)
+            except Exception:
+                log.exception("stream relay receive failed")
+
+    def send(self, topic, data):
+        message = json.dumps([topic, data]).encode()
+        if len(message) > self.max_message:
+            log.warning("not relaying %d-byte message on %s", len(message), topic)
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # A socket created before fork is shared with the parent
+                self._pid = os.getpid()
+                self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                self._sender.setblocking(False)
+            sender = self._sender
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return  # nobody has subscribed anywhere yet
+        own = f'{os.getpid()}.sock'
+        for name in names:
+            if not name.endswith('.sock') or name == own:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                sender.sendto(message, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                _unlink(path)  # its process is gone
+            except OSError:
+                self.dropped += 1  # receiver backed up: it gets the next update
+
+
+class PostgresRelay:
+    """Relays publishes through NOTIFY on ``channel``; each process with
+    subscribers holds one LISTEN connection (psycopg2) and drops its own
+    messages, which it has already delivered. A NOTIFY payload is limited
+    to 8000 bytes."""
+
+    max_message = 7900
+
+    def __init__(self, url, channel='sportzino_stream', engine_options=None):
+        self.url = url
+        self.channel = channel
+        self.engine_options = engine_options or {}
+        self._lock = threading.Lock()
+        self._engine = None
+        self._pid = None
+        self._listening = None
+
+    @property
+    def origin(self):
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    def _connect(self):
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import NullPool
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._engine = create_engine(self.url, poolclass=NullPool, **self.engine_options)
+            return self._engine
+
+    def send(self, topic, data):
+        from sqlalchemy import text
+        message = json.dumps([self.origin, topic, data])
+        if len(message) > self.max_message:
+            log.warning("not relaying %d-byte message on %s", len(message), topic)
+            return
+        try:
+            with self._connect().connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                conn.execute(text("SELECT pg_notify(:channel, :message)"),
+                             {"channel": self.channel, "message": message})
+        except Exception:
+            log.exception("stream relay NOTIFY failed")
+
+    def listen(self, deliver):
+        with self._lock:
+            if self._listening == os.getpid():
+                return
+            self._listening = os.getpid()
+        threading.Thread(target=self._receive, args=(deliver,), name='stream-relay', daemon=True).start()
+
+    def _receive(self, deliver):
+        while True:
+            try:
+                raw = self._connect().raw_connection()
+                try:
+                    conn = raw.driver_connection
+                    conn.autocommit = True
+                    conn.cursor().execute(f'LISTEN "{self.channel}"')
+                    while True:
+                        if select.select([conn], [], [], 30)[0]:
+                            conn.poll()
+                        while conn.notifies:
+                            origin, topic, data = json.loads(conn.notifies.pop(0).payload)
+                            if origin != self.origin:
+                                deliver(topic, data)
+                finally:
+                    raw.invalidate()
+            except Exception:
+                log.exception("stream relay LISTEN connection lost; reconnecting")
+                time.sleep(1)
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,78 @@
+import gzip
+import threading
+from functools import wraps
+
+from flask import make_response, request
+
+
+class ConditionalJSON:
+    """ETag short-circuiting and gzip negotiation for the JSON API.
+
+    Views decorated with ``conditional(etag_fn)`` get their validator from
+    ``etag_fn()`` (row versions, max ids, ...) before the view runs, so a
+    matching If-None-Match is answered with 304 without touching the
+    expensive query. ETags are weak because the same validator covers both
+    the identity and gzip encodings. JSON bodies of at least ``min_size``
+    bytes are gzipped when the client accepts it. Per-endpoint byte
+    counters are kept in ``stats()``.
+    """
+
+    def __init__(self, app=None, min_size=1024, level=5):
+        self.min_size = min_size
+        self.level = level
+        self._lock = threading.Lock()
+        self._stats = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self._compress)
+
+    def _route(self, endpoint):
+        return self._stats.setdefault(endpoint, {
+            "responses": 0, "not_modified": 0, "bytes_raw": 0, "bytes_sent": 0, "last_size": 0})
+
+    def conditional(self, etag_fn):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                etag = etag_fn()
+                if etag and request.if_none_match.contains_weak(etag):
+                    with self._lock:
+                        route = self._route(request.endpoint)
+                        route["not_modified"] += 1
+                        route["bytes_raw"] += route["last_size"]
+                    return '', 304, {'ETag': f'W/"{etag}"'}
+                resp = make_response(view(*args, **kwargs))
+                if etag and resp.status_code == 200:
+                    resp.set_etag(etag, weak=True)
+                return resp
+            return wrapper
+        return decorator
+
+    def _compress(self, resp):
+        if request.endpoint is None or resp.mimetype != 'application/json' \
+                or resp.status_code == 304 or resp.direct_passthrough or resp.is_streamed:
+            return resp
+        data = resp.get_data()
+        raw = len(data)
+        sent = raw
+        if raw >= self.min_size and 'Content-Encoding' not in resp.headers \
+                and request.accept_encodings['gzip']:
+            data = gzip.compress(data, self.level)
+            resp.set_data(data)
+            resp.headers['Content-Encoding'] = 'gzip'
+            sent = len(data)
+        resp.vary.add('Accept-Encoding')
+        with self._lock:
+            route = self._route(request.endpoint)
+            route["responses"] += 1
+            route["bytes_raw"] += raw
+            route["bytes_sent"] += sent
+            route["last_size"] = raw
+        return resp
+
+    def stats(self):
+        with self._lock:
+            return {endpoint: dict(route, bytes_saved=route["bytes_raw"] - route["bytes_sent"])
+                    for endpoint, route in self._stats.items()}
@@ -0,0 +1,238 @@
+"""Concurrent, rate-limited page crawler for the odds scraper.
+
+Usage: python crawler.py [URL ...] [--concurrency 4] [--per-host 2] [--rate 1.0]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import aiohttp
+from bs4 import BeautifulSoup
+
+log = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+    "Accept-Language": "en-US,en;q=0.9"
+}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def retry_delay(value, now=None):
+    """Seconds asked for by a Retry-After header (delta-seconds or an
+    HTTP date), or None if it can't be parsed."""
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - (now if now is not None else time.time()))
+
+
+def parse_games(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    games = []
+    for game in soup.select('.match-card, .betting-row, .game'):
+        title = game.select_one('.league, .title')
+        teams = game.select('.team-name, .participant')
+        odds = game.select('.odds, .odd')
+        games.append({
+            'title': title.text.strip() if title else 'N/A',
+            'team1': teams[0].text.strip() if len(teams) > 0 else 'N/A',
+            'team2': teams[1].text.strip() if len(teams) > 1 else 'N/A',
+            'odds': [o.text.strip() for o in odds]
+        })
+    return games
+
+
+class RateLimiter:
+    """Token bucket: ``rate`` requests per second with bursts up to ``burst``."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ValidatorStore:
+    """ETag/Last-Modified per URL, persisted as JSON between runs."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.data = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    def headers_for(self, url):
+        entry = self.data.get(url, {})
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def update(self, url, resp_headers):
+        entry = {'etag': resp_headers.get('ETag'), 'last_modified': resp_headers.get('Last-Modified')}
+        if entry['etag'] or entry['last_modified']:
+            self.data[url] = entry
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+
+class Crawler:
+    def __init__(self, concurrency=8, per_host=2, rate=1.0, burst=1, retries=3, backoff=0.5,
+                 timeout=20.0, validators=None, proxy=None, verify_ssl=True, headers=None, max_retry_after=60.0):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.validators = validators or ValidatorStore()
+        self.proxy = proxy
+        self.verify_ssl = verify_ssl
+        self.headers = headers or DEFAULT_HEADERS
+        self._hosts = {}
+        self.stats = {'fetched': 0, 'not_modified': 0, 'failed': 0, 'retries': 0}
+
+    def _host(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = (asyncio.Semaphore(self.per_host), RateLimiter(self.rate, self.burst))
+        return self._hosts[host]
+
+    async def fetch(self, session, url):
+        """Returns the body, or None when the page is unchanged or failed."""
+        sem, limiter = self._host(url)
+        async with sem:
+            for attempt in range(self.retries + 1):
+                await limiter.acquire()
+                try:
+                    async with session.get(url, headers=self.validators.headers_for(url),
+                                           proxy=self.proxy, ssl=None if self.verify_ssl else False) as resp:
+                        if resp.status == 304:
+                            self.stats['not_modified'] += 1
+                            return None
+                        if resp.status not in RETRY_STATUSES:
+                            resp.raise_for_status()
+                            body = await resp.text()
+                            self.validators.update(url, resp.headers)
+                            self.stats['fetched'] += 1
+                            return body
+                        retry_after = resp.headers.get('Retry-After')
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if isinstance(e, aiohttp.ClientResponseError) and e.status not in RETRY_STATUSES:
+                        break
+                    retry_after = None
+                    log.debug("fetch %s failed: %s", url, e)
+                if attempt == self.retries:
+                    break
+                self.stats['retries'] += 1
+                # A server may ask for hours; waiting that long would stall
+                # the whole crawl, so it is capped and the attempt still counts
+                delay = retry_delay(retry_after)
+                if delay is None:
+                    delay = self.backoff * 2 ** attempt * (1 + random.random())
+                delay = min(delay, self.max_retry_after)
+                await asyncio.sleep(delay)
+        self.stats['failed'] += 1
+        return None
+
+    async def crawl(self, urls, handle):
+        """Fetches ``urls`` concurrently and calls ``handle(url, body)`` for
+        every page that changed since the last run."""
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        async with aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                         headers=self.headers) as session:
+            queue = asyncio.Queue()
+            for url in urls:
+                queue.put_nowait(url)
+
+            async def worker():
+                while True:
+                    try:
+                        url = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    body = await self.fetch(session, url)
+                    if body is not None:
+                        handle(url, body)
+
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(urls)) or 1)))
+        self.validators.save()
+        return self.stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('urls', nargs='*', default=['https://sportzino.com'])
+    parser.add_argument('--concurrency', type=int, default=8, help='total in-flight requests')
+    parser.add_argument('--per-host', type=int, default=2, help='in-flight requests per host')
+    parser.add_argument('--rate', type=float, default=1.0, help='requests per second per host')
+    parser.add_argument('--burst', type=int, default=1)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--max-retry-after', type=float, default=60.0, help='cap on a Retry-After wait, seconds')
+    parser.add_argument('--timeout', type=float, default=20.0)
+    parser.add_argument('--state', default='.crawl_state.json', help='ETag/Last-Modified cache file')
+    parser.add_argument('--proxy', default=os.getenv('SCRAPER_PROXY'))
+    parser.add_argument('--insecure', action='store_true', help='skip TLS verification (proxy MITM)')
+    parser.add_argument('--store', help='append changed odds to this odds_store directory')
+    args = parser.parse_args(argv)
+
+    crawler = Crawler(concurrency=args.concurrency, per_host=args.per_host, rate=args.rate,
+                      burst=args.burst, retries=args.retries, timeout=args.timeout,
+                      validators=ValidatorStore(args.state), proxy=args.proxy,
+                      verify_ssl=not args.insecure, max_retry_after=args.max_retry_after)
+
+    store = None
+    if args.store:
+        from odds_store import OddsStore
+        store = OddsStore(args.store)
+
+    def handle(url, body):
+        games = parse_games(body)
+        for game in games:
+            print(json.dumps({'url': url, **game}))
+        if store is not None:
+            log.info("%s: %d odds changes stored", url, store.ingest(games))
+
+    stats = asyncio.run(crawler.crawl(args.urls, handle))
+    log.info("crawl finished: %s", stats)
+    return stats
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
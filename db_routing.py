@@ -0,0 +1,249 @@
+"""Read/write splitting between the primary database and read replicas.
+
+Replicas are Flask-SQLAlchemy binds (``replica0``, ``replica1``...) that
+no model is mapped to, so ``create_all`` and every write ignore them.
+``RoutingSession.get_bind`` sends a statement to a replica only if
+
+- the view is marked ``@router.read_only``;
+- the client has not written in the last ``pin_seconds`` (its own write
+  may not have replicated yet; the deadline lives in the session cookie);
+- nothing has been written in this request so far (a flush, or an
+  INSERT/UPDATE/DELETE or SELECT ... FOR UPDATE through the session);
+- some replica is healthy: it answered the last probe and, on Postgres,
+  is at most ``max_lag`` seconds behind.
+
+One replica serves the whole request, so its reads agree with each
+other; requests take turns over the healthy ones. Each process probes a
+replica at most every ``check_interval`` seconds, inline on the request
+that finds it due. A replica that fails a request with a connection-level
+error is left out for ``retry_after`` seconds and the view runs again on
+the primary.
+"""
+import contextlib
+import functools
+import itertools
+import logging
+import threading
+import time
+
+from flask import g, has_app_context, has_request_context, request, session
+from flask_login import current_user
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.sql.dml import UpdateBase
+
+log = logging.getLogger(__name__)
+
+REPLICA_PREFIX = 'replica'
+
+_POOL_OPTIONS = {
+    'POOL_SIZE': ('pool_size', int),
+    'MAX_OVERFLOW': ('max_overflow', int),
+    'POOL_TIMEOUT': ('pool_timeout', float),
+    'POOL_RECYCLE': ('pool_recycle', int),
+    'POOL_PRE_PING': ('pool_pre_ping', lambda value: value == '1'),
+}
+
+# Seconds of replay behind the primary; 0 when the replica has replayed
+# everything it received (an idle primary is not lag)
+_PG_LAG = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+
+
+def pool_options(env, prefix):
+    """Engine options from ``<prefix>_POOL_SIZE``, ``_MAX_OVERFLOW``,
+    ``_POOL_TIMEOUT``, ``_POOL_RECYCLE`` and ``_POOL_PRE_PING``; unset ones
+    keep SQLAlchemy's per-dialect defaults."""
+    return {key: convert(env[f'{prefix}_{name}']) for name, (key, convert) in _POOL_OPTIONS.items()
+            if env.get(f'{prefix}_{name}')}
+
+
+def replica_binds(uris, **options):
+    """SQLALCHEMY_BINDS entries for a comma-separated list of replica URIs."""
+    uris = [uri.strip() for uri in uris.split(',') if uri.strip()]
+    return {f'{REPLICA_PREFIX}{i}': dict(options, url=uri) for i, uri in enumerate(uris)}
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy's session with the replica routing described above."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            if self._flushing or isinstance(clause, UpdateBase) or getattr(clause, '_for_update_arg', None):
+                g._db_wrote = True
+            elif not g.get('_db_wrote'):
+                replica = g.get('_db_replica')
+                if replica is not None:
+                    return replica.engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class _Replica:
+    __slots__ = ('key', 'engine', 'down_until', 'checked_at', 'lag', 'error', 'served')
+
+    def __init__(self, key, engine):
+        self.key = key
+        self.engine = engine
+        self.down_until = 0.0
+        self.checked_at = 0.0
+        self.lag = None
+        self.error = None
+        self.served = 0
+
+
+class ReplicaRouter:
+    def __init__(self, db, pin_seconds=5.0, check_interval=5.0, retry_after=30.0, max_lag=10.0):
+        self.db = db
+        self.pin_seconds = pin_seconds
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self.max_lag = max_lag
+        self.fallbacks = 0
+        self._replicas = {}  # bind key -> _Replica
+        self._lock = threading.Lock()
+        self._probing = threading.Lock()
+        self._turn = itertools.count()
+
+    def init_app(self, app):
+        replicas = [key for key in app.config.get('SQLALCHEMY_BINDS') or {} if str(key).startswith(REPLICA_PREFIX)]
+        if not replicas:
+            return
+        for key in replicas:
+            # Flask-SQLAlchemy gives every bind a MetaData; without one,
+            # create_all/drop_all leave the replicas alone
+            self.db.metadatas.pop(key, None)
+        app.after_request(self._pin)
+
+    # per request
+
+    def read_only(self, view):
+        """Runs ``view`` against a replica when one may serve this client
+        (see the module docstring); place it above ``login_required`` so
+        the user is loaded from the replica too. Not for streamed
+        responses: the fallback reruns the view, but a body that is
+        already being sent can't be taken back."""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            g._db_replica = self._choose()
+            g.pop('_db_replica_failed', None)  # from a probe, already handled
+            if g._db_replica is None:
+                return view(*args, **kwargs)
+            try:
+                return view(*args, **kwargs)
+            except OperationalError as e:
+                replica = g.pop('_db_replica_failed', None)
+                if replica is None:
+                    raise
+                self.mark_down(replica, e)
+                self.db.session.rollback()
+                g._db_replica = None
+                with self._lock:
+                    self.fallbacks += 1
+                return view(*args, **kwargs)
+        return wrapper
+
+    @contextlib.contextmanager
+    def use_primary(self):
+        replica, g._db_replica = g.get('_db_replica'), None
+        try:
+            yield
+        finally:
+            g._db_replica = replica
+
+    def _pinned(self):
+        return has_request_context() and session.get('_primary_until', 0) > time.time()
+
+    def _pin(self, response):
+        # A client that just wrote reads from the primary for a while. A
+        # signed-in user's POST may have written outside this session (a
+        # connection of its own), so it pins too; an anonymous one that
+        # wrote nothing doesn't get a session cookie just for this.
+        wrote = g.get('_db_wrote') or (request.method not in ('GET', 'HEAD', 'OPTIONS')
+                                       and current_user.is_authenticated)
+        if wrote:
+            session['_primary_until'] = round(time.time() + self.pin_seconds, 1)
+        return response
+
+    def _choose(self):
+        if self._pinned():
+            return None
+        replicas = self._current()
+        if not replicas:
+            return None
+        self._probe_due(replicas)
+        now = time.monotonic()
+        healthy = [r for r in replicas if r.down_until <= now]
+        if not healthy:
+            return None
+        replica = healthy[next(self._turn) % len(healthy)]
+        with self._lock:
+            replica.served += 1
+        return replica
+
+    def _current(self):
+        replicas = []
+        # Under the lock, so concurrent first requests agree on one _Replica
+        # per engine and register its error listener once
+        with self._lock:
+            for key, engine in self.db.engines.items():
+                if not str(key).startswith(REPLICA_PREFIX):
+                    continue
+                replica = self._replicas.get(key)
+                if replica is None or replica.engine is not engine:
+                    replica = self._replicas[key] = _Replica(key, engine)
+                    event.listen(engine, 'handle_error', functools.partial(self._on_error, replica))
+                replicas.append(replica)
+        return replicas
+
+    @staticmethod
+    def _on_error(replica, context):
+        # Only errors that say the server itself is unusable count against
+        # it; a bad query would fail the same way on the primary.
+        if has_app_context() and (context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError)):
+            g._db_replica_failed = replica
+
+    # health
+
+    def mark_down(self, replica, reason, seconds=None):
+        replica.down_until = time.monotonic() + (self.retry_after if seconds is None else seconds)
+        replica.error = str(getattr(reason, 'orig', None) or reason)[:200]
+        log.warning("replica %s out of rotation: %s", replica.key, replica.error)
+
+    def _probe_due(self, replicas):
+        now = time.monotonic()
+        due = [r for r in replicas if r.down_until <= now and now - r.checked_at >= self.check_interval]
+        # One thread probes; the others go on with the last known state
+        if not due or not self._probing.acquire(blocking=False):
+            return
+        try:
+            for replica in due:
+                self._probe(replica)
+        finally:
+            self._probing.release()
+
+    def _probe(self, replica):
+        replica.checked_at = time.monotonic()
+        try:
+            with replica.engine.connect() as conn:
+                if conn.dialect.name == 'postgresql':
+                    lag = float(conn.execute(_PG_LAG).scalar() or 0)
+                else:
+                    conn.execute(text('SELECT 1'))
+                    lag = 0.0
+        except DBAPIError as e:
+            self.mark_down(replica, e)
+            return
+        replica.lag = lag
+        if lag > self.max_lag:
+            # Re-probed on the normal schedule rather than after retry_after
+            self.mark_down(replica, f"{lag:.1f}s behind the primary", seconds=self.check_interval)
+        else:
+            replica.error = None
+
+    def stats(self):
+        now = time.monotonic()
+        return {"fallbacks": self.fallbacks, "replicas": {
+            r.key: {"healthy": r.down_until <= now, "lag": r.lag, "served": r.served, "error": r.error}
+            for r in self._replicas.values()}}
@@ -0,0 +1,60 @@
+# Gunicorn settings for the single app in app.py (`gunicorn app:app`).
+#
+# GUNICORN_PRELOAD=1 (default) imports the app once in the master and warms
+# templates, mappers and static digests there, so workers share those pages
+# copy-on-write (WARM_UP_IMPORTS=1 also preloads payments and analytics, at
+# the cost of a slower cold start).
+#
+# GUNICORN_WORKER_MODE=threaded (default) runs gthread workers with
+# GUNICORN_THREADS threads each, for the I/O-bound routes (SSE stream,
+# payment gateways, CSV export); `sync` keeps one request per worker.
+# post_fork tells the app which one it runs under (app.configure_stream).
+import gc
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+if os.getenv('GUNICORN_WORKER_MODE', 'threaded') == 'threaded':
+    worker_class = 'gthread'
+    threads = int(os.getenv('GUNICORN_THREADS', '8'))
+else:
+    worker_class = 'sync'
+
+
+def when_ready(server):
+    if preload_app:
+        import app
+        app.warm_up(app.app)
+        # Keep the collector from touching (and un-sharing) the master's
+        # objects in every worker.
+        gc.freeze()
+
+
+def metrics_dir(server):
+    # Workers share /metrics totals through files (see metrics.py); without
+    # METRICS_DIR each server gets its own temporary directory
+    return os.getenv('METRICS_DIR') or os.path.join(tempfile.gettempdir(), f'sportzino-metrics-{server.pid}')
+
+
+def post_fork(server, worker):
+    import app
+    app.after_fork(app.app)
+    app.configure_stream(worker.cfg.worker_class_str, worker.cfg.threads)
+    app.metrics.use_directory(metrics_dir(server))
+
+
+def child_exit(server, worker):
+    # Fold the exited worker's metrics file into the retired totals so the
+    # directory doesn't keep one file per worker ever run.
+    import metrics
+    if os.path.isdir(metrics_dir(server)):
+        metrics.retire(metrics_dir(server), worker.pid)
+
+
+def on_exit(server):
+    if not os.getenv('METRICS_DIR'):
+        shutil.rmtree(metrics_dir(server), ignore_errors=True)
@@ -0,0 +1,342 @@
+"""Durable background jobs on the application database.
+
+``enqueue`` adds a row to the caller's session, so a job commits (or rolls
+back) together with the request's own writes: a registration either
+exists with its activation email queued, or neither does.
+
+Workers claim due jobs with a single UPDATE ... RETURNING that marks them
+running under a lease (``FOR UPDATE SKIP LOCKED`` on Postgres; SQLite
+serialises writers anyway). While a batch runs, the worker renews the
+lease every third of it, so a long job (a big export) is never handed
+to a second worker; a job whose worker dies is claimed again once its
+lease runs out. Each claim hands a handler every due job of one
+kind at once, so e.g. emails go out over one SMTP connection.
+
+A failing job is retried with exponential backoff and jitter until
+``max_attempts``, then left in status ``dead`` (the dead-letter state)
+with its last error for an admin to inspect and ``requeue``. A handler
+raising ``PermanentFailure`` skips the remaining retries.
+
+Delivery is at least once. Jobs whose effects are database writes are
+exactly once: the handler's writes commit in the same transaction that
+marks the job done. Side effects that must only follow that commit
+(telling clients about a new balance) go through ``after_commit``.
+"""
+import contextlib
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+log = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, DEAD = 'queued', 'running', 'done', 'dead'
+
+
+class PermanentFailure(Exception):
+    """Raised (or returned, by batch handlers) for errors retrying cannot fix."""
+
+
+class JobQueue:
+    def __init__(self, db, job_model, max_attempts=5, backoff=30.0, max_backoff=3600.0, lease=300.0):
+        self.db = db
+        self.model = job_model
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.handlers = {}
+        self._deferred = threading.local()
+
+    def handler(self, kind, batch=False):
+        """Registers ``fn`` for ``kind``. A plain handler is called with one
+        payload; a batch handler with a list of payloads and returns one
+        entry per payload: None on success, else the exception."""
+        def register(fn):
+            self.handlers[kind] = (fn, batch)
+            return fn
+        return register
+
+    def after_commit(self, fn):
+        """Called from a handler: runs ``fn()`` once the job's writes are
+        committed, and never if they roll back."""
+        self._pending().append(fn)
+
+    def _pending(self):
+        if not hasattr(self._deferred, 'fns'):
+            self._deferred.fns = []
+        return self._deferred.fns
+
+    def _run_deferred(self, committed):
+        fns, self._deferred.fns = self._pending(), []
+        for fn in fns if committed else ():
+            try:
+                fn()
+            except Exception:
+                log.exception("after-commit callback failed")
+
+    # producer side
+
+    def enqueue(self, kind, payload=None, delay=0, dedupe_key=None, max_attempts=None):
+        """Adds the job to the current session; the caller commits. With a
+        ``dedupe_key`` a second enqueue of the same key is a no-op."""
+        session = self.db.session
+        values = dict(kind=kind, payload=json.dumps(payload or {}), status=QUEUED, attempts=0,
+                      max_attempts=max_attempts or self.max_attempts, dedupe_key=dedupe_key,
+                      run_at=datetime.utcnow() + timedelta(seconds=delay))
+        if dedupe_key is None:
+            job = self.model(**values)
+            session.add(job)
+            return job
+        # The unique key decides between concurrent enqueues: the loser's
+        # insert does nothing and it gets the winner's job
+        dialect = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+        job_id = session.scalar(dialect.insert(self.model).values(**values)
+                                .on_conflict_do_nothing(index_elements=['dedupe_key']).returning(self.model.id))
+        if job_id is None:
+            return session.scalar(select(self.model).filter_by(dedupe_key=dedupe_key))
+        return session.get(self.model, job_id)
+
+    def requeue(self, job_ids):
+        """Gives dead jobs a fresh set of attempts."""
+        result = self.db.session.execute(
+            update(self.model).where(self.model.id.in_(job_ids), self.model.status == DEAD)
+            .values(status=QUEUED, attempts=0, run_at=datetime.utcnow(), locked_by=None, locked_until=None))
+        self.db.session.commit()
+        return result.rowcount
+
+    def stats(self):
+        rows = self.db.session.execute(
+            select(self.model.kind, self.model.status, func.count()).group_by(self.model.kind, self.model.status))
+        out = {}
+        for kind, status, n in rows:
+            out.setdefault(kind, {})[status] = n
+        return out
+
+    # consumer side
+
+    def claim(self, worker_id, limit=50, kinds=None):
+        """Marks up to ``limit`` due jobs, all of one kind, as running for
+        ``worker_id`` and returns them (committed)."""
+        j = self.model
+        now = datetime.utcnow()
+        due = ((j.status == QUEUED) & (j.run_at <= now)) | ((j.status == RUNNING) & (j.locked_until < now))
+        oldest = select(j.kind).where(due)
+        if kinds:
+            oldest = oldest.where(j.kind.in_(kinds))
+        ids = (select(j.id).where(due, j.kind == oldest.order_by(j.run_at, j.id).limit(1).scalar_subquery())
+               .order_by(j.run_at, j.id).limit(limit).with_for_update(skip_locked=True))
+        session = self.db.session
+        claimed = session.scalars(
+            update(j).where(j.id.in_(ids.scalar_subquery()))
+            .values(status=RUNNING, locked_by=worker_id, locked_until=now + timedelta(seconds=self.lease),
+                    attempts=j.attempts + 1)
+            .returning(j.id).execution_options(synchronize_session=False)).all()
+        # Commit before running anything so no lock is held during the work
+        session.commit()
+        if not claimed:
+            return []
+        return session.scalars(select(j).where(j.id.in_(claimed)).order_by(j.run_at, j.id)).all()
+
+    def extend(self, worker_id, job_ids):
+        """Renews the lease on the jobs ``worker_id`` still holds."""
+        j = self.model
+        self.db.session.execute(
+            update(j).where(j.id.in_(job_ids), j.status == RUNNING, j.locked_by == worker_id)
+            .values(locked_until=datetime.utcnow() + timedelta(seconds=self.lease))
+            .execution_options(synchronize_session=False))
+        self.db.session.commit()
+
+    def _done(self, job, result=None):
+        job.status, job.finished_at, job.locked_by, job.locked_until = DONE, datetime.utcnow(), None, None
+        job.result = None if result is None else json.dumps(result)
+        job.last_error = None
+
+    def _failed(self, job, error):
+        job.last_error = f"{type(error).__name__}: {error}"[:2000]
+        job.locked_by = job.locked_until = None
+        if isinstance(error, PermanentFailure) or job.attempts >= job.max_attempts:
+            job.status, job.finished_at = DEAD, datetime.utcnow()
+            log.error("job %s (%s) dead after %d attempts: %s", job.id, job.kind, job.attempts, job.last_error)
+            return
+        delay = min(self.max_backoff, self.backoff * 2 ** (job.attempts - 1))
+        job.status = QUEUED
+        job.run_at = datetime.utcnow() + timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+    def run(self, jobs):
+        """Runs claimed jobs (one kind) through their handler and records
+        each outcome. Returns the number that succeeded."""
+        session = self.db.session
+        fn, batch = self.handlers.get(jobs[0].kind, (None, False))
+        if fn is None:
+            for job in jobs:
+                self._failed(job, PermanentFailure(f"no handler for {job.kind!r}"))
+            session.commit()
+            return 0
+        ok = 0
+        if batch:
+            try:
+                outcomes = fn([json.loads(job.payload) for job in jobs])
+            except Exception as e:
+                log.exception("batch of %d %s jobs failed", len(jobs), jobs[0].kind)
+                session.rollback()
+                self._run_deferred(committed=False)
+                outcomes = [e] * len(jobs)
+            for job, outcome in zip(jobs, outcomes):
+                if outcome is None:
+                    self._done(job)
+                    ok += 1
+                else:
+                    self._failed(job, outcome)
+            session.commit()
+            self._run_deferred(committed=True)
+            return ok
+        for job in jobs:
+            try:
+                result = fn(json.loads(job.payload))
+                self._done(job, result)
+                session.commit()  # the handler's writes and DONE land together
+                ok += 1
+            except Exception as e:
+                log.exception("job %s (%s) failed", job.id, job.kind)
+                session.rollback()
+                self._run_deferred(committed=False)
+                self._failed(job, e)
+                session.commit()
+                continue
+            self._run_deferred(committed=True)
+        return ok
+
+
+class Worker:
+    """Polls ``queue`` inside ``app``'s context until stopped. Idle polls
+    back off from ``poll_interval`` up to ``max_idle``."""
+
+    def __init__(self, queue, app, kinds=None, batch_size=50, poll_interval=0.5, max_idle=5.0, name=None):
+        self.queue = queue
+        self.app = app
+        self.kinds = kinds
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_idle = max_idle
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = threading.Event()
+
+    def run_once(self):
+        with self.app.app_context():
+            jobs = self.queue.claim(self.name, self.batch_size, self.kinds)
+            if not jobs:
+                return 0
+            with self._renewing([job.id for job in jobs]):
+                self.queue.run(jobs)
+            return len(jobs)
+
+    @contextlib.contextmanager
+    def _renewing(self, job_ids):
+        # Renews the lease from a side thread (own app context, so its own
+        # session) for as long as the batch runs
+        done = threading.Event()
+
+        def renew():
+            while not done.wait(self.queue.lease / 3):
+                try:
+                    with self.app.app_context():
+                        self.queue.extend(self.name, job_ids)
+                except Exception:
+                    log.exception("worker %s could not renew its lease", self.name)
+
+        thread = threading.Thread(target=renew, daemon=True, name='job-lease')
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def drain(self):
+        """Runs until nothing is due; returns how many jobs ran."""
+        total = 0
+        while True:
+            n = self.run_once()
+            if not n:
+                return total
+            total += n
+
+    def run(self):
+        idle = self.poll_interval
+        while not self.stopping.is_set():
+            try:
+                n = self.run_once()
+            except Exception:
+                log.exception("worker %s poll failed", self.name)
+                n = 0
+            if n:
+                idle = self.poll_interval
+            else:
+                self.stopping.wait(idle)
+                idle = min(self.max_idle, idle * 2)
+
+    def stop(self, *_):
+        self.stopping.set()
+
+
+def run_workers(make_worker, processes=1, after_fork=None):
+    """Runs ``processes`` forked workers (each from ``make_worker()``),
+    restarting any that die, until SIGTERM/SIGINT; a stop lets each finish
+    the batch it holds. With one process the worker runs in this one."""
+    if processes <= 1:
+        worker = make_worker()
+        signal.signal(signal.SIGTERM, worker.stop)
+        signal.signal(signal.SIGINT, worker.stop)
+        worker.run()
+        return
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    children = {}
+    while not stopping.is_set():
+        while len(children) < processes:
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    if after_fork is not None:
+                        after_fork()
+                    worker = make_worker()
+                    signal.signal(signal.SIGTERM, worker.stop)
+                    signal.signal(signal.SIGINT, worker.stop)
+                    worker.run()
+                except BaseException:
+                    log.exception("worker process crashed")
+                    code = 1
+                finally:
+                    os._exit(code)
+            children[pid] = time.monotonic()
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid:
+            log.warning("worker %d exited with status %d; restarting", pid, status)
+            if time.monotonic() - children.pop(pid, 0) < 1:
+                time.sleep(1)  # don't spin on a worker that dies at startup
+        else:
+            stopping.wait(0.5)
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in children:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
@@ -0,0 +1,65 @@
+import csv
+import io
+import zlib
+from datetime import datetime
+
+from pagination import date_bounds
+
+HEADER = ['ID', 'Full Name', 'Email', 'Phone', 'Country', 'Wallet/SSN', 'ID File', 'Date']
+
+
+def parse_filters(args):
+    # Accepts from_id/to_id and since/until (ISO dates or datetimes), all
+    # inclusive. Raises ValueError on malformed ids or dates.
+    filters = {}
+    for key in ('from_id', 'to_id'):
+        if args.get(key):
+            filters[key] = int(args[key])
+    for key in ('since', 'until'):
+        if args.get(key):
+            datetime.fromisoformat(args[key])
+            filters[key] = args[key]
+    return filters
+
+
+def iter_rows(db, model, chunk_size=1000, from_id=None, to_id=None, since=None, until=None):
+    # Keyset pagination on the primary key: every chunk is an index range
+    # scan and only the exported columns are loaded, never ORM objects.
+    columns = [model.id, model.full_name, model.email, model.phone, model.country,
+               model.wallet_or_ssn, model.id_file, model.date]
+    last_id = from_id - 1 if from_id is not None else None
+    while True:
+        q = db.session.query(*columns)
+        if last_id is not None:
+            q = q.filter(model.id > last_id)
+        if to_id is not None:
+            q = q.filter(model.id <= to_id)
+        q = q.filter(*date_bounds(model.date, since, until))
+        chunk = q.order_by(model.id).limit(chunk_size).all()
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+        if len(chunk) < chunk_size:
+            return
+
+
+def iter_csv(db, model, chunk_size=1000, **filters):
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(HEADER)
+    yield buf.getvalue()
+    for chunk in iter_rows(db, model, chunk_size=chunk_size, **filters):
+        buf.seek(0)
+        buf.truncate()
+        w.writerows(chunk)
+        yield buf.getvalue()
+
+
+def gzip_stream(chunks, level=6):
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = z.compress(chunk.encode())
+        if data:
+            yield data
+    yield z.flush()
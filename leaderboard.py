@@ -0,0 +1,116 @@
+import hashlib
+import json
+import threading
+import time
+
+
+class Leaderboard:
+    """Top-N freeplay rewards kept in a small summary table.
+
+    ``record`` is called inside the same transaction that inserts the
+    FreeplayEntry, so the summary never drifts from the source table and
+    reads never have to sort FreeplayEntry.
+
+    Once the board is full its lowest reward only ever rises, so each
+    process keeps the last one it saw (``_floor``). An entry at or below it
+    cannot place and costs no query; one above it is inserted and the
+    board trimmed, which also refreshes the floor.
+    """
+
+    def __init__(self, db, entry_model, board_model, size=10, ttl=5.0):
+        self.db = db
+        self.entry_model = entry_model
+        self.board_model = board_model
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._cached = None
+        self._cached_at = 0.0
+        self._floor = None  # lowest reward on a full board, as last seen
+
+    def record(self, entry):
+        floor = self._floor
+        if floor is not None and entry.reward <= floor:
+            return False
+        if entry.id is None:
+            self.db.session.flush()
+        self.db.session.add(self._row_for(entry))
+        return self._trim(entry.id)
+
+    def record_many(self, entries):
+        # Only the best ``size`` entries of a batch can possibly place.
+        best = sorted(entries, key=lambda e: (-e.reward, e.id))[:self.size]
+        return any([self.record(entry) for entry in best])
+
+    def rebuild(self):
+        entry = self.entry_model
+        top = (entry.query
+               .order_by(entry.reward.desc(), entry.id.asc())
+               .limit(self.size)
+               .all())
+        self.board_model.query.delete()
+        self.db.session.add_all([self._row_for(e) for e in top])
+        self.db.session.commit()
+        self.clear()
+        return len(top)
+
+    def invalidate(self):
+        with self._lock:
+            self._cached = None
+
+    def clear(self):
+        """Forgets the floor as well, for when the board may have shrunk
+        (rebuilt, or the tables recreated)."""
+        with self._lock:
+            self._cached = None
+            self._floor = None
+
+    def snapshot(self):
+        # Returns (body, etag); body is the serialized JSON payload.
+        with self._lock:
+            if self._cached and time.monotonic() - self._cached_at < self.ttl:
+                return self._cached
+        rows = self._ranked().limit(self.size).all()
+        if len(rows) >= self.size:
+            self._raise_floor(rows[-1].reward)
+        body = json.dumps({"leaderboard": [
+            {
+                "user_id": r.user_id,
+                "referral_code": r.referral_code,
+                "amount": r.reward,
+                "timestamp": r.timestamp.strftime('%Y-%m-%d %H:%M')
+            } for r in rows
+        ]}, separators=(',', ':')).encode()
+        etag = hashlib.sha1(body).hexdigest()
+        with self._lock:
+            self._cached = (body, etag)
+            self._cached_at = time.monotonic()
+        return body, etag
+
+    def _ranked(self):
+        board = self.board_model
+        return board.query.order_by(board.reward.desc(), board.entry_id.asc())
+
+    def _trim(self, entry_id):
+        # Returns whether ``entry_id`` kept its place
+        board = self.board_model
+        self.db.session.flush()
+        keep = self._ranked().with_entities(board.id, board.entry_id, board.reward).limit(self.size).all()
+        if len(keep) >= self.size:
+            board.query.filter(board.id.notin_([r.id for r in keep])).delete(synchronize_session=False)
+            self._raise_floor(keep[-1].reward)
+        return any(r.entry_id == entry_id for r in keep)
+
+    def _raise_floor(self, reward):
+        with self._lock:
+            if self._floor is None or reward > self._floor:
+                self._floor = reward
+
+    def _row_for(self, entry):
+        return self.board_model(
+            entry_id=entry.id,
+            user_id=entry.user_id,
+            referral_code=entry.referral_code,
+            reward=entry.reward,
+            timestamp=entry.timestamp,
+        )
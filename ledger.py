@@ -0,0 +1,83 @@
+from collections import defaultdict
+
+from sqlalchemy import bindparam, func, insert, select, update
+
+
+def credit(db, user_model, txn_model, user_id, amount, kind):
+    """Append a ledger row and apply it to the user balance atomically.
+
+    The balance is bumped by the database (``balance = balance + :amount``)
+    so concurrent credits for one user never lose an update and no worker
+    reads the row first. Returns the new (balance, version_id).
+    """
+    db.session.add(txn_model(user_id=user_id, amount=amount, type=kind))
+    return _bump(db, user_model, user_id, amount, 1)
+
+
+def credit_many(db, user_model, txn_model, credits):
+    """Batch form of ``credit`` for (user_id, amount, kind, timestamp) tuples.
+
+    Ledger rows go in as one executemany and each distinct user gets a
+    single summed increment. Returns {user_id: (balance, version_id)}.
+    """
+    db.session.execute(insert(txn_model), [
+        {'user_id': user_id, 'amount': amount, 'type': kind, 'timestamp': ts}
+        for user_id, amount, kind, ts in credits
+    ])
+    per_user = defaultdict(lambda: [0.0, 0])
+    for user_id, amount, _, _ in credits:
+        per_user[user_id][0] += amount
+        per_user[user_id][1] += 1
+    return {user_id: _bump(db, user_model, user_id, total, n)
+            for user_id, (total, n) in sorted(per_user.items())}
+
+
+def _bump(db, user_model, user_id, amount, versions):
+    # version_id advances once per ledger row so clients can predict the
+    # version their credit will produce.
+    users = user_model.__table__
+    stmt = (update(users)
+            .where(users.c.id == user_id)
+            .values(balance=func.coalesce(users.c.balance, 0) + amount,
+                    version_id=users.c.version_id + versions)
+            .returning(users.c.balance, users.c.version_id))
+    balance, version = db.session.execute(stmt).one()
+    # SQLite hands RETURNING values back before column affinity is applied
+    return float(balance), version
+
+
+def mismatches(db, user_model, txn_model, tolerance=1e-6):
+    # One bulk pass: ledger sums grouped per user, joined against balances.
+    totals = (select(txn_model.user_id, func.sum(txn_model.amount).label('total'))
+              .group_by(txn_model.user_id)
+              .subquery())
+    derived = func.coalesce(totals.c.total, 0)
+    stmt = (select(user_model.id, user_model.balance, derived.label('derived'))
+            .outerjoin(totals, totals.c.user_id == user_model.id)
+            .where(func.abs(func.coalesce(user_model.balance, 0) - derived) > tolerance)
+            .order_by(user_model.id))
+    return db.session.execute(stmt.execution_options(yield_per=1000))
+
+
+def adopt(db, txn_model, rows):
+    # Records each difference as an 'adjustment' entry, e.g. for balances
+    # that predate the ledger. The ledger stays append-only.
+    n = 0
+    for user_id, balance, derived in rows:
+        db.session.add(txn_model(user_id=user_id, amount=(balance or 0) - derived, type='adjustment'))
+        n += 1
+    db.session.commit()
+    return n
+
+
+def reset(db, user_model, rows):
+    # Overwrites drifted balances with the ledger-derived value.
+    users = user_model.__table__
+    params = [{'uid': user_id, 'derived': derived} for user_id, _, derived in rows]
+    if params:
+        db.session.execute(
+            update(users).where(users.c.id == bindparam('uid'))
+            .values(balance=bindparam('derived'), version_id=users.c.version_id + 1),
+            params)
+    db.session.commit()
+    return len(params)
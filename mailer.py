@@ -0,0 +1,149 @@
+"""Outbound email over a small pool of persistent SMTP connections.
+
+Opening an SMTP session costs a TCP (and often TLS) handshake plus EHLO
+and AUTH round trips, several times the cost of sending one message.
+``send_many`` pushes a whole batch through one connection, and idle
+connections are kept for ``idle_timeout`` seconds for the next batch. A
+connection the server has closed is replaced and the message retried
+once.
+"""
+import logging
+import os
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+from email.utils import make_msgid
+
+log = logging.getLogger(__name__)
+
+
+class Mailer:
+    def __init__(self, host='localhost', port=1025, username=None, password=None, starttls=False,
+                 use_ssl=False, sender='no-reply@localhost', pool_size=2, idle_timeout=30.0, timeout=10.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.use_ssl = use_ssl
+        self.sender = sender
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.connects = 0
+        self._idle = []  # [(connection, last_used)]
+        self._lock = threading.Lock()
+        self._pid = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            host=os.getenv('SMTP_HOST', 'localhost'),
+            port=int(os.getenv('SMTP_PORT', '1025')),
+            username=os.getenv('SMTP_USERNAME'),
+            password=os.getenv('SMTP_PASSWORD'),
+            starttls=os.getenv('SMTP_STARTTLS') == '1',
+            use_ssl=os.getenv('SMTP_SSL') == '1',
+            sender=os.getenv('MAIL_FROM', 'no-reply@localhost'),
+            pool_size=int(os.getenv('SMTP_POOL_SIZE', '2')),
+            idle_timeout=float(os.getenv('SMTP_IDLE_TIMEOUT', '30')),
+        )
+
+    def message(self, to, subject, html, text=None):
+        msg = EmailMessage()
+        msg['From'] = self.sender
+        msg['To'] = to
+        msg['Subject'] = subject
+        msg['Message-ID'] = make_msgid()
+        msg.set_content(text or 'This message is best viewed as HTML.')
+        msg.add_alternative(html, subtype='html')
+        return msg
+
+    def _connect(self):
+        cls = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        conn = cls(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            conn.starttls()
+        if self.username:
+            conn.login(self.username, self.password)
+        self.connects += 1
+        return conn
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle, self._pid = [], os.getpid()  # never share a socket across a fork
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if time.monotonic() - last_used < self.idle_timeout:
+                    return conn
+                _quit(conn)
+        return self._connect()
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((conn, time.monotonic()))
+                return
+        _quit(conn)
+
+    def send_many(self, messages):
+        """Sends every message over one pooled connection. Returns one entry
+        per message: None if the server accepted it, else the exception."""
+        outcomes = []
+        conn = None
+        for n, msg in enumerate(messages):
+            for attempt in (1, 2):
+                if conn is None:
+                    try:
+                        conn = self._acquire()
+                    except (smtplib.SMTPException, OSError) as e:
+                        # Server unreachable: the rest of the batch would fail alike
+                        return outcomes + [e] * (len(messages) - n)
+                try:
+                    conn.send_message(msg)
+                    outcomes.append(None)
+                    break
+                except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                    # Stale pooled connection (or a drop mid-batch): reconnect once
+                    _quit(conn)
+                    conn = None
+                    if attempt == 2:
+                        outcomes.append(e)
+                except (smtplib.SMTPException, OSError) as e:
+                    if isinstance(e, smtplib.SMTPResponseException) and conn is not None:
+                        try:
+                            conn.rset()
+                        except smtplib.SMTPException:
+                            _quit(conn)
+                            conn = None
+                    elif not isinstance(e, smtplib.SMTPRecipientsRefused):
+                        _quit(conn)
+                        conn = None
+                    outcomes.append(e)
+                    break
+        if conn is not None:
+            self._release(conn)
+        return outcomes
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            _quit(conn)
+
+
+def is_permanent(error):
+    # 5xx replies and refused recipients will fail the same way next time
+    return (isinstance(error, smtplib.SMTPRecipientsRefused)
+            or isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500)
+
+
+def _quit(conn):
+    if conn is None:
+        return
+    try:
+        conn.quit()
+    except (smtplib.SMTPException, OSError):
+        conn.close()
@@ -0,0 +1,293 @@
+"""Per-route request timing, SQL accounting and Prometheus exposition.
+
+Every request records its wall time, the number of SQL statements it ran
+and the time spent in them, plus named sections (template rendering,
+password hashing) into histograms labelled by endpoint. A statement that
+repeats ``n_plus_one`` times within one request is logged as a likely
+N+1 query. A request is recorded when its response is closed, so a
+streamed body's time and queries count too.
+
+With ``directory`` set (METRICS_DIR; under gunicorn a per-server temp
+directory otherwise, see gunicorn.conf.py), each worker process
+periodically writes its cumulative totals to
+``<directory>/metrics-<pid>-<token>.json`` and ``render()`` sums every
+file it finds, so a scrape that lands on any gunicorn worker reports the
+whole server. When a worker exits, gunicorn's ``child_exit`` hook calls
+``retire``, which folds its file into ``metrics-retired.json`` and
+deletes it: counters never go backwards and the directory holds one file
+per live worker plus one. The token keeps a later worker that gets the
+same pid apart from the retired one.
+"""
+import atexit
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+RETIRED = 'metrics-retired.json'
+
+FAMILIES = {
+    'http_request_duration_seconds': (
+        'histogram', ('route', 'method'), 'Request wall time until the response body is sent.'),
+    'http_requests_total': (
+        'counter', ('route', 'method', 'status'), 'Requests by route, method and status.'),
+    'db_queries_per_request': (
+        'histogram', ('route',), 'SQL statements executed per request.'),
+    'db_query_duration_seconds': (
+        'histogram', ('route',), 'Total time spent in SQL per request.'),
+    'section_duration_seconds': (
+        'histogram', ('route', 'section'), 'Time spent in named sections (template, hash) per request.'),
+    'db_n_plus_one_total': (
+        'counter', ('route',), 'Requests that repeated one statement at least the N+1 threshold.'),
+}
+
+
+class Metrics:
+    def __init__(self, app=None, directory=None, n_plus_one=10, flush_interval=1.0):
+        self.directory = directory
+        self.n_plus_one = n_plus_one
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._hist = {}
+        self._counters = {}
+        self._flushed = 0.0
+        self._file = None  # (pid, name) of this process's file
+        self._flush_at_exit = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._close_with)
+        # Class-level listeners cover every engine, including ones created later.
+        if not event.contains(Engine, 'before_cursor_execute', self._before_cursor):
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor)
+        before_render_template.connect(self._before_render, app, weak=False)
+        template_rendered.connect(self._after_render, app, weak=False)
+        if self.directory:
+            self.use_directory(self.directory)
+
+    def use_directory(self, directory):
+        """Shares this process's totals through ``directory`` from now on."""
+        os.makedirs(directory, exist_ok=True)
+        if not self._flush_at_exit:
+            self._flush_at_exit = True
+            atexit.register(lambda: self.directory and self.flush())
+        self.directory = directory
+
+    # per-request state
+
+    def _start(self):
+        state = self._local
+        state.start = time.perf_counter()
+        state.queries = 0
+        state.query_time = 0.0
+        state.statements = {}
+        state.sections = {}
+        state.active = True
+
+    def _close_with(self, resp):
+        # The body may still be streaming (and querying): record on close
+        if getattr(self._local, 'active', False):
+            labels = (request.endpoint or 'unmatched', request.method, str(resp.status_code))
+            resp.call_on_close(lambda: self._finish(*labels))
+        return resp
+
+    def _finish(self, route, method, status):
+        state = self._local
+        if not getattr(state, 'active', False):
+            return
+        state.active = False
+        elapsed = time.perf_counter() - state.start
+        repeated = max(state.statements.items(), key=lambda kv: kv[1], default=(None, 0))
+        with self._lock:
+            self._observe('http_request_duration_seconds', (route, method), elapsed, BUCKETS)
+            self._inc('http_requests_total', (route, method, status))
+            self._observe('db_queries_per_request', (route,), state.queries, QUERY_BUCKETS)
+            self._observe('db_query_duration_seconds', (route,), state.query_time, BUCKETS)
+            for section, seconds in state.sections.items():
+                self._observe('section_duration_seconds', (route, section), seconds, BUCKETS)
+            if repeated[1] >= self.n_plus_one:
+                self._inc('db_n_plus_one_total', (route,))
+        if repeated[1] >= self.n_plus_one:
+            log.warning("possible N+1 on %s: %d executions of %s", route, repeated[1],
+                        ' '.join(repeated[0].split())[:200])
+        if self.directory and time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def _before_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    def _after_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        state = self._local
+        if getattr(state, 'active', False):
+            state.queries += 1
+            state.query_time += time.perf_counter() - context._metrics_start
+            state.statements[statement] = state.statements.get(statement, 0) + 1
+
+    def _before_render(self, sender, template, context, **extra):
+        self._local.render_start = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        started = getattr(self._local, 'render_start', None)
+        if started is not None:
+            self._add_section('template', time.perf_counter() - started)
+
+    @contextmanager
+    def section(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_section(name, time.perf_counter() - started)
+
+    def _add_section(self, name, seconds):
+        state = self._local
+        if getattr(state, 'active', False):
+            state.sections[name] = state.sections.get(name, 0.0) + seconds
+
+    # aggregation
+
+    def _observe(self, name, labels, value, buckets):
+        series = self._hist.setdefault(name, {})
+        h = series.get(labels)
+        if h is None:
+            h = series[labels] = {'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                h['counts'][i] += 1
+        h['sum'] += value
+        h['count'] += 1
+
+    def _inc(self, name, labels, value=1):
+        series = self._counters.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + value
+
+    def _dump(self):
+        with self._lock:
+            return {
+                'hist': {name: [[list(labels), dict(h, counts=list(h['counts']))] for labels, h in series.items()]
+                         for name, series in self._hist.items()},
+                'counters': {name: [[list(labels), v] for labels, v in series.items()]
+                             for name, series in self._counters.items()},
+            }
+
+    def _filename(self):
+        # A fresh token per process: a forked worker must not write its
+        # parent's file, nor a later worker with a reused pid a retired one
+        if self._file is None or self._file[0] != os.getpid():
+            self._file = (os.getpid(), f'metrics-{os.getpid()}-{secrets.token_hex(4)}.json')
+        return self._file[1]
+
+    def flush(self):
+        self._flushed = time.monotonic()
+        path = os.path.join(self.directory, self._filename())
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._dump(), f)
+        os.replace(tmp, path)
+
+    def _collect(self):
+        if not self.directory:
+            return [self._dump()]
+        self.flush()
+        # The retired totals name the files they include, which may not be
+        # deleted yet
+        retired = _read(os.path.join(self.directory, RETIRED))
+        dumps = [retired] if retired else []
+        folded = set(retired['files']) if retired else set()
+        for name in os.listdir(self.directory):
+            if name.startswith('metrics-') and name.endswith('.json') and name != RETIRED and name not in folded:
+                dump = _read(os.path.join(self.directory, name))
+                if dump:
+                    dumps.append(dump)
+        return dumps
+
+    def render(self):
+        hist, counters = _merge(self._collect())
+        lines = []
+        for name, (kind, names, text) in FAMILIES.items():
+            series = (hist if kind == 'histogram' else counters).get(name)
+            if not series:
+                continue
+            lines += [f'# HELP {name} {text}', f'# TYPE {name} {kind}']
+            for labels, value in sorted(series.items()):
+                base = _labels(names, labels)
+                if kind == 'counter':
+                    lines.append(f'{name}{{{base}}} {value}')
+                    continue
+                for bound, count in zip(value['buckets'], value['counts']):
+                    lines.append(f'{name}_bucket{{{base},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{base},le="+Inf"}} {value["count"]}')
+                lines.append(f'{name}_sum{{{base}}} {value["sum"]:.6f}')
+                lines.append(f'{name}_count{{{base}}} {value["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # a worker is mid-replace or the file vanished
+
+
+def _merge(dumps):
+    hist, counters = {}, {}
+    for dump in dumps:
+        for name, series in dump['hist'].items():
+            for labels, h in series:
+                agg = hist.setdefault(name, {}).setdefault(tuple(labels), {
+                    'buckets': h['buckets'], 'counts': [0] * len(h['counts']), 'sum': 0.0, 'count': 0})
+                agg['counts'] = [a + b for a, b in zip(agg['counts'], h['counts'])]
+                agg['sum'] += h['sum']
+                agg['count'] += h['count']
+        for name, series in dump['counters'].items():
+            for labels, v in series:
+                key = tuple(labels)
+                counters.setdefault(name, {})[key] = counters.get(name, {}).get(key, 0) + v
+    return hist, counters
+
+
+def retire(directory, pid):
+    """Adds exited worker ``pid``'s totals to the retired file, then
+    deletes its own. Called by the gunicorn master, one worker at a time,
+    after reaping ``pid`` and before any new worker can reuse it."""
+    prefix = f'metrics-{pid}-'
+    names = [n for n in os.listdir(directory) if n.startswith(prefix) and n.endswith('.json')]
+    dead = [dump for dump in (_read(os.path.join(directory, n)) for n in names) if dump]
+    if not dead:
+        return
+    retired_path = os.path.join(directory, RETIRED)
+    retired = _read(retired_path) or {'hist': {}, 'counters': {}, 'files': []}
+    hist, counters = _merge([retired] + dead)
+    files = [n for n in retired['files'] if os.path.exists(os.path.join(directory, n))]
+    tmp = f'{retired_path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'hist': {name: [[list(labels), h] for labels, h in series.items()]
+                            for name, series in hist.items()},
+                   'counters': {name: [[list(labels), v] for labels, v in series.items()]
+                                for name, series in counters.items()},
+                   'files': files + names}, f)
+    os.replace(tmp, retired_path)
+    for name in names:
+        os.unlink(os.path.join(directory, name))
+
+
+def _labels(names, values):
+    def escape(v):
+        return str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return ','.join(f'{n}="{escape(v)}"' for n, v in zip(names, values))
@@ -0,0 +1,194 @@
+"""Append-only columnar store for scraped odds.
+
+Layout of a store directory:
+
+- ``strings.json``  interned league/team names, id = list index
+- ``matches.i4``    (title_id, team1_id, team2_id) per match, id = row
+- ``ts.i8``, ``match.i4``, ``slot.i2``, ``value.f8``  one row per odds change
+- ``state.json``    the committed row and match counts, and the last seen
+  value per (match, slot), used for diffing
+
+Column files are raw little-endian arrays read through ``np.memmap``, so
+queries page in only what they touch. Rows are appended in timestamp order;
+``ingest`` refuses an explicit timestamp older than the last committed row
+and holds the wall clock at that row if it steps back, so ``history`` can
+binary-search the ts column.
+
+An ingest appends to the column files, fsyncs them and only then
+replaces ``state.json`` (temp file plus rename), so the commit is that
+one rename. Opening a store truncates every file to the committed
+counts, dropping whatever a crashed or failed ingest left behind (all of
+it when ``state.json`` doesn't exist yet).
+``strings.json`` is saved before the commit; it only ever grows, so a
+superset of the committed strings is harmless.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+COLUMNS = {'ts': '<i8', 'match': '<i4', 'slot': '<i2', 'value': '<f8'}
+SCAN_BLOCK = 1 << 20
+
+
+def parse_odds(text):
+    text = text.strip()
+    try:
+        if '/' in text:
+            num, den = text.split('/', 1)
+            return float(num) / float(den) + 1.0
+        return float(text)
+    except (ValueError, ZeroDivisionError):
+        return float('nan')
+
+
+class OddsStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        state = self._load_json('state.json', {'rows': 0, 'matches': 0, 'latest': {}})
+        self.rows = state['rows']
+        self._truncate(state['matches'])
+        ts = self._column('ts.i8', COLUMNS['ts'])
+        self.last_ts = int(ts[self.rows - 1]) if self.rows else None
+        self.strings = self._load_json('strings.json', [])
+        self._string_ids = {s: i for i, s in enumerate(self.strings)}
+        matches = self._column('matches.i4', '<i4').reshape(-1, 3)
+        self._match_ids = {tuple(int(x) for x in row): i for i, row in enumerate(matches)}
+        self.latest = {tuple(int(x) for x in k.split(':')): v for k, v in state['latest'].items()}
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load_json(self, name, default):
+        try:
+            with open(self._file(name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+    def _save_json(self, name, data):
+        tmp = self._file(name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._file(name))
+
+    def _truncate(self, matches):
+        sizes = {f'{name}.{dtype[1:]}': self.rows * np.dtype(dtype).itemsize for name, dtype in COLUMNS.items()}
+        sizes['matches.i4'] = matches * 12
+        for name, size in sizes.items():
+            path = self._file(name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def _column(self, name, dtype):
+        path = self._file(name)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def intern(self, s):
+        sid = self._string_ids.get(s)
+        if sid is None:
+            sid = self._string_ids[s] = len(self.strings)
+            self.strings.append(s)
+        return sid
+
+    def match_id(self, title, team1, team2):
+        key = (self.intern(title), self.intern(team1), self.intern(team2))
+        mid = self._match_ids.get(key)
+        if mid is None:
+            mid = self._match_ids[key] = len(self._match_ids)
+            with open(self._file('matches.i4'), 'ab') as f:
+                f.write(np.array(key, dtype='<i4').tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        return mid
+
+    def ingest(self, games, ts=None):
+        """Appends only the odds that changed since the previous snapshot.
+        ``games`` are parse_games() dicts; ``ts`` (seconds) defaults to now.
+        Returns the number of rows written."""
+        if ts is None:
+            ts = int(time.time() * 1000)
+            if self.last_ts is not None:
+                ts = max(ts, self.last_ts)
+        else:
+            ts = int(ts * 1000)
+            if self.last_ts is not None and ts < self.last_ts:
+                raise ValueError(f"timestamp {ts}ms is before the last stored row ({self.last_ts}ms)")
+        matches, slots, values, changed = [], [], [], {}
+        n_matches = len(self._match_ids)
+        try:
+            for game in games:
+                mid = self.match_id(game['title'], game['team1'], game['team2'])
+                for slot, raw in enumerate(game['odds']):
+                    value = parse_odds(raw)
+                    prev = changed.get((mid, slot), self.latest.get((mid, slot)))
+                    if prev is not None and (prev == value or (prev != prev and value != value)):
+                        continue
+                    changed[(mid, slot)] = value
+                    matches.append(mid)
+                    slots.append(slot)
+                    values.append(value)
+            if matches:
+                cols = {
+                    'ts': np.full(len(matches), ts, dtype=COLUMNS['ts']),
+                    'match': np.asarray(matches, dtype=COLUMNS['match']),
+                    'slot': np.asarray(slots, dtype=COLUMNS['slot']),
+                    'value': np.asarray(values, dtype=COLUMNS['value']),
+                }
+                for name, arr in cols.items():
+                    with open(self._file(f'{name}.{COLUMNS[name][1:]}'), 'ab') as f:
+                        f.write(arr.tobytes())
+                        f.flush()
+                        os.fsync(f.fileno())
+            self._save_json('strings.json', self.strings)
+            latest = {**self.latest, **changed}
+            self._save_json('state.json', {'rows': self.rows + len(matches), 'matches': len(self._match_ids),
+                                           'latest': {f'{m}:{s}': v for (m, s), v in latest.items()}})
+        except BaseException:
+            # Back to the last commit, so the next ingest appends in line
+            self._truncate(n_matches)
+            for key in list(self._match_ids)[n_matches:]:
+                del self._match_ids[key]
+            raise
+        self.rows += len(matches)
+        self.latest = latest
+        if matches:
+            self.last_ts = ts
+        return len(matches)
+
+    def columns(self):
+        # Committed rows only; an ingest in progress may have appended more
+        cols = {name: self._column(f'{name}.{dtype[1:]}', dtype) for name, dtype in COLUMNS.items()}
+        return {name: c[:self.rows] for name, c in cols.items()}
+
+    def history(self, match_id, start=None, end=None):
+        """Odds rows for one match as (ts_ms, slot, value) arrays.
+
+        Time bounds are binary searches on the sorted ts column; the match
+        filter then scans only that window, one block at a time."""
+        cols = self.columns()
+        ts = cols['ts']
+        lo = 0 if start is None else int(np.searchsorted(ts, int(start * 1000), 'left'))
+        hi = len(ts) if end is None else int(np.searchsorted(ts, int(end * 1000), 'right'))
+        picks = []
+        for block in range(lo, hi, SCAN_BLOCK):
+            stop = min(block + SCAN_BLOCK, hi)
+            picks.append(block + np.flatnonzero(cols['match'][block:stop] == match_id))
+        idx = np.concatenate(picks) if picks else np.zeros(0, dtype=np.int64)
+        return np.asarray(ts[idx]), np.asarray(cols['slot'][idx]), np.asarray(cols['value'][idx])
+
+    def find_matches(self, team):
+        sid = self._string_ids.get(team)
+        return [mid for (title, t1, t2), mid in self._match_ids.items() if sid in (t1, t2)]
+
+    def describe(self, match_id):
+        for key, mid in self._match_ids.items():
+            if mid == match_id:
+                return tuple(self.strings[i] for i in key)
+        raise KeyError(match_id)
@@ -0,0 +1,88 @@
+import base64
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import String
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    # Raises ValueError on a tampered or malformed cursor.
+    if not token:
+        return None
+    padded = token + '=' * (-len(token) % 4)
+    try:
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ValueError('invalid cursor') from e
+
+
+def keyset_page(query, id_col, cursor, limit):
+    # Fetches one row past the limit to know whether another page exists,
+    # so no count is needed to paginate.
+    after = decode_cursor(cursor)
+    if after is not None:
+        query = query.filter(id_col > after)
+    rows = query.order_by(id_col).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (encode_cursor(rows[-1].id) if more else None)
+
+
+def date_bounds(column, since=None, until=None):
+    """Filter clauses for an inclusive since/until range on ``column``, a
+    DateTime or an ISO-string column. A bare YYYY-MM-DD ``until`` covers
+    the whole day: compared as-is it would stop at that day's midnight, so
+    it becomes ``< next day``. Raises ValueError on malformed dates."""
+    as_text = isinstance(column.type, String)
+    clauses = []
+    if since:
+        start = datetime.fromisoformat(since)
+        clauses.append(column >= (start.isoformat() if as_text else start))
+    if until:
+        if len(until) == len('YYYY-MM-DD'):
+            end = datetime.combine(date.fromisoformat(until) + timedelta(days=1), datetime.min.time())
+            clauses.append(column < (end.isoformat() if as_text else end))
+        else:
+            end = datetime.fromisoformat(until)
+            clauses.append(column <= (end.isoformat() if as_text else end))
+    return clauses
+
+
+def page_size(value, default=50, maximum=500):
+    try:
+        size = int(value) if value else default
+    except ValueError:
+        return default
+    return max(1, min(size, maximum))
+
+
+class CountCache:
+    """Per-process TTL cache for COUNT(*) results keyed by table and filters."""
+
+    def __init__(self, ttl=30.0, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def get(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._values.get(key)
+            if hit and now - hit[1] < self.ttl:
+                return hit[0]
+        value = compute()
+        with self._lock:
+            if len(self._values) >= self.max_entries:
+                self._values.clear()
+            self._values[key] = (value, now)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
@@ -0,0 +1,69 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Runs password hashing on a bounded thread pool.
+
+    hashlib's scrypt and pbkdf2 release the GIL, so the pool keeps hashes
+    off the request thread's critical section under threaded workers, and
+    the semaphore caps how many hashes can be queued at once. Callers that
+    cannot get a slot within ``timeout`` seconds get HasherBusy instead of
+    piling up behind a login burst.
+    """
+
+    def __init__(self, method='scrypt:32768:8:1', workers=2, queue_size=16, timeout=2.0, bulk_workers=2):
+        self.method = method
+        self.timeout = timeout
+        self.bulk_workers = bulk_workers
+        self._canonical = None
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pwhash')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            method=os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1'),
+            workers=int(os.getenv('PASSWORD_HASH_WORKERS', '2')),
+            queue_size=int(os.getenv('PASSWORD_HASH_QUEUE', '16')),
+            timeout=float(os.getenv('PASSWORD_HASH_TIMEOUT', '2')),
+            bulk_workers=int(os.getenv('PASSWORD_HASH_BULK_WORKERS', '2')),
+        )
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HasherBusy()
+        try:
+            return self._pool.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def hash_many(self, passwords):
+        # Bulk path (imports, seeding): a throwaway pool, so a large batch
+        # doesn't queue behind logins, of at most ``bulk_workers`` threads
+        # so it can't take every CPU the web or jobs service has either.
+        with ThreadPoolExecutor(max_workers=self.bulk_workers, thread_name_prefix='pwhash-bulk') as pool:
+            return list(pool.map(lambda p: generate_password_hash(p, self.method), passwords))
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        if self._canonical is None:
+            # Expands shorthand such as "pbkdf2" to the full prefix werkzeug
+            # writes into the hash, e.g. "pbkdf2:sha256:1000000".
+            self._canonical = generate_password_hash('', self.method).split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._canonical
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
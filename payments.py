@@ -0,0 +1,188 @@
+import hashlib
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class PaymentError(Exception):
+    pass
+
+
+class GatewayUnavailable(PaymentError):
+    pass
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive failures and rejects calls for
+    ``cooldown`` seconds, then lets a single trial call through."""
+
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def before(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown:
+                raise GatewayUnavailable("payment provider temporarily unavailable")
+            # Half-open: push the window forward so only this caller probes.
+            self.opened_at = time.monotonic()
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class IdempotencyCache:
+    """Remembers provider responses per idempotency key so a double submit
+    returns the first result instead of creating a second remote object.
+    Concurrent callers with the same key wait for the first one."""
+
+    def __init__(self, ttl=600.0, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._results = {}
+        self._inflight = {}
+
+    def run(self, key, fn):
+        while True:
+            with self._lock:
+                hit = self._results.get(key)
+                if hit and time.monotonic() - hit[1] < self.ttl:
+                    return hit[0]
+                waiter = self._inflight.get(key)
+                if waiter is None:
+                    waiter = self._inflight[key] = threading.Event()
+                    break
+            waiter.wait()
+        try:
+            result = fn()
+            with self._lock:
+                if len(self._results) >= self.max_entries:
+                    self._results.clear()
+                self._results[key] = (result, time.monotonic())
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key).set()
+
+
+def idempotency_key(*parts):
+    return hashlib.sha256('|'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+class Gateway:
+    def __init__(self, base_url, timeout=(3.05, 10), pool_size=10, breaker=None, cache=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.cache = cache or IdempotencyCache()
+        # One keep-alive pool per provider, shared by every request thread.
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+
+    def _request(self, method, path, **kwargs):
+        self.breaker.before()
+        try:
+            resp = self.http.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            self.breaker.failure()
+            raise GatewayUnavailable(str(e)) from e
+        if resp.status_code >= 500:
+            self.breaker.failure()
+            raise GatewayUnavailable(f"provider returned {resp.status_code}")
+        try:
+            body = resp.json() if resp.content else {}
+        except ValueError:
+            # An HTML error page from a proxy or load balancer, not the API
+            if resp.status_code >= 400:
+                self.breaker.success()
+                raise PaymentError(f"provider returned {resp.status_code}")
+            self.breaker.failure()
+            raise GatewayUnavailable("provider returned a non-JSON response")
+        self.breaker.success()
+        if resp.status_code >= 400:
+            error = body.get('error')
+            message = error.get('message') if isinstance(error, dict) else body.get('message') or error
+            raise PaymentError(message or f"provider returned {resp.status_code}")
+        return body
+
+
+class StripeGateway(Gateway):
+    def __init__(self, api_key, base_url='https://api.stripe.com', **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.http.auth = (api_key or '', '')
+
+    def create_checkout_session(self, params, key):
+        # Stripe also dedupes on Idempotency-Key, covering other workers.
+        return self.cache.run(('stripe', key), lambda: self._request(
+            'POST', '/v1/checkout/sessions', data=_form_encode(params),
+            headers={'Idempotency-Key': key}))
+
+
+class PayPalGateway(Gateway):
+    def __init__(self, client_id, client_secret, base_url='https://api-m.sandbox.paypal.com', **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self._token = None
+        self._token_expires = 0.0
+        self._token_lock = threading.Lock()
+
+    def _access_token(self):
+        with self._token_lock:
+            if self._token is None or time.monotonic() >= self._token_expires:
+                body = self._request('POST', '/v1/oauth2/token',
+                                     data={'grant_type': 'client_credentials'},
+                                     auth=(self.client_id or '', self.client_secret or ''))
+                self._token = body['access_token']
+                self._token_expires = time.monotonic() + int(body.get('expires_in', 300)) - 60
+            return self._token
+
+    def create_payment(self, payment, key):
+        return self.cache.run(('paypal', key), lambda: self._request(
+            'POST', '/v1/payments/payment', json=payment,
+            headers={'Authorization': f'Bearer {self._access_token()}', 'PayPal-Request-Id': key}))
+
+
+def _form_encode(params, prefix=None):
+    # Stripe's nested form encoding: line_items[0][price_data][currency]=usd
+    items = params.items() if isinstance(params, dict) else enumerate(params)
+    out = []
+    for k, v in items:
+        name = f"{prefix}[{k}]" if prefix else str(k)
+        if isinstance(v, (dict, list)):
+            out.extend(_form_encode(v, name))
+        else:
+            out.append((name, v))
+    return out
+
+
+def from_env():
+    timeout = (float(os.getenv('PAYMENT_CONNECT_TIMEOUT', '3.05')), float(os.getenv('PAYMENT_READ_TIMEOUT', '10')))
+    breaker = dict(threshold=int(os.getenv('PAYMENT_BREAKER_THRESHOLD', '5')),
+                   cooldown=float(os.getenv('PAYMENT_BREAKER_COOLDOWN', '30')))
+    stripe = StripeGateway(os.getenv('STRIPE_SECRET_KEY'),
+                           base_url=os.getenv('STRIPE_API_BASE', 'https://api.stripe.com'),
+                           timeout=timeout, breaker=CircuitBreaker(**breaker))
+    paypal = PayPalGateway(os.getenv('PAYPAL_CLIENT_ID'), os.getenv('PAYPAL_CLIENT_SECRET'),
+                           base_url=os.getenv('PAYPAL_API_BASE', 'https://api-m.sandbox.paypal.com'),
+                           timeout=timeout, breaker=CircuitBreaker(**breaker))
+    return stripe, paypal
@@ -0,0 +1,126 @@
+"""Collision-free referral codes.
+
+Codes are a keyed Feistel permutation of a sequence number rendered as
+8 base-36 characters. A permutation maps distinct inputs to distinct
+outputs, so codes are unique by construction and no SELECT is needed
+before the INSERT. Each process reserves sequence numbers from the
+database a block at a time, which costs one round trip per
+``block_size`` codes.
+
+That holds as long as nothing else stores a code of the same shape:
+``is_generated`` tells such codes apart, and the user import refuses
+them (legacy codes, the email prefix plus a timestamp, never match).
+"""
+import hashlib
+import hmac
+import os
+import string
+import threading
+
+from sqlalchemy import BigInteger, Column, String, Table, insert, update
+from sqlalchemy.exc import IntegrityError
+
+ALPHABET = string.digits + string.ascii_uppercase
+CODE_LENGTH = 8
+HALF_BITS = 20  # 40-bit domain; 2**40 < 36**8 so every value fits 8 chars
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+
+def permute(n, key):
+    left, right = n >> HALF_BITS, n & HALF_MASK
+    for r in range(ROUNDS):
+        digest = hmac.new(key, bytes([r]) + right.to_bytes(4, 'big'), hashlib.sha256).digest()
+        left, right = right, left ^ (int.from_bytes(digest[:4], 'big') & HALF_MASK)
+    return (left << HALF_BITS) | right
+
+
+def encode(n):
+    chars = []
+    for _ in range(CODE_LENGTH):
+        n, rem = divmod(n, 36)
+        chars.append(ALPHABET[rem])
+    return ''.join(reversed(chars))
+
+
+def is_generated(code):
+    """Whether ``code`` has the shape of an allocated code, and so could
+    be one the permutation hands out."""
+    return len(code) == CODE_LENGTH and all(c in ALPHABET for c in code)
+
+
+def sequence_table(metadata):
+    if 'referral_sequence' in metadata.tables:
+        return metadata.tables['referral_sequence']
+    return Table('referral_sequence', metadata,
+                 Column('name', String(50), primary_key=True),
+                 Column('next_value', BigInteger, nullable=False))
+
+
+class CodeAllocator:
+    def __init__(self, reserve, key, block_size=1000):
+        self.reserve = reserve
+        self.key = key
+        self.block_size = block_size
+        self.blocks = 0
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        self._pid = None
+
+    @classmethod
+    def for_db(cls, db, key=None, block_size=None, name='referral_code'):
+        """Allocator whose blocks come from a one-row counter table
+        registered on ``db``'s metadata (created by ``db.create_all()``)."""
+        table = sequence_table(db.metadata)
+        key = key or os.getenv('REFERRAL_CODE_KEY') or os.getenv('SECRET_KEY')
+        if not key:
+            # A well-known key would make every code predictable from its
+            # sequence number, so there is no fallback
+            raise RuntimeError("REFERRAL_CODE_KEY or SECRET_KEY must be set")
+        block_size = block_size or int(os.getenv('REFERRAL_CODE_BLOCK', '1000'))
+
+        def reserve(n):
+            # Own transaction: a reserved block stays reserved even if the
+            # request that triggered it rolls back (gaps are harmless).
+            for _ in range(2):
+                with db.engine.begin() as conn:
+                    row = conn.execute(
+                        update(table).where(table.c.name == name)
+                        .values(next_value=table.c.next_value + n)
+                        .returning(table.c.next_value)).first()
+                    if row is not None:
+                        return row[0] - n
+                    try:
+                        with conn.begin_nested():
+                            conn.execute(insert(table).values(name=name, next_value=n))
+                        return 0
+                    except IntegrityError:
+                        pass  # another process created the row first
+            raise RuntimeError("could not reserve referral code block")
+
+        return cls(reserve, key.encode(), block_size)
+
+    def _take(self, n):
+        # Blocks never cross a fork: a child must not reuse its parent's range.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._next = self._end = 0
+        out = []
+        while len(out) < n:
+            if self._next >= self._end:
+                size = max(self.block_size, n - len(out))
+                self._next = self.reserve(size)
+                self._end = self._next + size
+                self.blocks += 1
+            take = min(n - len(out), self._end - self._next)
+            out.extend(range(self._next, self._next + take))
+            self._next += take
+        return out
+
+    def allocate(self):
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, n):
+        with self._lock:
+            seqs = self._take(n)
+        return [encode(permute(s, self.key)) for s in seqs]
@@ -0,0 +1,157 @@
+from sqlalchemy import and_, bindparam, exists, func, insert, literal, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Ledger entries that count as downline earnings; add_earnings is called
+# for exactly these, and rebuild sums exactly these
+EARNING_TYPES = ('freeplay', 'bonus')
+
+
+class ReferralGraph:
+    """Referral tree kept as a closure table plus per-depth rollups.
+
+    ``closure`` holds one (ancestor, descendant, depth) row for every pair
+    on a path, including the (user, user, 0) self row. ``stats`` holds, per
+    ancestor and depth, how many members and how much ledger credit sit
+    at that depth of the downline. Both are maintained incrementally on
+    register and on every credit, so subtree questions are a single range
+    scan on the stats primary key.
+
+    A user can only be referred by an earlier account (a smaller id). A
+    referrer added later, e.g. further down the same import, is ignored by
+    both the incremental path and ``rebuild``, so the tree can never
+    contain a cycle.
+    """
+
+    def __init__(self, db, user_model, closure_model, stats_model):
+        self.db = db
+        self.user_model = user_model
+        self.closure = closure_model
+        self.stats = stats_model
+
+    def add_user(self, user_id, referrer_id=None):
+        # Called in the register transaction, after the user row is flushed.
+        c, s = self.closure, self.stats
+        session = self.db.session
+        session.execute(insert(c).values(ancestor_id=user_id, descendant_id=user_id, depth=0))
+        if referrer_id is None or referrer_id >= user_id:
+            return
+        session.execute(insert(c).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select(c.ancestor_id, literal(user_id), c.depth + 1).where(c.descendant_id == referrer_id)))
+        # Every ancestor gains one member at (its depth to the referrer) + 1.
+        # Restricting on ancestor_id first keeps both statements on the
+        # primary-key index; a tree gives each ancestor exactly one depth.
+        path = select(c.ancestor_id, (c.depth + 1).label('depth')).where(c.descendant_id == referrer_id)
+        self._ensure_rows(path)
+        session.execute(update(s).where(
+            s.ancestor_id.in_(select(c.ancestor_id).where(c.descendant_id == referrer_id)),
+            s.depth == select(c.depth + 1).where(c.descendant_id == referrer_id, c.ancestor_id == s.ancestor_id)
+            .scalar_subquery(),
+        ).values(members=s.members + 1))
+
+    def add_users(self, pairs):
+        """Batch form of ``add_user`` for (user_id, referrer_id) pairs in
+        insertion order; a referrer may be an earlier pair of the batch."""
+        if not pairs:
+            return
+        c, s = self.closure.__table__, self.stats.__table__
+        session = self.db.session
+        session.execute(insert(c), [{'ancestor_id': u, 'descendant_id': u, 'depth': 0} for u, _ in pairs])
+        linked = [{'uid': u, 'ref': r} for u, r in pairs if r is not None and r < u]
+        if not linked:
+            return
+        # executemany runs in order, so in-batch parents already have paths.
+        session.execute(insert(c).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select(c.c.ancestor_id, bindparam('uid'), c.c.depth + 1).where(c.c.descendant_id == bindparam('ref'))),
+            linked)
+        counts = session.execute(
+            select(c.c.ancestor_id, c.c.depth, func.count())
+            .where(c.c.descendant_id.in_([p['uid'] for p in linked]), c.c.depth > 0)
+            .group_by(c.c.ancestor_id, c.c.depth)).all()
+        if not counts:
+            return  # the referrers have no paths yet (rebuild-referrals adds them)
+        params = [{'a': a, 'd': d, 'n': n} for a, d, n in counts]
+        session.execute(self._insert_missing(
+            select(bindparam('a'), bindparam('d'), literal(0), literal(0.0)).where(~exists().where(
+                and_(s.c.ancestor_id == bindparam('a'), s.c.depth == bindparam('d'))))),
+            params)
+        session.execute(update(s).where(s.c.ancestor_id == bindparam('a'), s.c.depth == bindparam('d'))
+                        .values(members=s.c.members + bindparam('n')), params)
+
+    def add_earnings(self, user_id, amount):
+        c, s = self.closure, self.stats
+        session = self.db.session
+        path = select(c.ancestor_id, c.depth).where(c.descendant_id == user_id, c.depth > 0)
+        self._ensure_rows(path)
+        session.execute(update(s).where(
+            s.ancestor_id.in_(select(c.ancestor_id).where(c.descendant_id == user_id, c.depth > 0)),
+            s.depth == select(c.depth).where(c.descendant_id == user_id, c.ancestor_id == s.ancestor_id)
+            .scalar_subquery(),
+        ).values(earnings=s.earnings + amount))
+
+    def _ensure_rows(self, path):
+        s = self.stats
+        path = path.subquery()
+        missing = select(path.c.ancestor_id, path.c.depth, literal(0), literal(0.0)).where(~exists().where(
+            and_(s.ancestor_id == path.c.ancestor_id, s.depth == path.c.depth)))
+        self.db.session.execute(self._insert_missing(missing))
+
+    def _insert_missing(self, rows):
+        # NOT EXISTS skips the rows already there; two first referrals under
+        # the same ancestor can still both miss the row, and the loser's
+        # insert then does nothing instead of failing the registration
+        session = self.db.session
+        dialect = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+        return (dialect.insert(self.stats.__table__)
+                .from_select(['ancestor_id', 'depth', 'members', 'earnings'], rows)
+                .on_conflict_do_nothing(index_elements=['ancestor_id', 'depth']))
+
+    def subtree(self, user_id, max_depth=None):
+        s = self.stats
+        q = select(s.depth, s.members, s.earnings).where(s.ancestor_id == user_id)
+        if max_depth is not None:
+            q = q.where(s.depth <= max_depth)
+        rows = self.db.session.execute(q.order_by(s.depth)).all()
+        return {
+            "members": sum(r.members for r in rows),
+            "earnings": sum(r.earnings for r in rows),
+            "levels": [{"depth": r.depth, "members": r.members, "earnings": r.earnings} for r in rows],
+        }
+
+    def rebuild(self, txn_model=None):
+        """Recomputes closure and rollups from User.referrer_code with one
+        recursive CTE and grouped inserts, e.g. after a bulk import."""
+        u, c, s = self.user_model.__table__, self.closure.__table__, self.stats.__table__
+        session = self.db.session
+        session.execute(s.delete())
+        session.execute(c.delete())
+        q = session.get_bind().dialect.identifier_preparer.quote
+        users, closure = q(u.name), q(c.name)  # "user" is reserved on Postgres
+        session.execute(text(f"""
+            INSERT INTO {closure} (ancestor_id, descendant_id, depth)
+            WITH RECURSIVE paths(ancestor_id, descendant_id, depth) AS (
+                SELECT id, id, 0 FROM {users}
+                UNION ALL
+                SELECT p.ancestor_id, child.id, p.depth + 1
+                FROM paths p
+                JOIN {users} parent ON parent.id = p.descendant_id
+                JOIN {users} child ON child.referrer_code = parent.referral_code AND child.id > parent.id
+            )
+            SELECT ancestor_id, descendant_id, depth FROM paths
+        """))
+        members = (select(c.c.ancestor_id, c.c.depth, func.count(), literal(0.0))
+                   .where(c.c.depth > 0).group_by(c.c.ancestor_id, c.c.depth))
+        session.execute(insert(s).from_select(['ancestor_id', 'depth', 'members', 'earnings'], members))
+        if txn_model is not None:
+            t = txn_model.__table__
+            per_user = (select(t.c.user_id, func.sum(t.c.amount).label('total'))
+                        .where(t.c.type.in_(EARNING_TYPES)).group_by(t.c.user_id).subquery())
+            earned = (select(c.c.ancestor_id, c.c.depth, func.sum(per_user.c.total).label('total'))
+                      .join(per_user, per_user.c.user_id == c.c.descendant_id)
+                      .where(c.c.depth > 0).group_by(c.c.ancestor_id, c.c.depth).subquery())
+            session.execute(update(s).where(and_(
+                s.c.ancestor_id == earned.c.ancestor_id, s.c.depth == earned.c.depth
+            )).values(earnings=earned.c.total))
+        session.commit()
+        return session.query(func.count()).select_from(c).scalar()
@@ -0,0 +1,45 @@
+import threading
+from collections import OrderedDict
+
+from flask import render_template
+
+
+class RenderCache:
+    """Caches rendered template output for pages whose HTML depends only on
+    the template and the context passed in (no per-user state, no flashed
+    messages). Keyed on the template name plus the context items."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+
+    def render(self, template, **context):
+        key = (template, tuple(sorted(context.items())))
+        with self._lock:
+            html = self._pages.get(key)
+            if html is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        html = render_template(template, **context)
+        with self._lock:
+            self._pages[key] = html
+            while len(self._pages) > self.maxsize:
+                self._pages.popitem(last=False)
+        return html
+
+    def invalidate(self, template=None):
+        with self._lock:
+            if template is None:
+                self._pages.clear()
+            else:
+                for key in [k for k in self._pages if k[0] == template]:
+                    del self._pages[key]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._pages)}
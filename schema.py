@@ -0,0 +1,58 @@
+"""Brings an existing database up to the models, without a migration tool.
+
+``db.create_all()`` only creates missing tables (reported as
+``CREATE TABLE <name>``, so callers can fill new summary tables).
+``upgrade`` also
+
+- adds missing columns. A NOT NULL column needs a backfill expression:
+  it is added with that as its default, so existing rows get it. A
+  nullable column with a backfill gets an UPDATE of the rows still NULL;
+- widens VARCHAR columns whose length grew (Postgres only; SQLite does
+  not enforce lengths);
+- creates missing indexes.
+
+Every step looks at the live schema first, so running it again changes
+nothing. Unique constraints on added columns are not handled.
+"""
+from sqlalchemy import String, inspect, text
+
+
+def upgrade(db, backfill=None):
+    """Returns the statements it ran. ``backfill`` maps (table, column)
+    to a SQL expression for the rows that predate the column."""
+    backfill = backfill or {}
+    before = set(inspect(db.engine).get_table_names())
+    db.create_all()
+    done = [f"CREATE TABLE {table.name}" for table in db.metadata.sorted_tables if table.name not in before]
+    with db.engine.begin() as conn:
+        run = lambda sql: (conn.execute(text(sql)), done.append(sql))
+        existing = inspect(conn)
+        dialect = conn.dialect
+        q = dialect.identifier_preparer.quote
+        for table in db.metadata.sorted_tables:
+            name = q(table.name)
+            columns = {c['name']: c for c in existing.get_columns(table.name)}
+            for column in table.columns:
+                value = backfill.get((table.name, column.name))
+                kind = column.type.compile(dialect=dialect)
+                found = columns.get(column.name)
+                if found is None:
+                    if column.nullable or column.primary_key:
+                        run(f"ALTER TABLE {name} ADD COLUMN {q(column.name)} {kind}")
+                        if value is not None:
+                            run(f"UPDATE {name} SET {q(column.name)} = {value} WHERE {q(column.name)} IS NULL")
+                    elif value is None:
+                        raise RuntimeError(f"{table.name}.{column.name} is NOT NULL and has no backfill value")
+                    else:
+                        run(f"ALTER TABLE {name} ADD COLUMN {q(column.name)} {kind} NOT NULL DEFAULT {value}")
+                        if dialect.name == 'postgresql':
+                            run(f"ALTER TABLE {name} ALTER COLUMN {q(column.name)} DROP DEFAULT")
+                elif (dialect.name == 'postgresql' and isinstance(column.type, String) and column.type.length
+                      and (getattr(found['type'], 'length', None) or column.type.length) < column.type.length):
+                    run(f"ALTER TABLE {name} ALTER COLUMN {q(column.name)} TYPE {kind}")
+            indexes = {i['name'] for i in existing.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda i: i.name):
+                if index.name not in indexes:
+                    index.create(conn)
+                    done.append(f"CREATE INDEX {index.name}")
+    return done
@@ -0,0 +1,217 @@
+"""Ranked prefix search over a few text columns of a table.
+
+On SQLite the columns are mirrored into an external-content FTS5 table
+(only the inverted index is stored, not a second copy of the text),
+queried with whole-word terms and a prefix last term. On Postgres a
+pg_trgm GIN index over the lower-cased concatenation serves substring
+matches. Candidates from either are ranked by ``score``: column weights,
+whole-word hits above prefix hits.
+
+Scoring every match of a broad query would cost as much as a scan, so
+candidates are fetched in tiers, each newest first: the newest
+``rank_window`` whole-word matches, then the newest ``rank_window``
+prefix matches, so a prefix query can never crowd older exact matches
+out of the candidates. Only when the whole-word window is full is a
+third tier read: up to ``limit`` rows where every term is a whole word
+in a top-weight column, i.e. the best possible score. When that fills a
+page, the prefix tier (which cannot beat it) is skipped.
+
+Either way the index is kept in sync by the database itself: FTS5 by
+insert/update/delete triggers, the trigram index as an ordinary
+expression index. Every write path, including bulk INSERTs that skip
+the ORM, is covered. Both are created with the table by
+``db.create_all()``; ``ensure()`` adds them to an existing database.
+"""
+import re
+import unicodedata
+
+from sqlalchemy import event, text
+
+MAX_TERMS = 8
+
+
+def terms(value):
+    return re.findall(r'\w+', value.lower())
+
+
+def fold(value):
+    # Same folding as FTS5's unicode61 tokenizer: "Müller" matches "muller"
+    if value.isascii():
+        return value
+    return ''.join(c for c in unicodedata.normalize('NFKD', value) if not unicodedata.combining(c))
+
+
+class SearchIndex:
+    def __init__(self, db, model, columns, weights=None, rank_window=200, max_expansions=16):
+        self.db = db
+        self.model = model
+        self.table = model.__table__.name
+        self.columns = tuple(columns)
+        self.weights = tuple(weights or (1.0,) * len(self.columns))
+        self.top_columns = tuple(c for c, w in zip(self.columns, self.weights) if w == max(self.weights))
+        self.rank_window = rank_window
+        self.max_expansions = max_expansions
+        self.name = f'{self.table}_search'
+        self.vocab = f'{self.name}_vocab'
+        event.listen(model.__table__, 'after_create', lambda target, conn, **kw: self._create(conn))
+        event.listen(model.__table__, 'before_drop', lambda target, conn, **kw: self._drop(conn))
+
+    # DDL (every name quoted: the users table is "user", reserved on Postgres)
+
+    def _sqlite_ddl(self, q):
+        name, table = q(self.name), q(self.table)
+        cols = ', '.join(q(c) for c in self.columns)
+        new = ', '.join(f'new.{q(c)}' for c in self.columns)
+        old = ', '.join(f'old.{q(c)}' for c in self.columns)
+        delete = f"INSERT INTO {name}({name}, rowid, {cols}) VALUES ('delete', old.id, {old});"
+        insert = f"INSERT INTO {name}(rowid, {cols}) VALUES (new.id, {new});"
+        content = self.table.replace("'", "''")
+        # prefix='2 3' keeps short prefix lookups to a single b-tree probe
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5("
+            f"{cols}, content='{content}', content_rowid='id', prefix='2 3')",
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {q(self.vocab)} USING fts5vocab({name}, 'row')",
+            f"CREATE TRIGGER IF NOT EXISTS {q(self.name + '_ai')} AFTER INSERT ON {table} BEGIN {insert} END",
+            f"CREATE TRIGGER IF NOT EXISTS {q(self.name + '_ad')} AFTER DELETE ON {table} BEGIN {delete} END",
+            f"CREATE TRIGGER IF NOT EXISTS {q(self.name + '_au')} AFTER UPDATE OF {cols} ON {table} "
+            f"BEGIN {delete} {insert} END",
+        ]
+
+    def _document(self, q, columns=None):
+        # Must match the indexed expression exactly for Postgres to use it
+        parts = " || ' ' || ".join(f"coalesce({q(c)}, '')" for c in columns or self.columns)
+        return f"lower({parts})"
+
+    def _create(self, conn):
+        dialect = conn.dialect.name
+        q = conn.dialect.identifier_preparer.quote
+        if dialect == 'sqlite':
+            existed = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': self.name}).first()
+            for statement in self._sqlite_ddl(q):
+                conn.execute(text(statement))
+            if not existed:
+                conn.execute(text(f"INSERT INTO {q(self.name)}({q(self.name)}) VALUES ('rebuild')"))
+        elif dialect == 'postgresql':
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {q(self.name)} ON {q(self.table)} "
+                              f"USING gin (({self._document(q)}) gin_trgm_ops)"))
+
+    def _drop(self, conn):
+        if conn.dialect.name == 'sqlite':
+            q = conn.dialect.identifier_preparer.quote
+            conn.execute(text(f"DROP TABLE IF EXISTS {q(self.vocab)}"))
+            conn.execute(text(f"DROP TABLE IF EXISTS {q(self.name)}"))
+
+    def ensure(self):
+        with self.db.engine.begin() as conn:
+            self._create(conn)
+
+    def rebuild(self):
+        """Re-derives the FTS5 index from the table (a no-op elsewhere)."""
+        with self.db.engine.begin() as conn:
+            self._create(conn)
+            if conn.dialect.name == 'sqlite':
+                q = conn.dialect.identifier_preparer.quote
+                conn.execute(text(f"INSERT INTO {q(self.name)}({q(self.name)}) VALUES ('rebuild')"))
+
+    # queries
+
+    def score(self, words, values):
+        """Sum over query terms of the best column weight each hits: full
+        weight for a whole word, half for a word it only prefixes."""
+        found = [terms(fold(value)) if value else () for value in values]
+        total = 0.0
+        for word in words:
+            best = 0.0
+            for weight, tokens in zip(self.weights, found):
+                if weight <= best:
+                    continue
+                if word in tokens:
+                    best = weight
+                elif weight / 2 > best and any(token.startswith(word) for token in tokens):
+                    best = weight / 2
+            total += best
+        return total
+
+    def _expand(self, session, q, word):
+        """Indexed words ``word`` is a proper prefix of, or None if there
+        are too many. A prefix longer than the prefix index covers is
+        otherwise merged in memory over its whole doclist; as an OR of
+        whole words FTS5 can skip through it like any other term. ``word``
+        itself is left out: the vocabulary table counts the doclist of
+        every term it returns, and whole-word hits are already fetched."""
+        if len(word) <= 3:
+            return None
+        upper = word[:-1] + chr(ord(word[-1]) + 1)
+        # ``> word`` would still seek to ``word`` and count it: the vocab
+        # table only turns ``>=`` into a seek
+        found = session.execute(text(f"SELECT term FROM {q(self.vocab)} WHERE term >= :lo AND term < :hi LIMIT :n"),
+                                {'lo': word + '\0', 'hi': upper, 'n': self.max_expansions + 1}).scalars().all()
+        return None if len(found) > self.max_expansions else found
+
+    def _sqlite_tiers(self, session, q, words):
+        name, cols = q(self.name), ', '.join(q(c) for c in self.columns)
+        sql = (f"SELECT rowid, {cols} FROM {name} WHERE {name} MATCH :match "
+               f"ORDER BY rowid DESC LIMIT :window")
+        phrase = lambda w: '"' + w.replace('"', '""') + '"'
+        exact = ' AND '.join(phrase(w) for w in words)
+        top = '{' + ' '.join(self.top_columns) + '} : (' + exact + ')'
+        tiers = [(sql, {'match': exact}), (sql, {'match': top})]
+        # Whole words except the last: an exact term streams its doclist,
+        # a prefix term has to merge the doclists of every word it prefixes.
+        expanded = self._expand(session, q, words[-1])
+        if expanded is None:
+            last = phrase(words[-1]) + '*'
+        elif expanded:
+            last = '(' + ' OR '.join(phrase(w) for w in expanded) + ')'
+        else:
+            return tiers  # no longer word: the whole-word tier has every match
+        tiers.append((sql, {'match': ' AND '.join([phrase(w) for w in words[:-1]] + [last])}))
+        return tiers
+
+    def _postgres_tiers(self, q, words):
+        params = {f't{i}': '%' + w.replace('\\', '\\\\').replace('%', r'\%').replace('_', r'\_') + '%'
+                  for i, w in enumerate(words)}
+        cols, doc = ', '.join(q(c) for c in self.columns), self._document(q)
+        base = (f"SELECT id, {cols} FROM {q(self.table)} WHERE "
+                + ' AND '.join(f"{doc} LIKE :{name}" for name in params))
+        order = " ORDER BY id DESC LIMIT :window"
+        # The trigram index narrows on the LIKEs; the regexes keep rows
+        # with every term a whole word in a top-weight column
+        whole = {f'w{i}': rf'\m{w}\M' for i, w in enumerate(words)}
+        top = ' AND '.join('(' + ' OR '.join(f"lower(coalesce({q(c)}, '')) ~ :{name}" for c in self.top_columns) + ')'
+                           for name in whole)
+        # Postgres has no separate prefix tier: the LIKEs match anywhere
+        return [(base + order, params), (f"{base} AND {top}{order}", dict(params, **whole))]
+
+    def search(self, query, limit=20):
+        """Returns [(id, score)], best match first, newest first among
+        equals. Every term must match; the last one may be a prefix (on
+        Postgres any term may match anywhere inside a word)."""
+        words = terms(fold(query))[:MAX_TERMS]
+        if not words:
+            return []
+        session = self.db.session
+        dialect = session.get_bind().dialect
+        q = dialect.identifier_preparer.quote
+        if dialect.name == 'postgresql':
+            tiers = self._postgres_tiers(q, words)
+        else:
+            tiers = self._sqlite_tiers(session, q, words)
+        (exact, exact_params), (top, top_params), *rest = tiers
+        rows = session.execute(text(exact), dict(exact_params, window=self.rank_window)).all()
+        if len(rows) == self.rank_window and self.top_columns != self.columns:
+            # Older whole-word matches were cut off; make sure the best ones are in
+            best = session.execute(text(top), dict(top_params, window=limit)).all()
+            if len(best) == limit:
+                rest = []  # a full page at the best possible score
+            rows = best + rows
+        for sql, params in rest:
+            rows += session.execute(text(sql), dict(params, window=self.rank_window)).all()
+        candidates = {row[0]: row[1:] for row in rows}
+        # bm25 is not used: its IDF pass reads each term's whole doclist,
+        # and in an all-terms query IDF is the same for every candidate anyway.
+        hits = [(row_id, self.score(words, values)) for row_id, values in candidates.items()]
+        hits.sort(key=lambda hit: (-hit[1], -hit[0]))
+        return hits[:limit]
@@ -0,0 +1,138 @@
+"""Local SMTP sink for development and tests.
+
+Accepts every message and writes it to ``<directory>/<n>.eml`` instead
+of delivering it, so the job workers can be exercised end to end with
+SMTP_HOST=localhost SMTP_PORT=1025.
+
+Usage: python smtp_sink.py [--port 1025] [--dir outbox]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import threading
+
+
+class SinkProtocol(asyncio.Protocol):
+    def __init__(self, sink):
+        self.sink = sink
+        self.buffer = b''
+        self.data = None
+        self.recipients = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.reply('220 sink ESMTP ready')
+
+    def reply(self, line):
+        self.transport.write(line.encode() + b'\r\n')
+
+    def data_received(self, chunk):
+        self.buffer += chunk
+        while b'\r\n' in self.buffer:
+            line, self.buffer = self.buffer.split(b'\r\n', 1)
+            if self.data is not None:
+                if line == b'.':
+                    self.sink.store(self.recipients, b'\r\n'.join(self.data) + b'\r\n')
+                    self.data, self.recipients = None, []
+                    self.reply('250 OK: queued')
+                else:
+                    self.data.append(line[1:] if line.startswith(b'..') else line)
+                continue
+            self.command(line.decode('utf-8', 'replace'))
+
+    def command(self, line):
+        verb = line[:4].upper()
+        if verb == 'EHLO':
+            self.reply('250-sink')
+            self.reply('250-8BITMIME')
+            self.reply('250 SMTPUTF8')
+        elif verb == 'HELO':
+            self.reply('250 sink')
+        elif verb == 'MAIL':
+            self.recipients = []
+            self.reply('250 OK')
+        elif verb == 'RCPT':
+            self.recipients.append(line.split(':', 1)[1].strip().strip('<>'))
+            self.reply('250 OK')
+        elif verb == 'DATA':
+            self.data = []
+            self.reply('354 End data with <CR><LF>.<CR><LF>')
+        elif verb in ('RSET', 'NOOP'):
+            self.recipients = []
+            self.reply('250 OK')
+        elif verb == 'QUIT':
+            self.reply('221 Bye')
+            self.transport.close()
+        else:
+            self.reply('502 Command not implemented')
+
+
+class SMTPSink:
+    def __init__(self, directory='outbox', host='127.0.0.1', port=1025):
+        self.directory = directory
+        self.host = host
+        self.port = port
+        self.messages = []  # (recipients, raw bytes)
+        self.connections = 0
+        self._counter = itertools.count(1)
+        self._loop = None
+        self._server = None
+        os.makedirs(directory, exist_ok=True)
+
+    def store(self, recipients, raw):
+        self.messages.append((recipients, raw))
+        with open(os.path.join(self.directory, f"{next(self._counter)}.eml"), 'wb') as f:
+            f.write(raw)
+
+    def _protocol(self):
+        self.connections += 1
+        return SinkProtocol(self)
+
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await self._loop.create_server(self._protocol, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start(self):
+        """Serves on a daemon thread (port=0 picks a free port); returns self."""
+        ready = threading.Event()
+
+        def run():
+            async def main():
+                task = asyncio.ensure_future(self.serve())
+                while self._server is None:
+                    await asyncio.sleep(0.01)
+                ready.set()
+                await task
+            try:
+                asyncio.run(main())
+            except asyncio.CancelledError:
+                pass
+        threading.Thread(target=run, daemon=True, name='smtp-sink').start()
+        ready.wait(5)
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1025)
+    parser.add_argument('--dir', default='outbox')
+    args = parser.parse_args()
+    sink = SMTPSink(args.dir, args.host, args.port)
+    print(f"SMTP sink on {args.host}:{args.port}, writing to {args.dir}/")
+    try:
+        asyncio.run(sink.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Cold-start measurement for the app module.
+
+Each measurement runs in a fresh interpreter so nothing is already
+imported: ``import_times`` parses ``python -X importtime`` output and
+``cold_start`` times process spawn -> ``import app`` -> first response
+from the test client. ``eager`` names modules to import just before the
+app, inside the timed import, to measure what keeping them lazy saves.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+FIRST_RESPONSE = """
+import time, json
+t0 = time.perf_counter()
+{eager}import {module} as m
+t1 = time.perf_counter()
+resp = m.app.test_client().get({path!r})
+t2 = time.perf_counter()
+print(json.dumps({{"import": t1 - t0, "first_response": t2 - t1, "status": resp.status_code}}))
+"""
+
+
+def import_times(module='app'):
+    """Returns (self_us, cumulative_us, depth, name) per imported module."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=ROOT, capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        rows.append((int(self_us), int(cumulative), depth, name.strip()))
+    return rows
+
+
+def children(rows, name='app'):
+    """Direct imports of the top-level module ``name``; importtime lists a
+    module's children before the module itself."""
+    end = next(i for i, r in enumerate(rows) if r[2] == 0 and r[3] == name)
+    start = end
+    while start > 0 and rows[start - 1][2] != 0:
+        start -= 1
+    return [r for r in rows[start:end] if r[2] == 1] + [rows[end]]
+
+
+def cold_start(module='app', path='/', eager=()):
+    code = FIRST_RESPONSE.format(module=module, path=path, eager=''.join(f'import {name}\n' for name in eager))
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-c', code],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['total'] = time.perf_counter() - start
+    return result
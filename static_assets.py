@@ -0,0 +1,150 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+from flask import request, send_file
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # optional; .br variants are skipped without it
+    brotli = None
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.html', '.json', '.txt', '.xml', '.map', '.ico'}
+FINGERPRINT = re.compile(r'^(?P<stem>.+)\.(?P<digest>[0-9a-f]{10})(?P<ext>\.[^./]+)$')
+ONE_YEAR = 365 * 24 * 3600
+
+
+class StaticAssets:
+    """Content-hash fingerprinting and precompressed serving for /static.
+
+    ``url_for('static', filename='logo.png')`` builds ``logo.<hash>.png``;
+    requests for a current fingerprint are served with a one-year immutable
+    Cache-Control, anything else falls back to Flask's default max-age.
+    Files are streamed through send_file, which answers Range requests with
+    206 partial content (used by the freeplay background audio).
+
+    Callbacks registered with ``on_change`` run when a file's digest turns
+    out to differ from the one already handed out, so HTML holding the old
+    URL (see RenderCache) can be dropped.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._digests = {}
+        self._listeners = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.folder = app.static_folder
+        app.url_defaults(self._url_defaults)
+        app.view_functions['static'] = self.serve
+
+    def on_change(self, callback):
+        self._listeners.append(callback)
+
+    def digest(self, filename):
+        path = safe_join(self.folder, filename)
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            hit = self._digests.get(filename)
+            if hit and hit[0] == stamp:
+                return hit[1]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                h.update(block)
+        value = h.hexdigest()[:10]
+        with self._lock:
+            self._digests[filename] = (stamp, value)
+        if hit and hit[1] != value:
+            for callback in self._listeners:
+                callback()
+        return value
+
+    def fingerprint(self, filename):
+        value = self.digest(filename)
+        if value is None:
+            return filename
+        stem, ext = os.path.splitext(filename)
+        return f"{stem}.{value}{ext}"
+
+    def warm(self):
+        # Digests every static file up front (e.g. in a preloading master)
+        count = 0
+        for root, _, files in os.walk(self.folder or ''):
+            for name in files:
+                rel = os.path.relpath(os.path.join(root, name), self.folder).replace(os.sep, '/')
+                count += self.digest(rel) is not None
+        return count
+
+    def _url_defaults(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.fingerprint(values['filename'])
+
+    def _resolve(self, filename):
+        m = FINGERPRINT.match(filename)
+        if m:
+            original = m.group('stem') + m.group('ext')
+            if self.digest(original) == m.group('digest'):
+                return original, True
+        return filename, False
+
+    def serve(self, filename):
+        original, immutable = self._resolve(filename)
+        path = safe_join(self.folder, original)
+        if path is None or not os.path.isfile(path):
+            raise NotFound()
+        mimetype = mimetypes.guess_type(original)[0] or 'application/octet-stream'
+        encoding = None
+        if os.path.splitext(original)[1].lower() in COMPRESSIBLE and not request.range:
+            accepted = request.accept_encodings
+            for enc, suffix in (('br', '.br'), ('gzip', '.gz')):
+                if accepted[enc] and os.path.isfile(path + suffix):
+                    path, encoding = path + suffix, enc
+                    break
+        max_age = ONE_YEAR if immutable else self.app.get_send_file_max_age(original)
+        resp = send_file(path, mimetype=mimetype, conditional=True, max_age=max_age)
+        if encoding:
+            resp.headers['Content-Encoding'] = encoding
+        if os.path.splitext(original)[1].lower() in COMPRESSIBLE:
+            resp.vary.add('Accept-Encoding')
+        if immutable:
+            resp.cache_control.public = True
+            resp.cache_control.immutable = True
+        return resp
+
+    def precompress(self):
+        """Writes .gz (and .br when brotli is installed) next to every
+        compressible static file whose variant is missing or stale."""
+        written = 0
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.splitext(name)[1].lower() not in COMPRESSIBLE:
+                    continue
+                with open(path, 'rb') as f:
+                    data = f.read()
+                variants = [('.gz', lambda d: gzip.compress(d, 9, mtime=0))]
+                if brotli is not None:
+                    variants.append(('.br', lambda d: brotli.compress(d, quality=11)))
+                for suffix, compress in variants:
+                    target = path + suffix
+                    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                        continue
+                    with open(target, 'wb') as f:
+                        f.write(compress(data))
+                    written += 1
+        return written
@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.py builds its app at import time from the environment, so point it at
+# throwaway storage before the first import
+_tmp = tempfile.mkdtemp(prefix='sportzino-tests-')
+os.environ.update({
+    'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(_tmp, 'test.db')}",
+    'SECRET_KEY': 'test-secret-key',
+    'ADMIN_EMAIL': 'admin@example.com',
+    'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+    'UPLOAD_DIR': os.path.join(_tmp, 'uploads'),
+    'STREAM_RELAY_DIR': os.path.join(_tmp, 'stream'),
+})
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+@pytest.fixture
+def A():
+    """The app module, with empty tables and caches."""
+    import app as A
+    with A.app.app_context():
+        A.db.drop_all()
+        A.db.create_all()
+    A.user_cache.clear()
+    A.leaderboard.clear()
+    A.admin_counts.clear()
+    A.render_cache.invalidate()
+    return A
+
+
+@pytest.fixture
+def client(A):
+    return A.app.test_client()
+
+
+def make_user(A, email='user@example.com', password='secret', **values):
+    with A.app.app_context():
+        user = A.User(email=email, referral_code=values.pop('referral_code', email.split('@')[0]), **values)
+        user.set_password(password)
+        A.db.session.add(user)
+        A.db.session.commit()
+        return user.id
+
+
+def login(client, user_id):
+    with client.session_transaction() as s:
+        s['_user_id'] = str(user_id)
+        s['_fresh'] = True
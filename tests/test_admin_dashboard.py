@@ -0,0 +1,38 @@
+from conftest import login, make_user
+
+
+def walk(client, collection, query=''):
+    ids, cursor, pages = [], '', 0
+    while True:
+        page = client.get(f'/api/admin-dashboard?limit=2&{collection}_cursor={cursor}&{query}').json
+        ids += [row['id'] for row in page[collection]]
+        pages += 1
+        cursor = page[f'next_{collection}_cursor']
+        if cursor is None:
+            return ids, pages, page[f'{collection}_total']
+
+
+def test_cursors_walk_every_row_once(A, client):
+    admin_id = make_user(A, 'admin@example.com')
+    login(client, admin_id)
+    users = [admin_id] + [make_user(A, f'u{i}@example.com', balance=float(i)) for i in range(4)]
+    with A.app.app_context():
+        for i in range(5):
+            A.db.session.add(A.KYCSubmission(full_name=f'P{i}', email=f'p{i}@example.com',
+                                             country='DE' if i % 2 else 'FR', date=f'2024-05-0{i + 1}T10:00:00'))
+        A.db.session.commit()
+
+    assert walk(client, 'users') == (users, 3, 5)
+    ids, pages, total = walk(client, 'submissions')
+    assert len(ids) == len(set(ids)) == total == 5 and ids == sorted(ids) and pages == 3
+    assert walk(client, 'submissions', 'country=DE')[2] == 2
+    assert walk(client, 'users', 'min_balance=2')[0] == users[3:]
+
+    page = client.get('/api/admin-dashboard?limit=2').json
+    assert set(page['users'][0]) == {'id', 'email', 'balance', 'referral_code'}  # no password hash
+    assert client.get('/api/admin-dashboard?users_cursor=not-a-cursor').status_code == 400
+
+
+def test_dashboard_is_admin_only(A, client):
+    login(client, make_user(A))
+    assert client.get('/api/admin-dashboard').status_code == 403
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import analytics
+import jobs
+from conftest import login, make_user
+
+
+@pytest.fixture
+def report(A):
+    reports = analytics.ReferralAnalytics(A.db, A.User, A.FreeplayEntry, A.Transaction, overlap=10)
+
+    def run():
+        with A.app.app_context():
+            now = datetime.utcnow()
+            return reports.report(now - timedelta(days=1), now)['totals']['signups']
+    return reports, run
+
+
+def test_users_committed_out_of_id_order_are_counted(A, report):
+    reports, signups = report
+    make_user(A, 'referrer@example.com', referral_code='REF', id=100)
+    make_user(A, 'a@example.com', referrer_code='REF', id=101)
+    assert signups() == 1
+    # Took id 95 before 101 but committed after it: inside the overlap
+    make_user(A, 'b@example.com', referrer_code='REF', id=95)
+    assert signups() == 2
+    # Far below anything re-read incrementally: found by the next full reload
+    make_user(A, 'c@example.com', referrer_code='REF', id=3)
+    assert signups() == 2
+    reports._loaded_at -= reports.reload_every
+    assert signups() == 3
+    assert list(reports._user_ids) == [3, 95, 100, 101]
+
+
+def seed_referrals(A):
+    """Two referrers over 2024-03-01..03, hand-counted in the tests below."""
+    day = lambda d, h: datetime(2024, 3, d, h)
+    make_user(A, 'r1@example.com', referral_code='R1', date_created=datetime(2024, 2, 1))
+    make_user(A, 'r2@example.com', referral_code='R2', date_created=datetime(2024, 2, 1))
+    users = {name: make_user(A, f'{name}@example.com', referrer_code=code, date_created=created)
+             for name, code, created in (('a', 'R1', day(1, 10)), ('b', 'R1', day(1, 12)), ('c', 'R1', day(2, 9)),
+                                         ('d', 'R2', day(2, 10)), ('e', 'R2', datetime(2024, 2, 15)))}
+    with A.app.app_context():
+        for name, code, when in (('a', 'R1', day(1, 11)), ('a', 'R1', day(2, 11)), ('c', 'R1', day(3, 8)),
+                                 ('e', 'R2', day(2, 15))):
+            A.db.session.add(A.FreeplayEntry(user_id=users[name], referral_code=code, reward=10.0, timestamp=when))
+        referrers = dict(A.db.session.execute(A.db.select(A.User.referral_code, A.User.id)
+                                              .where(A.User.referral_code.in_(['R1', 'R2']))).all())
+        for code, when in (('R1', day(1, 12)), ('R2', day(2, 10))):
+            A.db.session.add(A.Transaction(user_id=referrers[code], amount=5.0, type='bonus', timestamp=when))
+        A.db.session.commit()
+    return users
+
+
+@pytest.fixture
+def admin(A, client):
+    login(client, make_user(A, 'admin@example.com', date_created=datetime(2024, 1, 1)))
+    with A.app.app_context():
+        A.referral_analytics().clear()
+    return lambda query='': client.get(f'/api/admin/analytics/referrals?from=2024-03-01&to=2024-03-03{query}').json
+
+
+def test_funnel_conversion_and_cohorts_match_a_hand_count(A, admin):
+    seed_referrals(A)
+    report = admin()
+    assert report['totals'] == {"signups": 4, "claims": 4, "rewards": 40.0, "bonuses": 10.0}
+    assert report['daily'] == {"dates": ['2024-03-01', '2024-03-02', '2024-03-03'], "signups": [2, 2, 0],
+                               "claims": [1, 2, 1], "rewards": [10.0, 20.0, 10.0], "bonuses": [5.0, 5.0, 0.0]}
+    # R1 referred a, b, c in range (a and c claimed); R2 referred d in range
+    # (no claim) and e before it (claimed, so active)
+    assert report['funnel'] == [
+        {"code": 'R1', "signups": 3, "converted": 2, "conversion": 0.6667, "active_referred": 2, "claims": 3,
+         "rewards": 30.0, "bonuses": 5.0, "payouts": 35.0},
+        {"code": 'R2', "signups": 1, "converted": 0, "conversion": 0.0, "active_referred": 1, "claims": 1,
+         "rewards": 10.0, "bonuses": 5.0, "payouts": 15.0}]
+    # a (03-01) claimed on days 0 and 1 of its cohort; c (03-02) on day 1
+    assert report['cohorts'] == [{"cohort": '2024-03-01', "size": 2, "active": [1, 1, 0]},
+                                 {"cohort": '2024-03-02', "size": 2, "active": [0, 1]}]
+    only = admin('&code=R2')
+    assert [row['code'] for row in only['funnel']] == ['R2'] and only['cohorts'] == []
+    assert only['totals'] == {"signups": 1, "claims": 1, "rewards": 10.0, "bonuses": 5.0}
+
+
+def test_late_claims_reopen_settled_buckets(A, admin):
+    users = seed_referrals(A)
+    assert admin()['funnel'][0]['converted'] == 2  # every bucket is long settled and now cached
+    # b's claim failed to write at the time and waits as a job, with its
+    # original timestamp
+    with A.app.app_context():
+        A.job_queue.enqueue('freeplay_claim', {'user_id': users['b'], 'referral_code': 'R1', 'reward': 10.0,
+                                               'timestamp': '2024-03-01T13:00:00'})
+        A.db.session.commit()
+    assert admin()['daily']['claims'] == [1, 2, 1]
+    assert jobs.Worker(A.job_queue, A.app, name='test-worker').drain() == 1
+    report = admin()
+    assert report['daily']['claims'] == [2, 2, 1]
+    assert report['funnel'][0]['converted'] == 3 and report['funnel'][0]['conversion'] == 1.0
+    assert report['cohorts'][0] == {"cohort": '2024-03-01', "size": 2, "active": [2, 1, 0]}
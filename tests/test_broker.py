@@ -0,0 +1,57 @@
+import json
+import multiprocessing
+import os
+
+from broker import Broker, SocketRelay
+import jobs
+from conftest import login, make_user
+
+
+def _subscriber(directory, ready, received):
+    broker = Broker(relay=SocketRelay(directory))
+    sub = broker.subscribe(['leaderboard'])
+    ready.set()
+    received.put(sub.wait(10))
+
+
+def test_socket_relay_reaches_another_process(tmp_path):
+    ctx = multiprocessing.get_context('fork')
+    ready, received = ctx.Event(), ctx.Queue()
+    child = ctx.Process(target=_subscriber, args=(str(tmp_path), ready, received))
+    child.start()
+    try:
+        assert ready.wait(10)
+        publisher = Broker(relay=SocketRelay(str(tmp_path)))
+        assert publisher.publish('leaderboard', '[1]') == 0  # no local subscribers
+        assert received.get(timeout=10) == [('leaderboard', '[1]')]
+    finally:
+        child.join(10)
+    # The exited subscriber's socket is cleaned up (at exit, or by the next send)
+    publisher.publish('leaderboard', '[2]')
+    assert os.listdir(tmp_path) == []
+
+
+def test_full_stream_sends_state_and_asks_to_reconnect(A, client, monkeypatch):
+    user_id = make_user(A, balance=25.0)
+    login(client, user_id)
+    monkeypatch.setattr(A.broker, 'max_subscribers', 0)
+    resp = client.get('/api/stream')
+    assert resp.status_code == 200
+    body = resp.get_data(as_text=True)
+    assert body.startswith('retry: 15000\n\n')
+    assert 'event: balance\ndata: {"balance": 25.0}' in body
+
+
+def test_job_credits_are_published_after_commit(A):
+    user_id = make_user(A)
+    sub = A.broker.subscribe([f'user:{user_id}'])
+    try:
+        with A.app.app_context():
+            A.job_queue.enqueue('freeplay_claim', {'user_id': user_id, 'referral_code': 'LATE', 'reward': 10.0,
+                                                   'timestamp': '2024-01-01T12:00:00'})
+            A.db.session.commit()
+        assert sub.wait(0) == []
+        assert jobs.Worker(A.job_queue, A.app, name='test-worker').drain() == 1
+        assert sub.wait(1) == [(f'user:{user_id}', json.dumps({"balance": 10.0}))]
+    finally:
+        A.broker.unsubscribe(sub)
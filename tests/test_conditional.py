@@ -0,0 +1,79 @@
+import gzip
+
+import pytest
+from sqlalchemy import event
+
+from conftest import login, make_user
+
+
+@pytest.fixture
+def queries(A):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with A.app.app_context():
+        engine = A.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+def revalidate(client, url, etag):
+    return client.get(url, headers={'If-None-Match': etag})
+
+
+def test_leaderboard_is_304_until_a_claim_places(A, client):
+    login(client, make_user(A))
+    first = client.get('/api/leaderboard')
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    unchanged = revalidate(client, '/api/leaderboard', etag)
+    assert unchanged.status_code == 304 and unchanged.data == b'' and unchanged.headers['ETag'] == etag
+
+    client.post('/api/freeplay', json={'referral_code': 'CODE'})
+    changed = revalidate(client, '/api/leaderboard', etag)
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert len(changed.json['leaderboard']) == 1
+
+
+def test_user_info_is_304_until_the_balance_changes(A, client):
+    login(client, make_user(A))
+    etag = client.get('/api/user-info').headers['ETag']
+    assert revalidate(client, '/api/user-info', etag).status_code == 304
+
+    client.post('/api/freeplay', json={'referral_code': 'CODE'})
+    changed = revalidate(client, '/api/user-info', etag)
+    assert changed.status_code == 200 and changed.json['balance'] == 10.0
+
+
+def test_dashboard_304_skips_the_view_queries(A, client, queries):
+    login(client, make_user(A, 'admin@example.com'))
+    first = client.get('/api/admin-dashboard')
+    assert len(queries) > 1
+    del queries[:]
+    assert revalidate(client, '/api/admin-dashboard', first.headers['ETag']).status_code == 304
+    assert len(queries) == 1 and 'max(kyc_submission.id)' in queries[0]  # the validator only
+
+    make_user(A, 'new@example.com')
+    assert revalidate(client, '/api/admin-dashboard', first.headers['ETag']).status_code == 200
+    other_page = revalidate(client, '/api/admin-dashboard?limit=1', first.headers['ETag'])
+    assert other_page.status_code == 200
+
+
+def test_large_bodies_are_gzipped_and_savings_reported(A, client):
+    login(client, make_user(A, 'admin@example.com'))
+    for i in range(40):
+        make_user(A, f'user{i}@example.com')
+    saved = lambda: client.get('/api/cache-stats').json['api'].get('admin.admin_dashboard', {}).get('bytes_saved', 0)
+    before = saved()
+    plain = client.get('/api/admin-dashboard?limit=50')
+    assert 'Content-Encoding' not in plain.headers and 'Accept-Encoding' in plain.headers['Vary']
+    packed = client.get('/api/admin-dashboard?limit=50', headers={'Accept-Encoding': 'gzip'})
+    assert packed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(packed.data) == plain.data and len(packed.data) < len(plain.data)
+    small = client.get('/api/user-info', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+
+    assert saved() - before == len(plain.data) - len(packed.data)
@@ -0,0 +1,57 @@
+from flask import g, session
+from flask_login import login_user
+
+from conftest import make_user
+
+
+def pinned(A, method, user_id=None, wrote=False):
+    with A.app.test_request_context('/api/anything', method=method):
+        if user_id is not None:
+            login_user(A.db.session.get(A.User, user_id))
+        if wrote:
+            g._db_wrote = True
+        A.db_router._pin(None)
+        return '_primary_until' in session
+
+
+def test_only_writes_and_signed_in_posts_pin_to_the_primary(A):
+    user_id = make_user(A)
+    assert not pinned(A, 'POST')  # e.g. a failed login: nothing written, no cookie
+    assert not pinned(A, 'GET', user_id)
+    assert pinned(A, 'GET', wrote=True)
+    assert pinned(A, 'POST', user_id)
+
+
+def test_concurrent_requests_share_one_replica_per_bind(tmp_path, monkeypatch):
+    import time
+    from types import SimpleNamespace
+    from threading import Barrier, Thread
+
+    from sqlalchemy import create_engine
+
+    import db_routing
+
+    class SlowReplica(db_routing._Replica):
+        __slots__ = ()
+
+        def __init__(self, *args):
+            time.sleep(0.01)  # widen the window between lookup and registration
+            super().__init__(*args)
+
+    monkeypatch.setattr(db_routing, '_Replica', SlowReplica)
+    engines = {None: create_engine(f'sqlite:///{tmp_path}/primary.db'),
+               'replica0': create_engine(f'sqlite:///{tmp_path}/replica.db')}
+    router = db_routing.ReplicaRouter(SimpleNamespace(engines=engines))
+    barrier, seen = Barrier(8), []
+
+    def first_request():
+        barrier.wait()
+        seen.extend(router._current())
+
+    threads = [Thread(target=first_request) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(seen) == 8 and len({id(r) for r in seen}) == 1
+    assert list(router.stats()['replicas']) == ['replica0']
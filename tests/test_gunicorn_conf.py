@@ -0,0 +1,35 @@
+import os
+import runpy
+
+import pytest
+
+from conftest import login, make_user
+
+CONF = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gunicorn.conf.py')
+
+
+@pytest.mark.parametrize('mode, worker_class', [('threaded', 'gthread'), ('sync', 'sync')])
+def test_config_leaves_the_environment_alone(monkeypatch, mode, worker_class):
+    monkeypatch.setenv('GUNICORN_WORKER_MODE', mode)
+    before = dict(os.environ)
+    conf = runpy.run_path(CONF)
+    assert conf['worker_class'] == worker_class
+    assert dict(os.environ) == before
+
+
+def test_sync_workers_turn_the_stream_off(A, client, monkeypatch):
+    monkeypatch.setattr(A, 'STREAM_ENABLED', True)
+    login(client, make_user(A))
+    A.configure_stream('sync', 1)
+    assert client.get('/api/stream').status_code == 204
+
+
+def test_threaded_workers_cap_streams_at_half_their_threads(A, monkeypatch):
+    monkeypatch.delenv('STREAM_MAX_SUBSCRIBERS', raising=False)
+    monkeypatch.setattr(A.broker, 'max_subscribers', 1000)
+    A.configure_stream('gthread', 8)
+    assert A.broker.max_subscribers == 4
+    monkeypatch.setenv('STREAM_MAX_SUBSCRIBERS', '100')
+    A.broker.max_subscribers = 100
+    A.configure_stream('gthread', 8)
+    assert A.broker.max_subscribers == 100  # an explicit setting wins
@@ -0,0 +1,136 @@
+import base64
+import re
+import threading
+import time
+
+import pytest
+
+import jobs
+from conftest import make_user
+from smtp_sink import SMTPSink
+
+
+@pytest.fixture
+def outbox(A, tmp_path, monkeypatch):
+    sink = SMTPSink(str(tmp_path / 'outbox'), port=0).start()
+    monkeypatch.setattr(A.mail, 'port', sink.port)
+    yield sink
+    A.mail.close()
+    sink.stop()
+
+
+def drain(A):
+    return jobs.Worker(A.job_queue, A.app, name='test-worker').drain()
+
+
+def test_password_reset_link_round_trip(A, client, outbox):
+    user_id = make_user(A, 'reset@example.com', 'old-password')
+    assert client.post('/api/password-reset', json={'email': 'reset@example.com'}).status_code == 202
+    assert drain(A) == 1
+
+    raw = outbox.messages[-1][1].decode()
+    link = re.search(r'http://localhost:5000(/reset-password/[^"\s<]+)', raw.replace('=\r\n', '')).group(1)
+    token = link.rsplit('/', 1)[1]
+    with A.app.app_context():
+        stored = A.db.session.get(A.User, user_id).password
+    payload = base64.urlsafe_b64decode(token.split('.')[0] + '==').decode()
+    assert stored[-12:] not in payload  # the token must not leak any of the hash
+
+    page = client.get(link)  # what the email client opens
+    assert page.status_code == 200
+    assert b'name="password"' in page.data
+
+    assert client.post(link, data={'password': 'new-password'}).status_code == 200
+    with A.app.app_context():
+        user = A.db.session.get(A.User, user_id)
+        assert user.check_password('new-password')
+    # Changing the password retires the link
+    assert client.get(link).status_code == 400
+    assert client.post(link, json={'password': 'again'}).status_code == 400
+
+
+def test_reset_rejects_forged_token(client, A):
+    assert client.get('/reset-password/not-a-token').status_code == 400
+
+
+def test_reset_requests_are_deduplicated(A, client):
+    make_user(A, 'dup@example.com')
+    for _ in range(3):
+        assert client.post('/api/password-reset', json={'email': 'dup@example.com'}).status_code == 202
+    with A.app.app_context():
+        assert A.db.session.scalar(A.db.select(A.db.func.count()).select_from(A.Job)) == 1
+
+
+def test_enqueue_with_taken_dedupe_key_returns_existing_job(A):
+    with A.app.app_context():
+        first = A.job_queue.enqueue('noop', {'n': 1}, dedupe_key='k')
+        A.db.session.commit()
+        first_id = first.id
+    with A.app.app_context():
+        # A second process that has not seen the first row yet
+        again = A.job_queue.enqueue('noop', {'n': 2}, dedupe_key='k')
+        A.db.session.commit()
+        assert again.id == first_id
+        assert A.db.session.scalar(A.db.select(A.db.func.count()).select_from(A.Job)) == 1
+
+
+def test_failing_job_backs_off_then_goes_dead(A, monkeypatch):
+    calls = []
+
+    @A.job_queue.handler('flaky')
+    def flaky(payload):
+        calls.append(payload)
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(A.job_queue, 'backoff', 0)
+    with A.app.app_context():
+        A.job_queue.enqueue('flaky', {'n': 1}, max_attempts=3)
+        A.db.session.commit()
+    for _ in range(3):
+        drain(A)
+    with A.app.app_context():
+        job = A.db.session.scalar(A.db.select(A.Job))
+        assert (job.status, job.attempts) == (jobs.DEAD, 3)
+        assert 'boom' in job.last_error
+        assert A.job_queue.requeue([job.id]) == 1
+    assert len(calls) == 3
+
+
+def test_permanent_failure_skips_retries(A):
+    @A.job_queue.handler('hopeless')
+    def hopeless(payload):
+        raise jobs.PermanentFailure('bad input')
+
+    with A.app.app_context():
+        A.job_queue.enqueue('hopeless')
+        A.db.session.commit()
+    drain(A)
+    with A.app.app_context():
+        job = A.db.session.scalar(A.db.select(A.Job))
+        assert (job.status, job.attempts) == (jobs.DEAD, 1)
+
+
+def test_long_job_keeps_its_lease(A, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    @A.job_queue.handler('slow')
+    def slow(payload):
+        started.set()
+        release.wait(5)
+        return {'ok': True}
+
+    monkeypatch.setattr(A.job_queue, 'lease', 0.3)
+    with A.app.app_context():
+        A.job_queue.enqueue('slow')
+        A.db.session.commit()
+    runner = threading.Thread(target=drain, args=(A,))
+    runner.start()
+    assert started.wait(5)
+    time.sleep(1.0)  # three leases
+    with A.app.app_context():
+        assert A.job_queue.claim('other-worker') == []
+    release.set()
+    runner.join(5)
+    with A.app.app_context():
+        job = A.db.session.scalar(A.db.select(A.Job))
+        assert (job.status, job.attempts) == (jobs.DONE, 1)
@@ -0,0 +1,72 @@
+import csv
+import io
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+import jobs
+from conftest import login, make_user
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def add_submissions(A, *dates):
+    with A.app.app_context():
+        for i, date in enumerate(dates):
+            A.db.session.add(A.KYCSubmission(full_name=f'Person {i}', email=f'p{i}@example.com', date=date))
+        A.db.session.commit()
+
+
+def test_until_date_includes_the_whole_day(A, client):
+    admin_id = make_user(A, 'admin@example.com')
+    login(client, admin_id)
+    add_submissions(A, '2024-04-30T23:59:59', '2024-05-01T00:00:00', '2024-05-01T18:30:00.123456',
+                    '2024-05-02T00:00:00')
+    resp = client.get('/api/download-kyc-csv?since=2024-05-01&until=2024-05-01')
+    rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+    assert [r['Date'] for r in rows] == ['2024-05-01T00:00:00', '2024-05-01T18:30:00.123456']
+
+    resp = client.get('/api/download-kyc-csv?until=2024-05-01 12:00')
+    assert resp.get_data(as_text=True).count('\n') == 3  # header and the two rows up to noon
+    assert client.get('/api/download-kyc-csv?until=May').status_code == 400
+
+    dashboard = client.get('/api/admin-dashboard?until=2024-05-01').json
+    assert dashboard['submissions_total'] == 3
+    with A.app.app_context():
+        A.db.session.get(A.User, admin_id).date_created = datetime(2024, 5, 1, 9, 0)
+        A.db.session.commit()
+    assert client.get('/api/admin-dashboard?joined_until=2024-05-01').json['users_total'] == 1
+    assert client.get('/api/admin-dashboard?joined_until=2024-04-30').json['users_total'] == 0
+
+
+def test_queued_export_is_served_from_the_database(A, client, monkeypatch):
+    login(client, make_user(A, 'admin@example.com'))
+    add_submissions(A, *[f'2024-05-01T{h:02}:00:00' for h in range(24)])
+    monkeypatch.setattr(A, 'JOB_DATA_CHUNK_BYTES', 100)  # several chunks
+    job_id = client.post('/api/admin/exports?since=2024-05-01T06:00').json['job_id']
+    assert client.get(f'/api/admin/exports/{job_id}').status_code == 202
+    assert jobs.Worker(A.job_queue, A.app, name='test-worker').drain() == 1
+
+    resp = client.get(f'/api/admin/exports/{job_id}')
+    assert resp.status_code == 200
+    assert 'attachment' in resp.headers['Content-Disposition']
+    body = resp.get_data(as_text=True)
+    assert int(resp.headers['Content-Length']) == len(body.encode())
+    rows = list(csv.DictReader(io.StringIO(body)))
+    assert [r['Date'] for r in rows] == [f'2024-05-01T{h:02}:00:00' for h in range(6, 24)]
+    with A.app.app_context():
+        assert A.db.session.scalar(A.db.select(A.db.func.count()).select_from(A.JobData)) > 1
+
+
+def test_production_requires_a_shared_database_and_public_url(tmp_path):
+    env = dict(os.environ, FLASK_ENV='production', PUBLIC_URL='https://example.com')
+    env.pop('SQLALCHEMY_DATABASE_URI')
+    run = lambda: subprocess.run([sys.executable, '-c', 'import app'], cwd=ROOT, env=env,
+                                 capture_output=True, text=True)
+    assert 'SQLALCHEMY_DATABASE_URI must be set' in run().stderr
+    env['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'x.db'}"
+    assert 'not SQLite' in run().stderr
+    env['SQLALCHEMY_DATABASE_URI'] = 'postgresql://db.example.com/sportzino'
+    env.pop('PUBLIC_URL')
+    assert 'PUBLIC_URL must be set' in run().stderr
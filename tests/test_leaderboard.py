@@ -0,0 +1,69 @@
+import json
+
+from sqlalchemy import event, text
+
+from conftest import login, make_user
+from leaderboard import Leaderboard
+
+
+def claim(A, board, reward, user_id=1):
+    entry = A.FreeplayEntry(user_id=user_id, referral_code='CODE', reward=reward)
+    A.db.session.add(entry)
+    placed = board.record(entry)
+    A.db.session.commit()
+    return placed
+
+
+def amounts(board):
+    return [row['amount'] for row in json.loads(board.snapshot()[0])['leaderboard']]
+
+
+def test_board_keeps_the_top_entries_and_trims_the_rest(A):
+    with A.app.app_context():
+        board = Leaderboard(A.db, A.FreeplayEntry, A.LeaderboardEntry, size=3, ttl=0)
+        assert [claim(A, board, r) for r in (5.0, 20.0, 10.0, 15.0, 1.0, 20.0)] == [
+            True, True, True, True, False, True]
+        assert amounts(board) == [20.0, 20.0, 15.0]
+        # Trimmed to size; equal rewards rank by entry, the earlier first
+        assert A.db.session.scalars(text("SELECT entry_id FROM leaderboard_entry ORDER BY reward DESC, entry_id")
+                                    ).all() == [2, 6, 4]
+
+        A.db.session.execute(text("DELETE FROM leaderboard_entry"))
+        A.db.session.commit()
+        assert board.rebuild() == 3
+        assert amounts(board) == [20.0, 20.0, 15.0]
+
+
+def test_claims_that_cannot_place_cost_no_board_queries(A):
+    with A.app.app_context():
+        board = Leaderboard(A.db, A.FreeplayEntry, A.LeaderboardEntry, size=2, ttl=0)
+        for reward in (10.0, 10.0):
+            claim(A, board, reward)
+        statements = []
+        listen = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(A.db.engine, 'before_cursor_execute', listen)
+        try:
+            assert claim(A, board, 10.0) is False
+        finally:
+            event.remove(A.db.engine, 'before_cursor_execute', listen)
+        assert not [s for s in statements if 'leaderboard_entry' in s]
+        assert claim(A, board, 11.0) is True
+        assert amounts(board) == [11.0, 10.0]
+
+
+def test_upgrade_fills_new_summary_tables(A, client):
+    a = make_user(A, 'a@example.com')
+    b = make_user(A, 'b@example.com', referrer_code='a')
+    login(client, b)
+    assert client.post('/api/freeplay', json={'referral_code': 'a'}).status_code == 200
+    with A.app.app_context():
+        A.referrals.rebuild(A.Transaction)
+        with A.db.engine.begin() as conn:
+            for table in ('leaderboard_entry', 'referral_closure', 'referral_stats'):
+                conn.execute(text(f"DROP TABLE {table}"))
+        A.leaderboard.clear()
+        result = A.app.test_cli_runner().invoke(args=['upgrade-db'])
+        assert 'CREATE TABLE leaderboard_entry' in result.output, result.output
+        assert 'Leaderboard rebuilt with 1 entries.' in result.output
+        assert A.referrals.subtree(a)['members'] == 1
+    assert client.get('/api/leaderboard').json['leaderboard'][0]['user_id'] == b
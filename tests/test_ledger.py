@@ -0,0 +1,72 @@
+import threading
+
+from sqlalchemy import func, select, update
+
+from conftest import login, make_user
+
+
+def check_ledger(A, *args):
+    return A.app.test_cli_runner().invoke(args=['check-ledger', *args]).output
+
+
+def balance_and_entries(A, user_id):
+    with A.app.app_context():
+        balance = A.db.session.get(A.User, user_id).balance
+        entries = A.db.session.scalars(select(A.Transaction.amount).where(A.Transaction.user_id == user_id)).all()
+        return balance, entries
+
+
+def test_concurrent_credits_are_all_kept(A):
+    user_id = make_user(A)
+    clients = [A.app.test_client() for _ in range(8)]
+    for client in clients:
+        login(client, user_id)
+    start = threading.Barrier(len(clients))
+    statuses = []
+
+    def claim(client):
+        start.wait()
+        for n in range(3):
+            statuses.append(client.post('/api/freeplay', json={'referral_code': f'CODE{n}'}).status_code)
+
+    threads = [threading.Thread(target=claim, args=(c,)) for c in clients]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert statuses == [200] * 24
+    balance, entries = balance_and_entries(A, user_id)
+    assert balance == 240.0 and entries == [10.0] * 24
+    with A.app.app_context():
+        assert A.db.session.scalar(select(A.User.version_id).where(A.User.id == user_id)) == 25
+    assert check_ledger(A).strip() == '0 mismatched balances.'
+
+
+def test_check_ledger_finds_and_adopts_drift(A, client):
+    user_id = make_user(A)
+    login(client, user_id)
+    client.post('/api/freeplay', json={'referral_code': 'CODE'})
+    with A.app.app_context():
+        # e.g. a balance set before the ledger existed
+        A.db.session.execute(update(A.User).where(A.User.id == user_id).values(balance=25.0))
+        A.db.session.commit()
+
+    assert check_ledger(A).splitlines() == [f'user {user_id}: balance 25.0 != ledger 10.0', '1 mismatched balances.']
+    assert 'Adopted 1 balances' in check_ledger(A, '--adopt')
+    assert balance_and_entries(A, user_id) == (25.0, [10.0, 15.0])
+    assert check_ledger(A).strip() == '0 mismatched balances.'
+
+
+def test_check_ledger_reset_restores_ledger_totals(A, client):
+    user_id = make_user(A)
+    login(client, user_id)
+    client.post('/api/freeplay', json={'referral_code': 'CODE'})
+    with A.app.app_context():
+        A.db.session.execute(update(A.User).where(A.User.id == user_id).values(balance=99.0))
+        A.db.session.commit()
+
+    assert 'Reset 1 balances' in check_ledger(A, '--reset')
+    assert balance_and_entries(A, user_id) == (10.0, [10.0])
+    assert client.get('/api/user-info').json['balance'] == 10.0
+    with A.app.app_context():
+        assert A.db.session.scalar(select(func.count()).select_from(A.Transaction)) == 1
@@ -0,0 +1,95 @@
+import json
+import os
+import re
+import time
+
+from flask import Flask, Response
+from sqlalchemy import create_engine, text
+
+import metrics
+from metrics import Metrics
+
+
+def write(directory, pid, requests, token='a'):
+    dump = {'hist': {}, 'counters': {'http_requests_total': [[['pages.home', 'GET', '200'], requests]]}}
+    with open(os.path.join(directory, f'metrics-{pid}-{token}.json'), 'w') as f:
+        json.dump(dump, f)
+
+
+def test_exited_workers_are_folded_not_dropped(tmp_path):
+    directory = str(tmp_path)
+    live = Metrics(directory=directory)
+    for pid, requests in ((101, 3), (102, 4), (103, 5)):
+        write(directory, pid, requests)
+    before = live.render()
+    assert 'http_requests_total{route="pages.home",method="GET",status="200"} 12' in before
+
+    metrics.retire(directory, 101)
+    metrics.retire(directory, 102)
+    metrics.retire(directory, 999)  # never wrote a file
+    own = {n for n in os.listdir(directory) if n.startswith(f'metrics-{os.getpid()}-')}
+    assert len(own) == 1
+    assert set(os.listdir(directory)) == own | {'metrics-103-a.json', metrics.RETIRED}
+    assert live.render() == before
+
+    # A scrape between the retired file's replace and the unlink counts it once
+    write(directory, 102, 4)
+    assert live.render() == before
+    # A new worker that got a retired worker's pid is a different file
+    write(directory, 101, 2, token='b')
+    assert 'http_requests_total{route="pages.home",method="GET",status="200"} 14' in live.render()
+
+
+def sample(text_, name, **labels):
+    wanted = ','.join(f'{k}="{v}"' for k, v in labels.items())
+    return float(re.search(rf'^{name}\{{{re.escape(wanted)}\}} (\S+)$', text_, re.M).group(1))
+
+
+def test_requests_are_timed_and_their_queries_counted():
+    app = Flask(__name__)
+    recorder = Metrics(app, n_plus_one=5)
+    engine = create_engine('sqlite://')
+
+    @app.route('/slow')
+    def slow():
+        time.sleep(0.03)
+        return 'ok'
+
+    @app.route('/three')
+    def three():
+        with engine.connect() as conn:
+            for n in (1, 2, 3):
+                conn.execute(text(f'SELECT {n}'))
+        return 'ok'
+
+    @app.route('/loop')
+    def loop():
+        with engine.connect() as conn:
+            for n in range(6):
+                conn.execute(text('SELECT :n'), {'n': n})
+        return 'ok'
+
+    @app.route('/stream')
+    def stream():
+        def rows():
+            # Runs after the view returned, while the body is sent
+            with engine.connect() as conn:
+                for n in (1, 2):
+                    yield f'{conn.execute(text(f"SELECT {n}")).scalar()}\n'
+        return Response(rows())
+
+    client = app.test_client()
+    for path in ('/slow', '/three', '/loop', '/stream'):
+        assert client.get(path, buffered=True).status_code == 200
+    out = recorder.render()
+
+    assert sample(out, 'http_request_duration_seconds_bucket', route='slow', method='GET', le='0.025') == 0
+    assert sample(out, 'http_request_duration_seconds_sum', route='slow', method='GET') >= 0.03
+    assert sample(out, 'http_requests_total', route='three', method='GET', status='200') == 1
+    assert sample(out, 'db_queries_per_request_sum', route='three') == 3
+    assert sample(out, 'db_queries_per_request_sum', route='loop') == 6
+    assert sample(out, 'db_queries_per_request_sum', route='stream') == 2
+    assert sample(out, 'db_queries_per_request_sum', route='slow') == 0
+    # Six runs of one statement reach the threshold; three different ones don't
+    assert sample(out, 'db_n_plus_one_total', route='loop') == 1
+    assert 'db_n_plus_one_total{route="three"}' not in out
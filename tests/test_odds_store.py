@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+import pytest
+
+import odds_store
+from odds_store import OddsStore
+
+
+def game(odds, team1='Arsenal', team2='Chelsea'):
+    return {'title': 'Premier League', 'team1': team1, 'team2': team2, 'odds': odds}
+
+
+def sizes(path):
+    return {name: os.path.getsize(os.path.join(path, name))
+            for name in ('ts.i8', 'match.i4', 'slot.i2', 'value.f8', 'matches.i4')}
+
+
+def test_only_changes_are_appended_and_survive_reopening(tmp_path):
+    store = OddsStore(str(tmp_path))
+    assert store.ingest([game(['2.0', '3/1', 'x'])], ts=1) == 3
+    assert store.ingest([game(['2.0', '3/1', 'x'])], ts=2) == 0
+    assert store.ingest([game(['2.5', '3/1', 'x']), game(['1.5'], team2='Spurs')], ts=3) == 2
+
+    store = OddsStore(str(tmp_path))
+    assert store.rows == 5
+    ts, slot, value = store.history(store.find_matches('Chelsea')[0])
+    assert ts.tolist() == [1000, 1000, 1000, 3000]
+    assert value[[0, 1, 3]].tolist() == [2.0, 4.0, 2.5] and np.isnan(value[2])
+    assert store.ingest([game(['2.5', '3/1', 'x'])], ts=4) == 0  # diffed against the committed state
+
+
+def test_crash_before_commit_is_rolled_back_on_open(tmp_path):
+    store = OddsStore(str(tmp_path))
+    store.ingest([game(['2.0', '3.0'])], ts=1)
+    committed = sizes(str(tmp_path))
+    # Died halfway through the next ingest: a new match, two whole columns
+    # and half a value written, state.json never replaced
+    with open(tmp_path / 'matches.i4', 'ab') as f:
+        f.write(np.array([0, 3, 4], '<i4').tobytes())
+    for name, data in (('ts.i8', np.array([2000], '<i8')), ('match.i4', np.array([1], '<i4'))):
+        with open(tmp_path / name, 'ab') as f:
+            f.write(data.tobytes())
+    with open(tmp_path / 'value.f8', 'ab') as f:
+        f.write(b'\0\0\0')
+
+    store = OddsStore(str(tmp_path))
+    assert sizes(str(tmp_path)) == committed
+    assert store.ingest([game(['2.0', '3.5']), game(['1.1'], team2='Spurs')], ts=3) == 2
+    cols = store.columns()
+    assert cols['match'].tolist() == [0, 0, 0, 1]
+    assert cols['value'].tolist() == [2.0, 3.0, 3.5, 1.1]
+
+
+def test_failed_ingest_leaves_the_store_consistent(tmp_path, monkeypatch):
+    store = OddsStore(str(tmp_path))
+    store.ingest([game(['2.0'])], ts=1)
+    real_open = open
+
+    def failing_open(path, mode='r', *args, **kwargs):
+        if str(path).endswith('slot.i2') and 'a' in mode:
+            raise OSError('disk full')
+        return real_open(path, mode, *args, **kwargs)
+
+    monkeypatch.setattr(odds_store, 'open', failing_open, raising=False)
+    with pytest.raises(OSError):
+        store.ingest([game(['2.2']), game(['9.0'], team2='Spurs')], ts=2)
+    monkeypatch.undo()
+    assert store.ingest([game(['2.2']), game(['9.0'], team2='Spurs')], ts=3) == 2
+    for reopened in (store, OddsStore(str(tmp_path))):
+        cols = reopened.columns()
+        assert cols['ts'].tolist() == [1000, 3000, 3000]
+        assert cols['match'].tolist() == [0, 0, 1]
+
+
+def test_timestamps_never_go_backwards(tmp_path, monkeypatch):
+    store = OddsStore(str(tmp_path))
+    store.ingest([game(['2.0'])], ts=5)
+    with pytest.raises(ValueError):
+        OddsStore(str(tmp_path)).ingest([game(['2.5'])], ts=4)
+    monkeypatch.setattr(odds_store.time, 'time', lambda: 3.0)  # clock stepped back
+    assert store.ingest([game(['3.0'])]) == 1
+    assert store.ingest([game(['3.0'])], ts=5) == 0
+    cols = OddsStore(str(tmp_path)).columns()
+    assert cols['ts'].tolist() == [5000, 5000]
+    assert store.history(0, start=5, end=5)[2].tolist() == [2.0, 3.0]
+
+
+def test_nothing_is_kept_without_a_commit(tmp_path):
+    with open(tmp_path / 'ts.i8', 'ab') as f:  # died before the first state.json
+        f.write(np.array([1000], '<i8').tobytes())
+    store = OddsStore(str(tmp_path))
+    assert store.rows == 0 and os.path.getsize(tmp_path / 'ts.i8') == 0
+    assert store.ingest([game(['2.0'])], ts=2) == 1
+    assert OddsStore(str(tmp_path)).columns()['ts'].tolist() == [2000]
@@ -0,0 +1,46 @@
+import threading
+import time
+
+from sqlalchemy import select, update
+from werkzeug.security import generate_password_hash
+
+from conftest import make_user
+from passwords import PasswordHasher
+
+
+def stored_hash(A, user_id):
+    with A.app.app_context():
+        return A.db.session.scalar(select(A.User.password).where(A.User.id == user_id))
+
+
+def test_login_rehashes_at_the_configured_cost(A, client):
+    user_id = make_user(A, 'old@example.com', 'secret')
+    current = stored_hash(A, user_id)
+    with A.app.app_context():
+        A.db.session.execute(update(A.User).where(A.User.id == user_id)
+                             .values(password=generate_password_hash('secret', 'pbkdf2:sha256:500')))
+        A.db.session.commit()
+
+    login = lambda: client.post('/login', data={'email': 'old@example.com', 'password': 'secret'})
+    assert login().status_code == 302
+    upgraded = stored_hash(A, user_id)
+    assert upgraded.split('$')[0] == current.split('$')[0] == 'pbkdf2:sha256:1000'
+    assert login().status_code == 302
+    assert stored_hash(A, user_id) == upgraded  # already at cost: left alone
+
+
+def test_full_hasher_answers_503(A, client, monkeypatch):
+    user_id = make_user(A, 'busy@example.com')
+    with A.app.app_context():
+        token = A.email_token('reset').dumps([user_id, A.password_fingerprint(A.db.session.get(A.User, user_id))])
+    busy = PasswordHasher(method='pbkdf2:sha256:1000', workers=1, queue_size=0, timeout=0.05)
+    monkeypatch.setattr(A, 'hasher', busy)
+    # Holds the only slot for a while: a stored hash with a very high cost
+    slow = threading.Thread(target=busy.verify, args=('pbkdf2:sha256:2000000$salt$00', 'guess'))
+    slow.start()
+    time.sleep(0.05)
+    resp = client.post(f'/reset-password/{token}', json={'password': 'new-secret'})
+    slow.join()
+    assert resp.status_code == 503 and resp.headers['Retry-After'] == '1'
+    assert client.post(f'/reset-password/{token}', json={'password': 'new-secret'}).status_code == 200
+    busy.shutdown()
@@ -0,0 +1,158 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+import payments
+from conftest import login, make_user
+
+
+class FakeProvider(ThreadingHTTPServer):
+    """Local stand-in for the Stripe and PayPal endpoints the gateways call.
+    Dedupes on the idempotency headers like the real APIs; ``script`` holds
+    canned (status, body, delay) replies served before the normal ones."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.calls = []
+        self.script = []
+        self.objects = {}
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        server.calls.append((self.path, dict(self.headers), body))
+        if server.script:
+            status, reply, delay = server.script.pop(0)
+            time.sleep(delay)
+            return self.reply(status, reply)
+        if self.path == '/v1/oauth2/token':
+            return self.reply(200, {'access_token': 'tok', 'expires_in': 3600})
+        key = self.headers.get('Idempotency-Key') or self.headers.get('PayPal-Request-Id')
+        if key not in server.objects:
+            n = len(server.objects) + 1
+            if self.path == '/v1/checkout/sessions':
+                fields = parse_qs(body.decode())
+                assert fields['line_items[0][price_data][unit_amount]'] == ['1000']
+                server.objects[key] = {'id': f'cs_{n}', 'url': f'https://checkout.example/cs_{n}'}
+            else:
+                server.objects[key] = {'id': f'PAY-{n}', 'links': [
+                    {'href': f'https://paypal.example/PAY-{n}', 'method': 'REDIRECT'}]}
+        self.reply(200, server.objects[key])
+
+    def reply(self, status, body):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json' if not isinstance(body, bytes) else 'text/html')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def provider(A, monkeypatch):
+    server = FakeProvider()
+    breaker = dict(threshold=2, cooldown=60)
+    gateways = (payments.StripeGateway('sk_test', base_url=server.url, timeout=(1, 0.5),
+                                       breaker=payments.CircuitBreaker(**breaker)),
+                payments.PayPalGateway('id', 'secret', base_url=server.url, timeout=(1, 0.5),
+                                       breaker=payments.CircuitBreaker(**breaker)))
+    monkeypatch.setattr(A, 'payment_gateways', lambda: gateways)
+    yield server
+    server.shutdown()
+
+
+def checkouts(server):
+    return [c for c in server.calls if c[0] == '/v1/checkout/sessions']
+
+
+def test_double_submit_makes_one_remote_call(client, provider):
+    first = client.post('/api/create-checkout-session')
+    second = client.post('/api/create-checkout-session')
+    assert first.status_code == second.status_code == 200
+    assert first.json == second.json
+    assert len(checkouts(provider)) == 1
+
+
+def test_anonymous_buyers_behind_one_address_get_separate_sessions(A, provider):
+    one, two = A.app.test_client(), A.app.test_client()  # same remote_addr
+    assert one.post('/api/create-checkout-session').json != two.post('/api/create-checkout-session').json
+    keys = {headers['Idempotency-Key'] for _, headers, _ in checkouts(provider)}
+    assert len(keys) == 2
+
+
+def test_signed_in_user_is_keyed_on_account(A, provider):
+    user_id = make_user(A)
+    one, two = A.app.test_client(), A.app.test_client()
+    login(one, user_id)
+    login(two, user_id)
+    assert one.post('/api/create-checkout-session').json == two.post('/api/create-checkout-session').json
+    assert len(checkouts(provider)) == 1
+
+
+def test_retry_after_provider_error_reuses_the_key(client, provider):
+    provider.script.append((502, {'error': 'bad gateway'}, 0))
+    assert client.post('/api/create-checkout-session', headers={'Idempotency-Key': 'order-1'}).status_code == 503
+    retry = client.post('/api/create-checkout-session', headers={'Idempotency-Key': 'order-1'})
+    assert retry.status_code == 200
+    sent = [headers['Idempotency-Key'] for _, headers, _ in checkouts(provider)]
+    assert len(sent) == 2 and sent[0] == sent[1]
+
+
+def test_explicit_key_is_scoped_to_the_user(A, provider):
+    one, two = A.app.test_client(), A.app.test_client()
+    login(one, make_user(A, 'one@example.com'))
+    login(two, make_user(A, 'two@example.com'))
+    headers = {'Idempotency-Key': 'order-1'}
+    first = one.post('/api/create-checkout-session', headers=headers)
+    assert one.post('/api/create-checkout-session', headers=headers).json == first.json
+    assert two.post('/api/create-checkout-session', headers=headers).json != first.json
+    keys = {headers['Idempotency-Key'] for _, headers, _ in checkouts(provider)}
+    assert len(keys) == 2
+
+
+def test_breaker_opens_after_repeated_failures(client, provider):
+    provider.script.extend([(500, {}, 0), (500, {}, 0)])
+    for n in range(2):
+        client.post('/api/create-checkout-session', headers={'Idempotency-Key': f'k{n}'})
+    assert client.post('/api/create-checkout-session', headers={'Idempotency-Key': 'k3'}).status_code == 503
+    assert len(checkouts(provider)) == 2  # the third never left the process
+
+
+def test_slow_provider_times_out(client, provider):
+    provider.script.append((200, {'url': 'late'}, 1.5))
+    start = time.monotonic()
+    assert client.post('/api/create-checkout-session').status_code == 503
+    assert time.monotonic() - start < 1.4
+
+
+def test_non_json_responses(client, provider):
+    provider.script.append((200, b'<html>maintenance</html>', 0))
+    assert client.post('/api/create-checkout-session', headers={'Idempotency-Key': 'a'}).status_code == 503
+    provider.script.append((403, b'<html>forbidden</html>', 0))
+    response = client.post('/api/create-checkout-session', headers={'Idempotency-Key': 'b'})
+    assert response.status_code == 500
+    assert 'provider returned 403' in response.json['error']
+
+
+def test_paypal_token_is_reused_and_payments_deduped(client, provider):
+    body = {'intent': 'sale', 'transactions': [{'amount': {'total': '10.00', 'currency': 'USD'}}]}
+    first = client.post('/api/paypal-pay', json=body)
+    second = client.post('/api/paypal-pay', json=body)
+    other = client.post('/api/paypal-pay', json=dict(body, note='different order'))
+    assert first.json == second.json != other.json
+    paths = [path for path, _, _ in provider.calls]
+    assert paths.count('/v1/oauth2/token') == 1
+    assert paths.count('/v1/payments/payment') == 2
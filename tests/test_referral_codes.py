@@ -0,0 +1,12 @@
+import pytest
+
+from referral_codes import CodeAllocator
+
+
+def test_no_key_means_no_codes(A, monkeypatch):
+    monkeypatch.delenv('REFERRAL_CODE_KEY', raising=False)
+    monkeypatch.delenv('SECRET_KEY')
+    with pytest.raises(RuntimeError):
+        CodeAllocator.for_db(A.db)
+    with pytest.raises(RuntimeError):
+        A.configure_app()
@@ -0,0 +1,78 @@
+import io
+
+from sqlalchemy import literal, select
+
+import ledger
+import user_import
+from conftest import make_user
+
+
+def snapshot(A):
+    c, s = A.ReferralClosure, A.ReferralStats
+    return (A.db.session.execute(select(c.ancestor_id, c.descendant_id, c.depth)
+                                 .order_by(c.ancestor_id, c.descendant_id)).all(),
+            A.db.session.execute(select(s.ancestor_id, s.depth, s.members, s.earnings)
+                                 .order_by(s.ancestor_id, s.depth)).all())
+
+
+def test_incremental_tree_matches_rebuild(A):
+    a = make_user(A, 'a@example.com')
+    b = make_user(A, 'b@example.com', referrer_code='a')
+    c = make_user(A, 'c@example.com', referrer_code='b')
+    d = make_user(A, 'd@example.com', referrer_code='a')
+    with A.app.app_context():
+        graph = A.referrals
+        for user_id, referrer in ((a, None), (b, a), (c, b), (d, a)):
+            graph.add_user(user_id, referrer)
+        for user_id, amount, kind in ((c, 5.0, 'freeplay'), (b, 2.0, 'bonus'), (d, 1.5, 'freeplay')):
+            ledger.credit(A.db, A.User, A.Transaction, user_id, amount, kind)
+            graph.add_earnings(user_id, amount)
+        # Adopted balances are not earnings; rebuild must not count them either
+        ledger.adopt(A.db, A.Transaction, [(c, 100.0, 0.0)])
+        A.db.session.commit()
+        incremental = snapshot(A)
+        graph.rebuild(A.Transaction)
+        assert snapshot(A) == incremental
+        assert graph.subtree(a) == {"members": 3, "earnings": 8.5, "levels": [
+            {"depth": 1, "members": 2, "earnings": 3.5}, {"depth": 2, "members": 1, "earnings": 5.0}]}
+
+
+def test_referral_cycles_are_ignored(A):
+    # x names y as referrer and y names x: only the earlier account can refer
+    rows = (b"email,password,referral_code,referrer_code\n"
+            b"x@example.com,pw,X,Y\ny@example.com,pw,Y,X\nz@example.com,pw,Z,Y\n")
+    with A.app.app_context():
+        report = A.importer.run(user_import.iter_records(io.BytesIO(rows), 'csv'))
+        assert report['created'] == 3
+        incremental = snapshot(A)
+        closure, _ = incremental
+        assert all(depth == 0 for ancestor, descendant, depth in closure if ancestor == descendant)
+        ids = dict(A.db.session.execute(select(A.User.referral_code, A.User.id)).all())
+        assert (ids['X'], ids['Y'], 1) in closure and (ids['Y'], ids['X'], 1) not in closure
+        assert (ids['X'], ids['Z'], 2) in closure
+        A.referrals.rebuild(A.Transaction)  # terminates despite the cycle in referrer_code
+        assert snapshot(A) == incremental
+
+
+def test_losing_the_stats_row_race_is_harmless(A):
+    a = make_user(A, 'a@example.com')
+    with A.app.app_context():
+        A.db.session.add(A.ReferralStats(ancestor_id=a, depth=1, members=1, earnings=0.0))
+        A.db.session.flush()
+        # What a concurrent first referral does after its NOT EXISTS missed the row
+        A.db.session.execute(A.referrals._insert_missing(
+            select(literal(a), literal(1), literal(0), literal(0.0)).where(literal(True))))
+        A.db.session.commit()
+        assert A.referrals.subtree(a)["members"] == 1
+
+
+def test_referrer_without_paths_does_not_break_import(A):
+    # A user from before the closure table, until rebuild-referrals runs
+    make_user(A, 'old@example.com', referral_code='old1700000000')
+    rows = b"email,password,referrer_code\nnew@example.com,pw,old1700000000\n"
+    with A.app.app_context():
+        report = A.importer.run(user_import.iter_records(io.BytesIO(rows), 'csv'))
+        assert report['created'] == 1
+        A.referrals.rebuild(A.Transaction)
+        old = A.db.session.scalar(select(A.User.id).where(A.User.email == 'old@example.com'))
+        assert A.referrals.subtree(old)['members'] == 1
@@ -0,0 +1,62 @@
+from sqlalchemy import inspect, text, update
+
+from conftest import login, make_user
+
+# The user table as the first release created it
+OLD_USER = '''CREATE TABLE user (
+    id INTEGER PRIMARY KEY, email VARCHAR(150) NOT NULL UNIQUE, password VARCHAR(150) NOT NULL,
+    referral_code VARCHAR(50) UNIQUE, referrer_code VARCHAR(50), balance FLOAT, date_created DATETIME)'''
+
+
+def downgrade(A):
+    with A.db.engine.begin() as conn:
+        conn.execute(text("DROP TABLE user"))
+        conn.execute(text("DROP TABLE user_search_vocab"))
+        conn.execute(text("DROP TABLE user_search"))
+        conn.execute(text(OLD_USER))
+        conn.execute(text("INSERT INTO user (email, password, referral_code, balance, date_created) "
+                          "VALUES ('old@example.com', '-', 'OLD', 5.0, '2024-01-01 00:00:00')"))
+        conn.execute(text("DROP INDEX ix_kyc_submission_id_file_hash"))
+        conn.execute(text("ALTER TABLE kyc_submission DROP COLUMN id_file_hash"))
+        conn.execute(text("DROP TABLE job"))
+
+
+def test_upgrade_adds_missing_columns_and_indexes(A):
+    with A.app.app_context():
+        downgrade(A)
+        runner = A.app.test_cli_runner()
+        result = runner.invoke(args=['upgrade-db'])
+        assert result.exit_code == 0, result.output
+        assert 'ADD COLUMN version_id INTEGER NOT NULL DEFAULT 1' in result.output
+
+        schema = inspect(A.db.engine)
+        assert {'version_id', 'updated_at', 'email_confirmed_at'} <= {c['name'] for c in schema.get_columns('user')}
+        assert 'ix_user_updated_at' in {i['name'] for i in schema.get_indexes('user')}
+        assert 'ix_kyc_submission_id_file_hash' in {i['name'] for i in schema.get_indexes('kyc_submission')}
+        assert schema.has_table('job')
+
+        user = A.db.session.scalar(A.db.select(A.User))
+        assert (user.version_id, user.updated_at) == (1, user.date_created)
+        user.balance = 6.0
+        A.db.session.commit()
+        assert user.version_id == 2
+        assert A.user_search.search('old')  # the search index was rebuilt over the new table
+
+        again = runner.invoke(args=['upgrade-db'])
+        assert again.output == "Schema up to date.\n"
+
+
+def test_cache_drops_rows_written_by_another_process(A, client, monkeypatch):
+    user_id = make_user(A)
+    login(client, user_id)
+    monkeypatch.setattr(A.user_cache, 'sync_interval', 3600)
+    assert client.get('/api/user-info').json['balance'] == 0.0
+    client.get('/api/user-info')  # a sync with the row cached
+    with A.app.app_context():
+        # What the job worker's bonus credit does, without this process's cache
+        A.db.session.execute(update(A.User).where(A.User.id == user_id)
+                             .values(balance=25.0, version_id=A.User.version_id + 1))
+        A.db.session.commit()
+    assert client.get('/api/user-info').json['balance'] == 0.0  # cached until the next sync
+    monkeypatch.setattr(A.user_cache, 'sync_interval', 0)
+    assert client.get('/api/user-info').json['balance'] == 25.0
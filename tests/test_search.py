@@ -0,0 +1,74 @@
+import pytest
+from sqlalchemy import insert
+
+from conftest import login, make_user
+
+
+@pytest.fixture
+def admin(A, client):
+    login(client, make_user(A, 'admin@example.com'))
+    return client
+
+
+def add_kyc(A, *rows):
+    with A.app.app_context():
+        A.db.session.execute(insert(A.KYCSubmission.__table__), [
+            dict(full_name=name, email=email, country=country, date='2026-01-01')
+            for name, email, country in rows])
+        A.db.session.commit()
+
+
+def search(client, q, **params):
+    response = client.get('/api/admin/search', query_string=dict(params, q=q))
+    assert response.status_code == 200, response.json
+    return response.json['results']
+
+
+def test_older_exact_match_outranks_newer_prefix_matches(A, admin):
+    add_kyc(A, ('John Smith', 'js@example.com', 'US'))
+    # More than a rank window of newer rows that "john" only prefixes
+    add_kyc(A, *[(f'Johnson {i}', f'j{i}@example.com', 'US') for i in range(250)])
+    results = search(admin, 'john', limit=5)
+    assert results[0]['full_name'] == 'John Smith'
+    assert results[0]['score'] > results[1]['score']
+
+
+def test_prefix_expansion_and_top_tier(A, admin):
+    add_kyc(A, ('Mary States', 'm1@example.com', 'US'),
+            ('Mary Statesboro', 'm2@example.com', 'US'),
+            ('Mary Other', 'm0@example.com', 'Statesland'),
+            ('Marion Stat', 'm3@example.com', 'FR'))
+    names = [r['full_name'] for r in search(admin, 'mary state')]
+    assert sorted(names) == ['Mary Other', 'Mary States', 'Mary Statesboro']
+    names = [r['full_name'] for r in search(admin, 'mary states')]
+    # A whole word beats a prefix; a name beats a country
+    assert names == ['Mary States', 'Mary Statesboro', 'Mary Other']
+    assert [r['full_name'] for r in search(admin, 'mary states', limit=1)] == ['Mary States']
+
+
+def test_index_follows_updates_and_deletes(A, admin):
+    add_kyc(A, ('Zoë Ångström', 'z@example.com', 'SE'))
+    assert [r['full_name'] for r in search(admin, 'zoe angstrom')] == ['Zoë Ångström']
+    with A.app.app_context():
+        row = A.db.session.scalar(A.db.select(A.KYCSubmission))
+        row.full_name = 'Zed Example'
+        A.db.session.commit()
+        assert search(admin, 'zoe') == []
+        assert len(search(admin, 'zed')) == 1
+        A.db.session.delete(row)
+        A.db.session.commit()
+    assert search(admin, 'zed') == []
+
+
+def test_user_table_is_searchable(A, admin):
+    make_user(A, 'someone@example.com')
+    results = search(admin, 'someone', type='users')
+    assert [r['email'] for r in results] == ['someone@example.com']
+
+
+def test_identifiers_are_quoted(A):
+    from sqlalchemy.dialects import postgresql, sqlite
+    ddl = ' '.join(A.user_search._sqlite_ddl(sqlite.dialect().identifier_preparer.quote))
+    assert 'ON user ' in ddl  # not reserved on SQLite
+    tiers = A.user_search._postgres_tiers(postgresql.dialect().identifier_preparer.quote, ['x'])
+    assert all('FROM "user"' in sql for sql, _ in tiers)
@@ -0,0 +1,40 @@
+import json
+import os
+import subprocess
+import sys
+
+import startup_profile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+LOADED = """
+import json, sys
+import app
+before = {name: name in sys.modules for name in ('payments', 'stripe', 'analytics', 'numpy')}
+app.warm_up(app.app)
+after = {name: name in sys.modules for name in ('payments', 'analytics')}
+print(json.dumps([before, after]))
+"""
+
+
+def loaded(**env):
+    proc = subprocess.run([sys.executable, '-c', LOADED], cwd=ROOT, env=dict(os.environ, **env),
+                          capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def test_payments_and_analytics_load_on_first_use():
+    before, after = loaded(WARM_UP_IMPORTS='0')
+    assert not any(before.values())
+    assert after == {'payments': False, 'analytics': False}
+    _, after = loaded(WARM_UP_IMPORTS='1')
+    assert after == {'payments': True, 'analytics': True}
+
+
+def test_profile_lists_the_app_modules_imports():
+    rows = startup_profile.children(startup_profile.import_times())
+    names = [name for _, _, _, name in rows]
+    assert names[-1] == 'app' and 'flask' in names
+    assert 'payments' not in names
+    result = startup_profile.cold_start()
+    assert result['status'] == 200 and result['total'] >= result['import']
@@ -0,0 +1,52 @@
+import gzip
+import re
+import shutil
+
+import pytest
+
+from conftest import login, make_user
+
+
+@pytest.fixture
+def static(A, tmp_path, monkeypatch):
+    """A scratch copy of static/, so tests can change and precompress it."""
+    folder = tmp_path / 'static'
+    shutil.copytree(A.static_assets.folder, folder)
+    monkeypatch.setattr(A.static_assets, 'folder', str(folder))
+    return folder
+
+
+def stylesheet(client):
+    resp = client.get('/freeplay')
+    assert resp.status_code == 200
+    return re.search(r'href="(/static/css/freeplay\.[0-9a-f]{10}\.css)"', resp.text).group(1)
+
+
+def test_pages_render_once_per_context(A, client):
+    first = client.get('/').text
+    assert client.get('/').text == first
+    assert A.render_cache.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+
+def test_fingerprinted_url_is_immutable_and_precompressed(A, client, static):
+    login(client, make_user(A))
+    url = stylesheet(client)
+    resp = client.get(url)
+    assert resp.status_code == 200 and 'immutable' in resp.headers['Cache-Control']
+    assert resp.data == (static / 'css' / 'freeplay.css').read_bytes()
+
+    assert A.app.test_cli_runner().invoke(args=['build-assets']).exit_code == 0
+    resp = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(resp.data) == (static / 'css' / 'freeplay.css').read_bytes()
+    assert 'Accept-Encoding' in resp.headers['Vary']
+
+
+def test_changed_asset_drops_cached_pages(A, client, static):
+    login(client, make_user(A))
+    old = stylesheet(client)
+    with open(static / 'css' / 'freeplay.css', 'a') as f:
+        f.write('.code-box { color: #fff; }\n')
+    assert client.get(old).status_code == 404  # a browser still holding the old page
+    assert A.render_cache.stats()['size'] == 0
+    assert stylesheet(client) != old
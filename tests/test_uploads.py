@@ -0,0 +1,53 @@
+import io
+import os
+
+PDF = b'%PDF-1.4\n' + b'x' * 5000 + b'\n%%EOF\n'
+
+
+def upload(client, data, name='id.pdf', **fields):
+    form = dict({'full_name': 'Ada Lovelace', 'email': 'ada@example.com', 'country': 'UK'}, **fields)
+    form['id_file'] = (io.BytesIO(data), name)
+    return client.post('/api/kyc', data=form, content_type='multipart/form-data')
+
+
+def stored_files(A):
+    root = A.kyc_store.root
+    return sorted(os.path.join(d, f) for d, _, files in os.walk(root)
+                  if os.path.relpath(d, root).split(os.sep)[0] not in ('tmp', 'previews') for f in files)
+
+
+def test_identical_documents_are_stored_once(A, client):
+    before = stored_files(A)
+    first, second = upload(client, PDF), upload(client, PDF, name='other-name.pdf')
+    assert (first.status_code, second.status_code) == (201, 201)
+    # Nothing in the response tells the caller the second was a duplicate
+    assert set(first.json) == set(second.json) == {'id'}
+    assert first.json['id'] != second.json['id']
+    assert len(stored_files(A)) == len(before) + 1
+    with A.app.app_context():
+        a, b = (A.db.session.get(A.KYCSubmission, r.json['id']) for r in (first, second))
+        assert a.id_file == b.id_file and a.id_file_hash == b.id_file_hash
+    assert os.listdir(A.kyc_store.tmp_dir) == []
+
+
+def test_content_type_is_sniffed_not_trusted(A, client):
+    response = upload(client, b'MZ\x90\x00 not a document', name='passport.pdf')
+    assert response.status_code == 400
+    assert os.listdir(A.kyc_store.tmp_dir) == []
+
+
+def test_oversized_upload_is_rejected_while_streaming(A, client, monkeypatch):
+    monkeypatch.setattr(A.kyc_store, 'max_bytes', 1024)
+    response = upload(client, PDF + b' ' * 60 * 1024)
+    assert response.status_code == 413
+    assert os.listdir(A.kyc_store.tmp_dir) == []
+
+
+def test_document_requires_admin(A, client):
+    from conftest import login, make_user
+    submission_id = upload(client, PDF).json['id']
+    login(client, make_user(A, 'someone@example.com'))
+    assert client.get(f'/api/kyc/{submission_id}/file').status_code == 403
+    login(client, make_user(A, 'admin@example.com'))
+    response = client.get(f'/api/kyc/{submission_id}/file')
+    assert response.status_code == 200 and response.data == PDF
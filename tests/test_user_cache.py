@@ -0,0 +1,25 @@
+from sqlalchemy import update
+
+from conftest import make_user
+
+
+def test_concurrent_write_is_a_conflict_not_an_error(A, client, monkeypatch):
+    user_id = make_user(A, 'race@example.com', 'pw')
+    with A.app.app_context():
+        A.user_cache.put(A.user_cache.snapshot(A.db.session.get(A.User, user_id)))
+    users = A.User.__table__
+
+    def check_password(self, password):
+        # Login rehashes the password while another worker credits the account
+        self.password = 'rehashed'
+        with A.db.engine.begin() as conn:
+            conn.execute(update(users).where(users.c.id == user_id).values(version_id=users.c.version_id + 1))
+        return True
+
+    monkeypatch.setattr(A.User, 'check_password', check_password)
+    resp = client.post('/login', data={'email': 'race@example.com', 'password': 'pw'})
+    assert resp.status_code == 409
+    with A.app.app_context():
+        assert A.user_cache.get(A.db.session, user_id) is None
+        user = A.db.session.get(A.User, user_id)
+        assert (user.password != 'rehashed', user.version_id) == (True, 2)
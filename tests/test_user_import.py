@@ -0,0 +1,72 @@
+import io
+import json
+import threading
+
+import jobs
+import user_import
+from passwords import PasswordHasher
+from conftest import login, make_user
+
+
+def test_bad_rows_are_reported_and_skipped(A):
+    records = [{"email": "ok@example.com", "password": "pw"},
+               {"email": 42, "password": "pw"},
+               {"email": "list@example.com", "password": ["pw"]},
+               {"email": "x" * 150 + "@example.com", "password": "pw"},
+               {"email": "code@example.com", "password": "pw", "referral_code": "C" * 51},
+               {"email": "also-ok@example.com", "password": "pw", "referrer_code": "OK"}]
+    body = "\n".join(json.dumps(r) for r in records).encode()
+    with A.app.app_context():
+        report = A.importer.run(user_import.iter_records(io.BytesIO(body), 'jsonl'))
+    assert (report['rows'], report['created'], report['failed']) == (6, 2, 4)
+    assert [(e['line'], e['error']) for e in report['errors']] == [
+        (2, "email must be a string"), (3, "password must be a string"),
+        (4, "email longer than 150 characters"), (5, "referral_code longer than 50 characters")]
+
+
+def test_codes_shaped_like_generated_ones_are_refused(A):
+    with A.app.app_context():
+        generated = A.code_allocator.allocate()
+        records = [{"email": "a@example.com", "password": "pw", "referral_code": generated},
+                   {"email": "b@example.com", "password": "pw", "referral_code": "ZZZZZZZZ"},
+                   {"email": "c@example.com", "password": "pw", "referral_code": "bob1700000000"},
+                   {"email": "d@example.com", "password": "pw"}]
+        body = "\n".join(json.dumps(r) for r in records).encode()
+        report = A.importer.run(user_import.iter_records(io.BytesIO(body), 'jsonl'))
+        assert [(e['line'], e['error']) for e in report['errors']] == [
+            (1, "referral code is reserved for generated codes"), (2, "referral code is reserved for generated codes")]
+        codes = dict(A.db.session.execute(A.db.select(A.User.email, A.User.referral_code)).all())
+    assert codes['c@example.com'] == 'bob1700000000'
+    assert len(codes['d@example.com']) == 8 and codes['d@example.com'] != generated
+
+
+def test_admin_import_is_queued_and_leaves_no_upload_behind(A, client, monkeypatch):
+    login(client, make_user(A, 'admin@example.com'))
+    monkeypatch.setattr(A, 'JOB_DATA_CHUNK_BYTES', 7)  # rows split across stored chunks
+    body = ("email,password,referral_code,referrer_code\n"
+            "new1@example.com,pw,new1code,\nnew2@example.com,pw,,new1code\nbad,pw,,\n")
+    resp = client.post('/api/admin/import-users', data={'file': (io.BytesIO(body.encode()), 'users.csv')})
+    assert resp.status_code == 202
+    status_url = resp.json['status_url']
+    assert client.get(status_url).json['status'] == 'queued'
+    with A.app.app_context():
+        assert A.db.session.scalar(A.db.select(A.db.func.count()).select_from(A.User)) == 1
+
+    assert jobs.Worker(A.job_queue, A.app, name='test-worker').drain() == 1
+    report = client.get(status_url)
+    assert report.status_code == 200
+    assert (report.json['rows'], report.json['created'], report.json['failed']) == (3, 2, 1)
+    assert report.json['errors'][0]['line'] == 4
+    with A.app.app_context():
+        assert A.db.session.scalar(A.db.select(A.db.func.count()).select_from(A.JobData)) == 0
+        emails = set(A.db.session.scalars(A.db.select(A.User.email)))
+    assert {'new1@example.com', 'new2@example.com'} <= emails
+
+
+def test_bulk_hashing_uses_a_bounded_pool(monkeypatch):
+    seen = set()
+    hasher = PasswordHasher(method='pbkdf2:sha256:1000', bulk_workers=2)
+    monkeypatch.setattr('passwords.generate_password_hash',
+                        lambda p, method: seen.add(threading.current_thread().name) or p)
+    assert hasher.hash_many([str(i) for i in range(200)]) == [str(i) for i in range(200)]
+    assert len(seen) <= 2
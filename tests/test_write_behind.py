@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from flask import Flask
+
+import jobs
+from conftest import make_user
+from write_behind import WriteBehindQueue
+
+
+def test_a_bad_item_fails_alone():
+    flushes = []
+
+    def flush(items):
+        flushes.append(list(items))
+        if any(item < 0 for item in items):
+            raise ValueError("negative")
+        return [item * 2 for item in items]
+
+    queue = WriteBehindQueue(flush, Flask(__name__), mode='group', max_delay=60)
+    futures = [queue.submit(item) for item in (1, 2, -3, 4, 5)]
+    queue.flush()
+    assert [f.exception() is None and f.result() for f in futures[:2] + futures[3:]] == [2, 4, 8, 10]
+    assert isinstance(futures[2].exception(), ValueError)
+    assert queue.stats()['failed'] == 1 and queue.stats()['flushed'] == 4
+    assert flushes[0] == [1, 2, -3, 4, 5] and [-3] in flushes
+    queue.close()
+
+
+def test_failed_async_claims_become_jobs(A, monkeypatch):
+    user_id = make_user(A, 'a@example.com')
+    writer = A.freeplay_writer
+    monkeypatch.setattr(writer, 'mode', 'async')
+    monkeypatch.setattr(writer, 'max_delay', 60)
+    for claimant in (user_id, user_id + 1):  # the second user doesn't exist yet
+        writer.submit({"user_id": claimant, "referral_code": "a", "reward": 10.0, "timestamp": datetime.utcnow()})
+    writer.flush()
+    with A.app.app_context():
+        assert A.db.session.get(A.User, user_id).balance == 10.0
+        job = A.db.session.scalar(A.db.select(A.Job).filter_by(kind='freeplay_claim'))
+        assert job.status == jobs.QUEUED
+    assert writer.stats()['last_error'].startswith('NoResultFound')
+
+    late = make_user(A, 'b@example.com')
+    assert late == user_id + 1
+    assert jobs.Worker(A.job_queue, A.app, name='test-worker').drain() == 1
+    with A.app.app_context():
+        assert A.db.session.get(A.User, late).balance == 10.0
+        assert A.db.session.get(A.Job, job.id).status == jobs.DONE
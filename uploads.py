@@ -0,0 +1,217 @@
+"""Streaming, content-addressed uploads.
+
+``parse_multipart`` feeds the request body through Werkzeug's sans-IO
+multipart decoder a chunk at a time, so file parts go straight from the
+socket into a ``ContentStore`` sink: written to a temp file and hashed as
+they arrive, never held whole in memory. The finished file is moved to
+``<root>/<sha256[:2]>/<sha256><ext>``; an identical upload finds the file
+already there and the new copy is dropped.
+
+Thumbnails and previews are rendered with Pillow by ``PreviewPool`` in
+separate processes, off the request path.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp', 'application/pdf': '.pdf'}
+IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/webp'}
+PREVIEW_SIZES = (('thumb', 256), ('preview', 1280))
+
+
+class UploadError(Exception):
+    status = 400
+
+
+class UploadTooLarge(UploadError):
+    status = 413
+
+
+def sniff(head):
+    # Trust the bytes, not the client's filename or Content-Type.
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head.startswith(b'%PDF-'):
+        return 'application/pdf'
+    return None
+
+
+class StoredFile:
+    def __init__(self, digest, path, size, mimetype, existed):
+        self.digest = digest
+        self.path = path  # relative to the store root
+        self.size = size
+        self.mimetype = mimetype
+        self.existed = existed
+
+
+class _Sink:
+    def __init__(self, store):
+        self.store = store
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+        self.file = tempfile.NamedTemporaryFile(dir=store.tmp_dir, delete=False)
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.store.max_bytes:
+            raise UploadTooLarge(f"file exceeds {self.store.max_bytes} bytes")
+        if len(self.head) < 16:
+            self.head += data[:16]
+        self.hash.update(data)
+        self.file.write(data)
+
+    def finish(self):
+        self.file.close()
+        mimetype = sniff(self.head)
+        if mimetype not in self.store.allowed:
+            self.abort()
+            raise UploadError("unsupported file type")
+        digest = self.hash.hexdigest()
+        rel = self.store.relpath(digest, mimetype)
+        dest = os.path.join(self.store.root, rel)
+        existed = os.path.exists(dest)
+        if existed:
+            os.unlink(self.file.name)
+        else:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(self.file.name, dest)  # same bytes if two uploads race
+        return StoredFile(digest, rel, self.size, mimetype, existed)
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.unlink(self.file.name)
+        except FileNotFoundError:
+            pass
+
+
+class ContentStore:
+    def __init__(self, root, max_bytes=10 * 1024 * 1024, allowed=tuple(EXTENSIONS)):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.allowed = set(allowed)
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def relpath(self, digest, mimetype):
+        return f"{digest[:2]}/{digest}{EXTENSIONS[mimetype]}"
+
+    def lookup(self, rel):
+        ext = os.path.splitext(rel)[1]
+        mimetype = next((m for m, e in EXTENSIONS.items() if e == ext), None)
+        if mimetype is None or not os.path.exists(self.abspath(rel)):
+            return None
+        return StoredFile(os.path.basename(rel)[:-len(ext)], rel, None, mimetype, True)
+
+    def abspath(self, rel):
+        return os.path.join(self.root, rel)
+
+    def preview_path(self, digest, name):
+        return os.path.join(self.root, 'previews', f"{digest}-{name}.jpg")
+
+    def sink(self):
+        return _Sink(self)
+
+
+def parse_multipart(stream, boundary, store, max_field_bytes=64 * 1024, max_parts=20):
+    """Returns ({field: str}, {field: StoredFile}). Sinks of a failed parse
+    are removed; files already stored stay (another request may share them)."""
+    decoder = MultipartDecoder(boundary.encode(), max_form_memory_size=max_field_bytes, max_parts=max_parts)
+    fields, files = {}, {}
+    name, sink, buf = None, None, []
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, File):
+                    name, sink = event.name, store.sink()
+                elif isinstance(event, Field):
+                    name, sink, buf = event.name, None, []
+                elif isinstance(event, Data):
+                    if sink is not None:
+                        sink.write(event.data)
+                        if not event.more_data:
+                            files[name], sink = sink.finish(), None
+                    else:
+                        buf.append(event.data)
+                        if not event.more_data:
+                            fields[name] = b''.join(buf).decode('utf-8', 'replace')
+                event = decoder.next_event()
+            if isinstance(event, Epilogue) or not chunk:
+                break
+    except Exception:
+        if sink is not None:
+            sink.abort()
+        raise
+    if sink is not None:
+        sink.abort()
+        raise UploadError("truncated multipart body")
+    return fields, files
+
+
+def render_previews(src, targets):
+    # Runs in a pool process: one decode, one resize per (path, size).
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as im:
+        im.draft('RGB', (max(size for _, size in targets),) * 2)  # cheap JPEG downscale
+        im = ImageOps.exif_transpose(im).convert('RGB')
+        for path, size in targets:
+            out = im.copy()
+            out.thumbnail((size, size))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            out.save(tmp, 'JPEG', quality=82, optimize=True)
+            os.replace(tmp, path)
+    return [path for path, _ in targets]
+
+
+class PreviewPool:
+    """Process pool for Pillow work. Created lazily (and again after a
+    fork) with the spawn start method, so no worker inherits gunicorn's
+    threads or sockets."""
+
+    def __init__(self, store, workers=2, sizes=PREVIEW_SIZES):
+        self.store = store
+        self.workers = workers
+        self.sizes = sizes
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+                self._pid = os.getpid()
+            return self._pool
+
+    def pending(self, stored):
+        return stored.mimetype in IMAGE_TYPES and not all(
+            os.path.exists(self.store.preview_path(stored.digest, name)) for name, _ in self.sizes)
+
+    def submit(self, stored):
+        if not self.pending(stored):
+            return None
+        targets = [(self.store.preview_path(stored.digest, name), size) for name, size in self.sizes]
+        fut = self._executor().submit(render_previews, self.store.abspath(stored.path), targets)
+        fut.add_done_callback(lambda f: f.exception() and log.warning(
+            "preview failed for %s: %s", stored.digest, f.exception()))
+        return fut
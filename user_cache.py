@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import make_transient_to_detached
+
+
+class IdentityCache:
+    """Bounded LRU/TTL cache of user rows for the Flask-Login user_loader.
+
+    Entries are column snapshots tagged with the row's ``version_id``. The
+    caller passes the minimum version it is willing to accept (the version
+    the client last wrote, carried in its session), so a worker never
+    serves a row older than that user's own last committed write.
+
+    Writes from other processes are caught by ``sync``: at most every
+    ``sync_interval`` seconds it reads the (id, version_id) of rows whose
+    ``updated_at`` moved since the previous sync and drops the entries
+    they make stale. ``slack`` seconds of overlap cover clock skew between
+    hosts and transactions that commit a while after stamping the row.
+    """
+
+    def __init__(self, model, maxsize=1024, ttl=60.0, sync_interval=2.0, slack=10.0):
+        self.model = model
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self.slack = slack
+        self._synced_at = None  # monotonic
+        self._since = None  # updated_at watermark for the next sync
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._rows = OrderedDict()
+        self._columns = [c.key for c in inspect(model).column_attrs]
+
+    def snapshot(self, obj):
+        return {key: getattr(obj, key) for key in self._columns}
+
+    def get(self, session, user_id, min_version=None):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._rows.get(user_id)
+            if hit and now - hit[1] < self.ttl and (min_version is None or hit[0]['version_id'] >= min_version):
+                self._rows.move_to_end(user_id)
+                self.hits += 1
+                values = hit[0]
+            else:
+                self.misses += 1
+                values = None
+        if values is None:
+            return None
+        obj = self.model(**values)
+        make_transient_to_detached(obj)
+        # load=False attaches the snapshot as a persistent instance without
+        # a SELECT; later changes flush as a versioned UPDATE.
+        return session.merge(obj, load=False)
+
+    def sync(self, session):
+        now = time.monotonic()
+        with self._lock:
+            if self._synced_at is not None and now - self._synced_at < self.sync_interval:
+                return
+            self._synced_at = now
+            since, self._since = self._since, datetime.utcnow() - timedelta(seconds=self.slack)
+            if since is None or not self._rows:
+                return
+        model = self.model
+        rows = session.execute(select(model.id, model.version_id).where(model.updated_at >= since)).all()
+        with self._lock:
+            for user_id, version in rows:
+                hit = self._rows.get(user_id)
+                if hit and hit[0]['version_id'] != version:
+                    del self._rows[user_id]
+
+    def put(self, values):
+        with self._lock:
+            self._rows[values['id']] = (values, time.monotonic())
+            self._rows.move_to_end(values['id'])
+            while len(self._rows) > self.maxsize:
+                self._rows.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._rows.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._synced_at = self._since = None
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._rows)}
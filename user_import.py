@@ -0,0 +1,217 @@
+"""Bulk user import from CSV or JSON Lines.
+
+Records are read as a stream and processed ``chunk_size`` at a time: one
+IN query finds emails (and explicit referral codes) that already exist,
+passwords are hashed in parallel, referral codes are allocated as a
+block, and the surviving rows go in as one executemany. A bad row is
+reported by line number and skipped; it never aborts the batch.
+
+Recognised fields: email, password (required), referral_code (kept when
+given, allocated otherwise) and referrer_code. A given referral_code in
+the allocator's format is refused: it could collide with a code
+allocated later (see referral_codes.py).
+"""
+import csv
+import io
+import json
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import DataError, IntegrityError
+
+from referral_codes import is_generated
+
+
+def detect_format(filename=None, mimetype=None):
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')) or mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return 'jsonl'
+    return 'csv'
+
+
+class _ChunkReader(io.RawIOBase):
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buf:
+            self._buf = next(self._chunks, None)
+            if self._buf is None:
+                self._buf = b''
+                return 0
+        n = min(len(b), len(self._buf))
+        b[:n], self._buf = self._buf[:n], self._buf[n:]
+        return n
+
+
+def chunk_stream(chunks):
+    """Binary stream over an iterable of bytes, e.g. an upload stored in
+    pieces."""
+    return io.BufferedReader(_ChunkReader(chunks))
+
+
+def iter_records(stream, fmt='csv'):
+    """Yields (line, dict-or-error) from a binary or text stream."""
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'jsonl':
+        for line, text in enumerate(stream, 1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as e:
+                yield line, ValueError(f"invalid JSON: {e}")
+                continue
+            yield line, record if isinstance(record, dict) else ValueError("expected a JSON object")
+    else:
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+
+
+def _chunks(records, size):
+    chunk = []
+    for item in records:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class UserImporter:
+    def __init__(self, db, user_model, hasher, allocator, referrals=None, chunk_size=1000, max_errors=1000):
+        self.db = db
+        self.user_model = user_model
+        self.hasher = hasher
+        self.allocator = allocator
+        self.referrals = referrals
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        # Checked per row up front: on Postgres an over-long value would
+        # otherwise fail the whole executemany
+        self.lengths = {name: user_model.__table__.c[name].type.length
+                        for name in ('email', 'referral_code', 'referrer_code')}
+
+    def run(self, records):
+        report = {"rows": 0, "created": 0, "failed": 0, "errors": []}
+        seen_emails, seen_codes = set(), set()
+        for chunk in _chunks(records, self.chunk_size):
+            report["rows"] += len(chunk)
+            rows = self._validate(chunk, seen_emails, seen_codes, report)
+            if rows:
+                self._insert(rows, report)
+        return report
+
+    def _error(self, report, line, email, message):
+        report["failed"] += 1
+        if len(report["errors"]) < self.max_errors:
+            report["errors"].append({"line": line, "email": email, "error": message})
+
+    def _fields(self, record):
+        # JSON Lines values can be any type; only strings are accepted
+        values = {}
+        for name in ('email', 'password', 'referral_code', 'referrer_code'):
+            value = record.get(name)
+            if value is not None and not isinstance(value, str):
+                raise ValueError(f"{name} must be a string")
+            value = value or ''
+            values[name] = value if name == 'password' else value.strip()
+            limit = self.lengths.get(name)
+            if limit and len(values[name]) > limit:
+                raise ValueError(f"{name} longer than {limit} characters")
+        return values
+
+    def _validate(self, chunk, seen_emails, seen_codes, report):
+        User = self.user_model
+        rows = []
+        for line, record in chunk:
+            if isinstance(record, Exception):
+                self._error(report, line, None, str(record))
+                continue
+            try:
+                fields = self._fields(record)
+            except ValueError as e:
+                email = record.get('email')
+                self._error(report, line, email if isinstance(email, str) else None, str(e))
+                continue
+            email, password, code = fields['email'], fields['password'], fields['referral_code'] or None
+            if not email or '@' not in email:
+                self._error(report, line, email or None, "missing or invalid email")
+            elif not password:
+                self._error(report, line, email, "missing password")
+            elif email in seen_emails:
+                self._error(report, line, email, "duplicate email in import")
+            elif code and code in seen_codes:
+                self._error(report, line, email, "duplicate referral code in import")
+            elif code and is_generated(code):
+                self._error(report, line, email, "referral code is reserved for generated codes")
+            else:
+                seen_emails.add(email)
+                if code:
+                    seen_codes.add(code)
+                rows.append({"line": line, "email": email, "password": password, "referral_code": code,
+                             "referrer_code": fields['referrer_code'] or None})
+        if not rows:
+            return rows
+
+        session = self.db.session
+        taken = set(session.scalars(select(User.email).where(User.email.in_([r["email"] for r in rows]))))
+        codes = [r["referral_code"] for r in rows if r["referral_code"]]
+        taken_codes = set(session.scalars(
+            select(User.referral_code).where(User.referral_code.in_(codes)))) if codes else set()
+        kept = []
+        for r in rows:
+            if r["email"] in taken:
+                self._error(report, r["line"], r["email"], "email already registered")
+            elif r["referral_code"] in taken_codes:
+                self._error(report, r["line"], r["email"], "referral code already in use")
+            else:
+                kept.append(r)
+        return kept
+
+    def _insert(self, rows, report):
+        User = self.user_model
+        session = self.db.session
+        hashes = self.hasher.hash_many([r["password"] for r in rows])
+        fresh = iter(self.allocator.allocate_many(sum(1 for r in rows if not r["referral_code"])))
+        values = [{"email": r["email"], "password": h, "referral_code": r["referral_code"] or next(fresh),
+                   "referrer_code": r["referrer_code"], "balance": 0.0, "version_id": 1}
+                  for r, h in zip(rows, hashes)]
+        try:
+            ids = session.scalars(insert(User).returning(User.id, sort_by_parameter_order=True), values).all()
+        except (IntegrityError, DataError):
+            # Lost a race with a concurrent registration (or a value the
+            # database rejects); fall back to row-at-a-time savepoints to
+            # find the offending rows.
+            session.rollback()
+            ids = []
+            for r, v in zip(rows, values):
+                try:
+                    with session.begin_nested():
+                        ids.append(session.scalar(insert(User).returning(User.id), v))
+                except IntegrityError:
+                    self._error(report, r["line"], r["email"], "email or referral code already in use")
+                    ids.append(None)
+                except DataError as e:
+                    self._error(report, r["line"], r["email"], f"rejected by the database: {e.orig}")
+                    ids.append(None)
+        created = [(user_id, v) for user_id, v in zip(ids, values) if user_id is not None]
+        if self.referrals is not None:
+            self._link(created)
+        session.commit()
+        report["created"] += len(created)
+
+    def _link(self, created):
+        # Referrers may be existing users or earlier rows of this import;
+        # add_users links in file order so a parent always precedes its child.
+        User = self.user_model
+        wanted = {v["referrer_code"] for _, v in created if v["referrer_code"]}
+        by_code = dict(self.db.session.execute(
+            select(User.referral_code, User.id).where(User.referral_code.in_(wanted))).all()) if wanted else {}
+        self.referrals.add_users([(user_id, by_code.get(v["referrer_code"])) for user_id, v in created])
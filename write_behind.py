@@ -0,0 +1,159 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+log = logging.getLogger(__name__)
+
+MODES = ('sync', 'group', 'async')
+
+
+class WriteBehindQueue:
+    """In-process group-commit queue.
+
+    Items are buffered and handed to ``flush_fn`` in batches once
+    ``max_batch`` items are waiting or the oldest has waited ``max_delay``
+    seconds, so one transaction (and one fsync) covers the whole batch.
+
+    ``mode`` is the durability knob:
+
+    - ``sync``: no queueing, callers write inline (the default).
+    - ``group``: callers block on the returned future until their batch is
+      committed; nothing acknowledged can be lost.
+    - ``async``: callers return immediately; a crash loses whatever is
+      still buffered (at most ``max_delay`` worth of writes).
+
+    A failed flush is retried in halves until the failing items are
+    isolated, so one bad item doesn't fail the rest of its batch.
+    Exceptions in ``transient`` (e.g. the database being unreachable) say
+    nothing about the items and fail the batch as a whole. In async mode
+    nobody waits on the futures, so failed items are handed to
+    ``on_failure(items, error)``, which should park them somewhere durable.
+    """
+
+    def __init__(self, flush_fn, app=None, mode='sync', max_batch=200, max_delay=0.05,
+                 on_failure=None, transient=()):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        self.app = app
+        self.flush_fn = flush_fn
+        self.mode = mode
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.on_failure = on_failure
+        self.transient = transient
+        self.last_error = None
+        self.flushed = 0
+        self.batches = 0
+        self.failed = 0
+        self._cond = threading.Condition()
+        self._items = []
+        self._oldest = None
+        self._pid = None
+        self._thread = None
+        self._closed = False
+        atexit.register(self.close)
+
+    def init_app(self, app):
+        # The flusher thread runs ``flush_fn`` inside this app's context.
+        self.app = app
+
+    @property
+    def enabled(self):
+        return self.mode != 'sync'
+
+    @property
+    def depth(self):
+        with self._cond:
+            return len(self._items)
+
+    def submit(self, item):
+        fut = Future()
+        if self._closed:
+            # Shutting down: nobody is left to flush, so write inline.
+            self._write([(item, fut)])
+            return fut
+        with self._cond:
+            self._ensure_thread()
+            if not self._items:
+                self._oldest = time.monotonic()
+            self._items.append((item, fut))
+            # Wake the flusher to start the delay timer or to flush a full batch
+            if len(self._items) == 1 or len(self._items) >= self.max_batch:
+                self._cond.notify()
+        return fut
+
+    def stats(self):
+        with self._cond:
+            return {"mode": self.mode, "depth": len(self._items), "flushed": self.flushed,
+                    "batches": self.batches, "failed": self.failed, "last_error": self.last_error}
+
+    def flush(self):
+        with self._cond:
+            batch, self._items = self._items, []
+        if batch:
+            self._write(batch)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    def _ensure_thread(self):
+        # Started lazily and re-created after fork, where threads don't survive.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if len(self._items) >= self.max_batch:
+                        break
+                    if self._items:
+                        remaining = self.max_delay - (time.monotonic() - self._oldest)
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+                batch, self._items = self._items[:self.max_batch], self._items[self.max_batch:]
+                self._oldest = time.monotonic() if self._items else None
+            self._write(batch)
+
+    def _write(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            with self.app.app_context():
+                results = self.flush_fn(items)
+        except Exception as e:
+            if len(batch) > 1 and not isinstance(e, self.transient):
+                half = len(batch) // 2
+                self._write(batch[:half])
+                self._write(batch[half:])
+                return
+            log.exception("write-behind flush of %d items failed", len(batch))
+            with self._cond:
+                self.failed += len(batch)
+                self.last_error = f"{type(e).__name__}: {e}"[:500]
+            for _, fut in batch:
+                fut.set_exception(e)
+            if self.mode == 'async' and self.on_failure is not None:
+                try:
+                    with self.app.app_context():
+                        self.on_failure(items, e)
+                except Exception:
+                    log.exception("could not keep %d failed write-behind items", len(batch))
+            return
+        with self._cond:
+            self.flushed += len(batch)
+            self.batches += 1
+        for (_, fut), result in zip(batch, results):
+            fut.set_result(result)